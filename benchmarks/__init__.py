@@ -0,0 +1,6 @@
+# Cortex - Benchmarks
+# Offline benchmarks for measuring brainlib performance and quality tradeoffs.
+#
+#   python -m benchmarks                    # latency, throughput and memory per operation
+#   python -m benchmarks.compare a.json b.json
+#   python -m benchmarks.bench_projection   # reduced-dimension quality/speed tradeoffs
@@ -0,0 +1,124 @@
+"""
+Cortex - Projection Benchmark
+
+Measures what reduced-dimension embeddings cost in quality and buy in speed:
+- Cluster agreement (adjusted Rand index) between full and reduced KMeans
+- Recall@k of reduced candidate generation plus exact re-ranking
+- Wall time of each path
+
+Runs fully offline on synthetic embeddings:
+
+    python -m benchmarks.bench_projection --n 10000 --components 64 96 128
+"""
+
+import argparse
+import json
+import sys
+import time
+from typing import List, Dict, Any
+
+import numpy as np
+from sklearn.cluster import KMeans
+from sklearn.metrics import adjusted_rand_score
+from sklearn.preprocessing import StandardScaler
+
+from brainlib.projection import EmbeddingProjector, cosine_top_k, PROJECTION_METHODS
+
+from .synthetic import make_embeddings
+
+
+def recall_at_k(embeddings: np.ndarray, reduced: np.ndarray, projector: EmbeddingProjector,
+                queries: np.ndarray, k: int, rerank_factor: int) -> float:
+    """Fraction of the exact top-k found by reduced candidates plus full re-ranking."""
+    hits = 0
+    for query in queries:
+        exact, _ = cosine_top_k(embeddings, query, k)
+        candidates, _ = cosine_top_k(reduced, projector.transform(query), k * rerank_factor)
+        reranked, _ = cosine_top_k(embeddings[candidates], query, k)
+        hits += len(set(exact.tolist()) & set(candidates[reranked].tolist()))
+    return hits / (k * len(queries))
+
+
+def run(n: int, dim: int, n_topics: int, noise: float, components: List[int], methods: List[str],
+        n_queries: int, k: int, rerank_factor: int, seed: int) -> Dict[str, Any]:
+    """Run the benchmark and return its results."""
+    embeddings = make_embeddings(n, dim, n_topics, noise, seed)
+    rng = np.random.default_rng(seed + 1)
+    queries = embeddings[rng.choice(n, size=min(n_queries, n), replace=False)]
+
+    # Full-dimension path, as in BrainClusterer.get_clusters
+    start = time.perf_counter()
+    scaled = StandardScaler().fit_transform(embeddings)
+    full_labels = KMeans(n_clusters=n_topics, random_state=42, n_init=10).fit_predict(scaled)
+    full_cluster_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for query in queries:
+        cosine_top_k(embeddings, query, k)
+    full_search_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    results = []
+    for method in methods:
+        for n_components in components:
+            start = time.perf_counter()
+            projector = EmbeddingProjector(method, n_components).fit(embeddings)
+            reduced = projector.transform(embeddings)
+            fit_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            reduced_labels = KMeans(n_clusters=n_topics, random_state=42, n_init=10).fit_predict(reduced)
+            cluster_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for query in queries:
+                candidates, _ = cosine_top_k(reduced, projector.transform(query), k * rerank_factor)
+                cosine_top_k(embeddings[candidates], query, k)
+            search_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+            results.append({
+                "method": method,
+                "n_components": projector.n_components,
+                "fit_seconds": round(fit_seconds, 4),
+                "cluster_seconds": round(cluster_seconds, 4),
+                "cluster_speedup": round(full_cluster_seconds / cluster_seconds, 2),
+                "adjusted_rand_index": round(float(adjusted_rand_score(full_labels, reduced_labels)), 4),
+                "search_ms": round(search_ms, 4),
+                f"recall_at_{k}": round(recall_at_k(embeddings, reduced, projector, queries, k, rerank_factor), 4)
+            })
+
+    return {
+        "benchmark": "projection",
+        "n": n,
+        "dim": dim,
+        "n_topics": n_topics,
+        "full": {
+            "cluster_seconds": round(full_cluster_seconds, 4),
+            "search_ms": round(full_search_ms, 4)
+        },
+        "reduced": results
+    }
+
+
+def main(argv: List[str] = None) -> None:
+    """Parse arguments, run the benchmark and print JSON results."""
+    parser = argparse.ArgumentParser(description="Benchmark reduced-dimension embeddings against full vectors")
+    parser.add_argument("--n", type=int, default=10000, help="number of synthetic notes")
+    parser.add_argument("--dim", type=int, default=384, help="full embedding dimension")
+    parser.add_argument("--topics", type=int, default=10, help="number of synthetic topics (and KMeans k)")
+    parser.add_argument("--noise", type=float, default=1.5, help="spread of notes around their topic")
+    parser.add_argument("--components", type=int, nargs="+", default=[64, 96, 128])
+    parser.add_argument("--methods", nargs="+", default=list(PROJECTION_METHODS), choices=PROJECTION_METHODS)
+    parser.add_argument("--queries", type=int, default=100, help="number of similarity queries")
+    parser.add_argument("--k", type=int, default=10, help="results per query")
+    parser.add_argument("--rerank-factor", type=int, default=10, help="candidates re-ranked per result")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    results = run(args.n, args.dim, args.topics, args.noise, args.components, args.methods,
+                  args.queries, args.k, args.rerank_factor, args.seed)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
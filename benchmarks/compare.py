@@ -0,0 +1,88 @@
+"""
+Cortex - Benchmark Comparison
+
+Compares two benchmark result files, e.g. from two commits:
+
+    python -m benchmarks.compare baseline.json candidate.json --threshold 0.1
+
+Exits with status 1 if any operation got slower, lost throughput or used
+more memory by more than the threshold.
+"""
+
+import argparse
+import json
+import sys
+from typing import List, Dict, Any, Tuple
+
+# Metric name and whether a higher value is better
+METRICS = (
+    ("p50_ms", False),
+    ("p99_ms", False),
+    ("throughput_per_s", True),
+    ("peak_rss_mb", False)
+)
+
+
+def _index(results: Dict[str, Any]) -> Dict[Tuple[str, int], Dict[str, Any]]:
+    """Key result rows by (operation, scale)."""
+    return {(result["operation"], result["scale"]): result for result in results["results"]}
+
+
+def compare(baseline: Dict[str, Any], candidate: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """
+    Compare every metric of every operation present in both result sets.
+
+    Returns:
+        One row per operation and metric with the relative change and
+        whether it counts as a regression
+    """
+    rows = []
+    old = _index(baseline)
+    new = _index(candidate)
+    for key in sorted(old.keys() & new.keys()):
+        for metric, higher_is_better in METRICS:
+            before = old[key].get(metric)
+            after = new[key].get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            regression = -change > threshold if higher_is_better else change > threshold
+            rows.append({
+                "operation": key[0],
+                "scale": key[1],
+                "metric": metric,
+                "baseline": before,
+                "candidate": after,
+                "change": round(change, 4),
+                "regression": regression
+            })
+    return rows
+
+
+def main(argv: List[str] = None) -> None:
+    """Print a comparison table and exit non-zero on regressions."""
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change counted as a regression")
+    parser.add_argument("--json", action="store_true", help="print rows as JSON")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as baseline_file, open(args.candidate) as candidate_file:
+        rows = compare(json.load(baseline_file), json.load(candidate_file), args.threshold)
+
+    if args.json:
+        json.dump(rows, sys.stdout, indent=2)
+        print()
+    else:
+        for row in rows:
+            flag = "REGRESSION" if row["regression"] else ""
+            print(f"{row['operation']:>16} {row['scale']:>8} {row['metric']:>16} "
+                  f"{row['baseline']:>12} -> {row['candidate']:<12} {row['change']:+8.1%} {flag}")
+
+    if any(row["regression"] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+Cortex - Benchmark Runner
+
+Measures how brainlib operations scale with corpus size:
+- Seeds synthetic corpora at each requested scale
+- Times every call of each operation and reports latency percentiles
+- Reports throughput and peak RSS per operation
+- Writes machine-readable JSON for comparing commits
+
+Runs fully offline with a stub encoder and an in-process MongoDB stand-in,
+or against the embedded backend with ``--storage embedded``:
+
+    python -m benchmarks --scales 1000 10000 --output results.json
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Dict, Any, Callable, Iterator, Optional, Tuple
+
+import numpy as np
+
+from brainlib.brain import BrainCore
+from brainlib.cluster import BrainClusterer
+from brainlib.storage import open_backend
+
+from .stubs import StubEncoder, mock_mongo, local_mongod, embedded_store, external_store
+from .synthetic import TOPICS, make_note_texts, make_note_documents, make_pdf
+
+logger = logging.getLogger(__name__)
+
+OPERATIONS = ("store_note", "store_pdf", "get_all_notes", "search", "find_optimal_k", "get_clusters")
+DEFAULT_SCALES = (1000, 10000)
+
+# KMeans over every k and silhouette scoring grow quadratically; beyond these
+# sizes a single run takes minutes, so they are skipped unless --no-limits
+SCALE_LIMITS = {"find_optimal_k": 10000, "get_clusters": 10000}
+
+
+def seed_corpus(db_uri: str, n: int, encoder, seed: int = 0) -> None:
+    """Replace the stored notes with ``n`` synthetic notes and their indexes."""
+    with open_backend(db_uri) as backend:
+        backend.drop()
+        for documents in make_note_documents(n, encoder, seed=seed, model_name="stub"):
+            backend.insert_notes(documents)
+
+
+def _current_rss_mb() -> Optional[float]:
+    """Resident set size of this process right now, where the platform exposes it."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return None
+
+
+def _peak_rss_mb() -> float:
+    """High-water mark of this process's resident set size."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def _measure(calls: List[Callable[[], Any]], items_per_call: float) -> Dict[str, Any]:
+    """Time each call and summarize latencies, throughput and memory."""
+    rss_start = _current_rss_mb()
+    latencies = []
+    for call in calls:
+        start = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    latencies = np.array(latencies)
+    total_seconds = latencies.sum() / 1000
+    return {
+        "calls": len(calls),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p90_ms": round(float(np.percentile(latencies, 90)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        "mean_ms": round(float(latencies.mean()), 3),
+        "max_ms": round(float(latencies.max()), 3),
+        "throughput_per_s": round(items_per_call * len(calls) / total_seconds, 2) if total_seconds > 0 else None,
+        "rss_start_mb": round(rss_start, 1) if rss_start is not None else None,
+        "peak_rss_mb": round(_peak_rss_mb(), 1)
+    }
+
+
+def _child(target: Callable[[], Dict[str, Any]], conn) -> None:
+    """Run a measurement and send its result, or its error, to the parent."""
+    try:
+        conn.send(target())
+    except Exception as e:
+        conn.send({"error": f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+
+
+def run_isolated(target: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Run one measurement in a forked child process.
+
+    Each operation then gets its own peak RSS, and writes made while
+    measuring against the in-process stand-in don't leak into the next one.
+    Falls back to running in-process where fork is unavailable.
+    """
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return target()
+
+    context = multiprocessing.get_context("fork")
+    parent_conn, child_conn = context.Pipe(duplex=False)
+    process = context.Process(target=_child, args=(target, child_conn))
+    process.start()
+    child_conn.close()
+    try:
+        result = parent_conn.recv()
+    except EOFError:
+        result = {"error": f"benchmark process exited with code {process.exitcode}"}
+    process.join()
+    return result
+
+
+class OperationBenchmarks:
+    """Builds the timed calls for each operation against a seeded corpus."""
+
+    def __init__(self, core: BrainCore, clusterer: BrainClusterer, db_uri: str, args: argparse.Namespace):
+        """Initialize with the brain and clusterer under test."""
+        self.core = core
+        self.clusterer = clusterer
+        self.db_uri = db_uri
+        self.args = args
+
+    def store_note(self, scale: int) -> Tuple[List[Callable[[], Any]], float]:
+        """One call per new synthetic note."""
+        texts = make_note_texts(self.args.writes, seed=self.args.seed + scale)
+        return [lambda text=text: self.core.store_note(text, self.db_uri) for text in texts], 1
+
+    def store_pdf(self, scale: int) -> Tuple[List[Callable[[], Any]], float]:
+        """One call per generated PDF; throughput counts pages."""
+        pdfs = [make_pdf(self.args.pdf_pages, seed=self.args.seed + i) for i in range(self.args.pdf_writes)]
+        return [
+            lambda pdf=pdf, i=i: self.core.store_pdf(pdf, f"bench-{i}.pdf", self.db_uri)
+            for i, pdf in enumerate(pdfs)
+        ], self.args.pdf_pages
+
+    def get_all_notes(self, scale: int) -> Tuple[List[Callable[[], Any]], float]:
+        """Repeated full listings; throughput counts notes returned."""
+        return [lambda: self.core.get_all_notes(self.db_uri)] * self.args.repeat, scale
+
+    def search(self, scale: int) -> Tuple[List[Callable[[], Any]], float]:
+        """One hybrid search per random two-word query."""
+        words = [word for topic in TOPICS.values() for word in topic]
+        rng = np.random.default_rng(self.args.seed)
+        queries = [" ".join(rng.choice(words, size=2)) for _ in range(self.args.repeat)]
+        return [lambda query=query: self.core.search(query, 10, "hybrid", self.db_uri) for query in queries], 1
+
+    def find_optimal_k(self, scale: int) -> Tuple[List[Callable[[], Any]], float]:
+        """Repeated k searches over embeddings fetched and scaled up front."""
+        _, embeddings = self.clusterer.load_embeddings(self.db_uri)
+        scaled = self.clusterer.scaler.fit_transform(embeddings)
+        return [lambda: self.clusterer.find_optimal_k(scaled, self.args.max_k)] * self.args.repeat, scale
+
+    def get_clusters(self, scale: int) -> Tuple[List[Callable[[], Any]], float]:
+        """Repeated end-to-end clustering with automatic k."""
+        return [
+            lambda: self.clusterer.get_clusters(db_uri=self.db_uri, max_k=self.args.max_k)
+        ] * self.args.repeat, scale
+
+
+@contextmanager
+def _database(args: argparse.Namespace) -> Iterator[str]:
+    """Provide the storage selected on the command line."""
+    if args.db_uri:
+        with external_store(args.db_uri, args.allow_drop) as db_uri:
+            yield db_uri
+    elif args.storage == "mongod":
+        with local_mongod() as db_uri:
+            yield db_uri
+    elif args.storage == "embedded":
+        with embedded_store() as db_uri:
+            yield db_uri
+    else:
+        with mock_mongo() as db_uri:
+            yield db_uri
+
+
+def _git_commit() -> Optional[str]:
+    """Commit the benchmark ran against, if run from a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """Run every requested operation at every requested scale."""
+    if args.encoder == "stub":
+        encoder = StubEncoder(dim=args.dim, seed=args.seed)
+        core = BrainCore(model_name="stub", model=encoder)
+    else:
+        core = BrainCore(model_name=args.encoder)
+        encoder = core.encoder
+    clusterer = BrainClusterer()
+
+    results = []
+    with _database(args) as db_uri:
+        benchmarks = OperationBenchmarks(core, clusterer, db_uri, args)
+        for scale in args.scales:
+            logger.info(f"Seeding {scale} notes")
+            start = time.perf_counter()
+            seed_corpus(db_uri, scale, encoder, args.seed)
+            logger.info(f"Seeded {scale} notes in {time.perf_counter() - start:.1f}s")
+
+            for operation in args.ops:
+                limit = SCALE_LIMITS.get(operation)
+                if limit and scale > limit and not args.no_limits:
+                    logger.info(f"Skipping {operation} at {scale} notes (limit {limit}, see --no-limits)")
+                    continue
+
+                logger.info(f"Running {operation} at {scale} notes")
+
+                def target(operation=operation, scale=scale):
+                    calls, items_per_call = getattr(benchmarks, operation)(scale)
+                    return _measure(calls, items_per_call)
+
+                result = run_isolated(target)
+                results.append({"operation": operation, "scale": scale, **result})
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "encoder": args.encoder,
+            "database": "external" if args.db_uri else args.storage,
+            "seed": args.seed
+        },
+        "results": results
+    }
+
+
+def main(argv: List[str] = None) -> None:
+    """Parse arguments, run the benchmarks and write JSON results."""
+    parser = argparse.ArgumentParser(description="Benchmark brainlib operations on synthetic corpora")
+    parser.add_argument("--scales", type=int, nargs="+", default=list(DEFAULT_SCALES),
+                        help="corpus sizes to seed, e.g. 1000 10000 100000")
+    parser.add_argument("--ops", nargs="+", default=list(OPERATIONS), choices=OPERATIONS)
+    parser.add_argument("--encoder", default="stub",
+                        help="'stub' for the offline encoder, or a SentenceTransformers model name")
+    parser.add_argument("--dim", type=int, default=384, help="stub embedding dimension")
+    parser.add_argument("--storage", choices=("mock", "mongod", "embedded"), default="mock",
+                        help="in-process mongomock, a throwaway local mongod, or a temporary embedded store")
+    parser.add_argument("--db-uri", help="benchmark against existing storage instead")
+    parser.add_argument("--allow-drop", action="store_true", help="allow dropping the notes at --db-uri")
+    parser.add_argument("--repeat", type=int, default=5, help="calls per read operation")
+    parser.add_argument("--writes", type=int, default=100, help="store_note calls per scale")
+    parser.add_argument("--pdf-writes", type=int, default=10, help="store_pdf calls per scale")
+    parser.add_argument("--pdf-pages", type=int, default=20, help="pages per generated PDF")
+    parser.add_argument("--max-k", type=int, default=10, help="max_k for clustering operations")
+    parser.add_argument("--no-limits", action="store_true", help="run clustering at every scale")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    # brainlib logs every call at INFO, which would dominate the timings
+    for name in ("brainlib", "brainlib.brain", "brainlib.cluster", "brainlib.lexical",
+                 "brainlib.projection", "brainlib.pdf_processor", "brainlib.storage"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+        logger.info(f"Wrote results to {args.output}")
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,173 @@
+"""
+Cortex - Benchmark Stand-ins
+
+Offline replacements for the heavy external pieces brainlib talks to:
+- A deterministic stub in place of SentenceTransformer
+- An in-process MongoDB stand-in (mongomock), patched into brainlib
+- A throwaway local mongod server, when one is installed
+- A temporary directory for the embedded backend
+"""
+
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Union
+
+import numpy as np
+
+# Modules that open their own MongoClient connections
+PATCHED_MODULES = ("brainlib.storage",)
+
+
+class StubEncoder:
+    """
+    Deterministic stand-in for SentenceTransformer.
+
+    Each token maps to a fixed pseudo-random vector and a text embeds to the
+    normalized sum of its token vectors, so texts sharing words end up close
+    together and clustering behaves roughly as it would on real embeddings.
+    """
+
+    def __init__(self, dim: int = 384, seed: int = 0):
+        """Initialize the encoder with the embedding dimension it produces."""
+        self.dim = dim
+        self.seed = seed
+        self._token_vectors: Dict[str, np.ndarray] = {}
+
+    def _token_vector(self, token: str) -> np.ndarray:
+        """Fixed pseudo-random vector for a token."""
+        vector = self._token_vectors.get(token)
+        if vector is None:
+            rng = np.random.default_rng((zlib.crc32(token.encode()), self.seed))
+            vector = rng.standard_normal(self.dim).astype(np.float32)
+            self._token_vectors[token] = vector
+        return vector
+
+    def _encode_one(self, text: str) -> np.ndarray:
+        """Normalized sum of the token vectors of a text."""
+        embedding = np.zeros(self.dim, dtype=np.float32)
+        for token in text.lower().split():
+            embedding += self._token_vector(token)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm > 0 else embedding
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32,
+               convert_to_tensor: bool = False, **kwargs) -> np.ndarray:
+        """Embed one text or a list of texts, like ``SentenceTransformer.encode``."""
+        if isinstance(sentences, str):
+            return self._encode_one(sentences)
+        return np.stack([self._encode_one(text) for text in sentences]) if sentences else np.empty((0, self.dim))
+
+
+@contextmanager
+def mock_mongo() -> Iterator[str]:
+    """
+    Route every brainlib MongoClient to one shared in-memory mongomock client.
+
+    Yields:
+        The db_uri to pass to brainlib calls
+    """
+    try:
+        import mongomock
+    except ImportError:
+        raise RuntimeError("The mongomock stand-in requires `pip install -r requirements-dev.txt`; "
+                           "use --storage mongod, --storage embedded or --db-uri instead")
+
+    import importlib
+
+    client = mongomock.MongoClient()
+    # brainlib closes its client after every call; keep the shared one alive
+    client.close = lambda: None
+
+    originals = {}
+    for name in PATCHED_MODULES:
+        module = importlib.import_module(name)
+        originals[module] = module.MongoClient
+        module.MongoClient = lambda *args, **kwargs: client
+    try:
+        yield "mongodb://mongomock"
+    finally:
+        for module, original in originals.items():
+            module.MongoClient = original
+
+
+def _free_port() -> int:
+    """Ask the OS for an unused local port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def local_mongod(timeout: float = 30.0) -> Iterator[str]:
+    """
+    Start a throwaway mongod on a free port with a temporary data directory.
+
+    Yields:
+        The db_uri of the running server
+    """
+    binary = shutil.which("mongod")
+    if binary is None:
+        raise RuntimeError("mongod was not found on PATH")
+
+    data_dir = tempfile.mkdtemp(prefix="cortex-bench-")
+    port = _free_port()
+    process = subprocess.Popen(
+        [binary, "--dbpath", data_dir, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=1):
+                    break
+            except OSError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("mongod failed to start")
+                time.sleep(0.1)
+        yield f"mongodb://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+@contextmanager
+def embedded_store() -> Iterator[str]:
+    """
+    Use the embedded backend in a temporary directory.
+
+    Yields:
+        The db_uri of the store
+    """
+    data_dir = tempfile.mkdtemp(prefix="cortex-bench-")
+    try:
+        yield f"file://{data_dir}"
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+@contextmanager
+def external_store(db_uri: str, allow_drop: bool = False) -> Iterator[str]:
+    """
+    Use existing storage, either a MongoDB server or an embedded store.
+
+    The benchmark drops and reseeds the notes, so storage that already
+    holds notes is refused unless ``allow_drop`` is set.
+    """
+    from brainlib.storage import open_backend
+
+    with open_backend(db_uri) as backend:
+        if backend.count_notes() and not allow_drop:
+            raise RuntimeError(f"{db_uri} already holds notes and the benchmark would drop them; "
+                               f"pass --allow-drop to proceed")
+    yield db_uri
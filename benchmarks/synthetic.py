@@ -0,0 +1,139 @@
+"""
+Cortex - Synthetic Corpora
+
+Deterministic test data for the benchmarks:
+- Note texts drawn from a few topics, with code identifiers mixed in
+- Random unit embeddings clustered around topic directions
+- Note documents shaped like the ones brainlib stores
+- Multi-page PDFs built without any PDF library
+"""
+
+from typing import List, Dict, Any, Iterator
+from datetime import datetime, timedelta
+import uuid
+
+import numpy as np
+
+TOPICS = {
+    "machine learning": ["model", "training", "gradient", "embedding", "loss", "dataset", "epoch", "tensor"],
+    "cooking": ["recipe", "oven", "garlic", "simmer", "flour", "butter", "season", "bake"],
+    "finance": ["budget", "invoice", "revenue", "tax", "expense", "forecast", "ledger", "quarter"],
+    "travel": ["flight", "hotel", "itinerary", "passport", "museum", "train", "luggage", "booking"],
+    "databases": ["index", "query", "shard", "replica", "transaction", "schema", "cursor", "collection"]
+}
+
+FILLER = ["the", "a", "notes", "about", "with", "for", "and", "today", "meeting", "idea", "follow", "up"]
+
+IDENTIFIERS = ["store_note", "get_clusters", "find_optimal_k", "BrainCore", "notes_db.notes",
+               "insert_many", "silhouette_score", "pdf_processor.py"]
+
+
+def make_note_texts(n: int, seed: int = 0, min_words: int = 8, max_words: int = 60) -> List[str]:
+    """Generate ``n`` short note texts, each mostly about one topic."""
+    rng = np.random.default_rng(seed)
+    topic_words = list(TOPICS.values())
+    texts = []
+    for _ in range(n):
+        words = topic_words[rng.integers(len(topic_words))]
+        length = int(rng.integers(min_words, max_words + 1))
+        pool = words * 3 + FILLER
+        text = [pool[i] for i in rng.integers(0, len(pool), size=length)]
+        if rng.random() < 0.2:
+            text.insert(int(rng.integers(0, length)), IDENTIFIERS[rng.integers(len(IDENTIFIERS))])
+        texts.append(" ".join(text).capitalize() + ".")
+    return texts
+
+
+def make_embeddings(n: int, dim: int = 384, n_topics: int = 10, noise: float = 1.5, seed: int = 0) -> np.ndarray:
+    """Generate unit-length embeddings scattered around a few topic directions."""
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((n_topics, dim))
+    labels = rng.integers(0, n_topics, size=n)
+    embeddings = topics[labels] + noise * rng.standard_normal((n, dim))
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings.astype(np.float32)
+
+
+def make_note_documents(n: int, encoder=None, dim: int = 384, seed: int = 0,
+                        model_name: str = "stub", batch_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Generate note documents in the shape ``BrainCore.store_note`` writes, in batches.
+
+    Args:
+        n: Number of notes
+        encoder: Encoder used to embed the texts; random embeddings are used if None
+        dim: Embedding dimension when no encoder is given
+        seed: Random seed
+        model_name: Value for the ``embedding_model`` tag
+        batch_size: Number of documents per yielded batch
+    """
+    texts = make_note_texts(n, seed)
+    created = datetime(2024, 1, 1)
+    for start in range(0, n, batch_size):
+        batch = texts[start:start + batch_size]
+        if encoder is not None:
+            embeddings = encoder.encode(batch, convert_to_tensor=False)
+        else:
+            embeddings = make_embeddings(len(batch), dim, seed=seed + start)
+        documents = []
+        for offset, (text, embedding) in enumerate(zip(batch, embeddings)):
+            timestamp = created + timedelta(minutes=start + offset)
+            documents.append({
+                "_id": str(uuid.UUID(int=seed * n + start + offset)),
+                "note": text,
+                "embedding": embedding.tolist(),
+                "embedding_model": model_name,
+                "type": "text",
+                "created_at": timestamp,
+                "updated_at": timestamp
+            })
+        yield documents
+
+
+def _escape_pdf_text(text: str) -> str:
+    """Escape a string for use inside a PDF literal."""
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(pages: int = 5, lines_per_page: int = 40, seed: int = 0) -> bytes:
+    """
+    Build a multi-page PDF with one line of synthetic note text per row.
+
+    The file uses only a standard Type 1 font and uncompressed content
+    streams, which PyPDF2 can extract text from.
+    """
+    texts = make_note_texts(pages * lines_per_page, seed, min_words=6, max_words=12)
+    font_id = 3
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        font_id: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    }
+    kids = []
+    for page in range(pages):
+        page_id = 4 + page * 2
+        content_id = page_id + 1
+        kids.append(f"{page_id} 0 R")
+        lines = texts[page * lines_per_page:(page + 1) * lines_per_page]
+        stream = "BT /F1 10 Tf 12 TL 50 760 Td " + " ".join(
+            f"({_escape_pdf_text(line)}) Tj T*" for line in lines
+        ) + " ET"
+        data = stream.encode("latin-1", errors="replace")
+        objects[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode()
+        objects[content_id] = b"<< /Length " + str(len(data)).encode() + b" >>\nstream\n" + data + b"\nendstream"
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>".encode()
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(output)
+        output += f"{object_id} 0 obj\n".encode() + objects[object_id] + b"\nendobj\n"
+    xref_offset = len(output)
+    count = max(objects) + 1
+    output += f"xref\n0 {count}\n0000000000 65535 f \n".encode()
+    for object_id in range(1, count):
+        output += f"{offsets[object_id]:010d} 00000 n \n".encode()
+    output += f"trailer\n<< /Size {count} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+    return bytes(output)
@@ -6,6 +6,7 @@ from .brain import (
     store_note,
     get_all_notes,
     get_note_with_embedding,
+    search,
     BrainCore
 )
 
@@ -14,6 +15,7 @@ from .cluster import (
     get_cluster_summary,
     get_notes_with_embeddings,
     find_optimal_k,
+    fit_projection,
     BrainClusterer
 )
 
@@ -23,6 +25,7 @@ __all__ = [
     'store_note', 
     'get_all_notes',
     'get_note_with_embedding',
+    'search',
     'BrainCore',
     
     # Clustering functions
@@ -30,5 +33,6 @@ __all__ = [
     'get_cluster_summary',
     'get_notes_with_embeddings',
     'find_optimal_k',
+    'fit_projection',
     'BrainClusterer'
 ] 
\ No newline at end of file
@@ -3,46 +3,108 @@ Cortex - Core Brain Module
 
 This is the main brain of the Cortex app. It handles:
 - Converting your text notes into embeddings so the system can understand them
-- Storing notes and their representations in the database
+- Storing notes and their representations in the database, one at a time or in bulk
 - Retrieving notes when you need them
 - Processing PDF files and extracting their text content
+- Searching notes by keyword, by meaning, or both
+- Flagging or rejecting near-duplicates of stored notes
+- Keeping each tenant's notes apart from every other tenant's
 """
 
 import json
 import logging
 import sys
+import time
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 import uuid
 
-from pymongo import MongoClient
+import numpy as np
 from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
-from sentence_transformers import SentenceTransformer
 
 try:
+    from . import metrics
     from .pdf_processor import PDFProcessor
+    from .lexical import reciprocal_rank_fusion
+    from .projection import EmbeddingProjector, semantic_ranking
+    from .dedup import (DuplicateIndex, DuplicateNoteError, check_duplicates, ensure_duplicate_index,
+                        find_similar_notes, DEFAULT_THRESHOLD, DUPLICATE_ACTIONS)
+    from .storage import open_backend, configured_db_uri, validate_tenant
 except ImportError:
+    import metrics
     from pdf_processor import PDFProcessor
+    from lexical import reciprocal_rank_fusion
+    from projection import EmbeddingProjector, semantic_ranking
+    from dedup import (DuplicateIndex, DuplicateNoteError, check_duplicates, ensure_duplicate_index,
+                       find_similar_notes, DEFAULT_THRESHOLD, DUPLICATE_ACTIONS)
+    from storage import open_backend, configured_db_uri, validate_tenant
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DEFAULT_MODEL = "all-MiniLM-L6-v2"
+
+# Artifact naming the model the stored embeddings belong to, written by a migration cutover
+_MODEL_ARTIFACT = "embedding_model"
+
+# Loaded encoders by model name, shared by every brain in the process
+_encoders: Dict[str, Any] = {}
+
+
+def active_model(backend) -> Optional[str]:
+    """Model whose embedding space the stored notes are in, or None if no cutover ever set one."""
+    document = backend.get_artifact(_MODEL_ARTIFACT)
+    return None if document is None else document["model_name"]
+
+
+def set_active_model(backend, model_name: str) -> None:
+    """Record the model whose embedding space the stored notes are in."""
+    backend.put_artifact(_MODEL_ARTIFACT, {"model_name": model_name, "updated_at": datetime.utcnow()})
+
+
 class BrainCore:
     """The core brain that handles storing and retrieving your notes with embeddings."""
     
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
-        """Set up the model for understanding text."""
+    def __init__(self, model_name: str = DEFAULT_MODEL, model: Optional[Any] = None,
+                 follow_store: bool = False):
+        """
+        Set up the model for understanding text.
+        
+        The model is loaded the first time something is encoded, so calls
+        that never embed don't pay for it.
+        
+        Args:
+            model_name: SentenceTransformers model to load
+            model: Already loaded encoder with a SentenceTransformer-style
+                ``encode`` method; when given, nothing is loaded
+            follow_store: Switch to the model the stored notes are embedded
+                with whenever a store is opened, instead of refusing to mix
+                models; see ``_check_model``
+        """
         self.model_name = model_name
-        self.model = None
+        self.model = model
+        self.follow_store = follow_store
         self.pdf_processor = PDFProcessor()
-        self._load_model()
     
-    def _load_model(self):
-        """Load the model that will understand your notes."""
+    @property
+    def encoder(self) -> Any:
+        """The model for ``model_name``, loaded on first use."""
+        if self.model is None:
+            self.model = self._load_model()
+        return self.model
+    
+    def _load_model(self) -> Any:
+        """Load the model that will understand your notes, or reuse it if already loaded."""
+        if self.model_name in _encoders:
+            return _encoders[self.model_name]
         try:
             logger.info(f"Loading model: {self.model_name}")
-            self.model = SentenceTransformer(self.model_name)
+            with metrics.span("model.load", model=self.model_name):
+                # Imported here so tools that never encode don't pay for loading torch
+                from sentence_transformers import SentenceTransformer
+                _encoders[self.model_name] = SentenceTransformer(self.model_name)
             logger.info("Model loaded successfully")
+            return _encoders[self.model_name]
         except Exception as e:
             logger.error(f"Failed to load model: {e}")
             raise
@@ -52,71 +114,193 @@ class BrainCore:
         if not note or not note.strip():
             raise ValueError("Note cannot be empty")
         
-        if self.model is None:
-            raise RuntimeError("model not loaded")
-        
         try:
-            embedding = self.model.encode(note, convert_to_tensor=False)
+            with metrics.span("encode"):
+                embedding = self.encoder.encode(note, convert_to_tensor=False)
+            metrics.observe("encode_batch_size", 1, buckets=metrics.SIZE_BUCKETS)
+            metrics.inc("encoded_texts_total")
             return embedding.tolist()
         except Exception as e:
             logger.error(f"Failed to convert text to embedding: {e}")
             raise
     
-    def store_note(self, note: str, db_uri: str = "mongodb://localhost:27017") -> str:
-        """Save your note along with its embedding in the database."""
-        if not note or not note.strip():
+    def embed_texts(self, notes: List[str], batch_size: int = 64) -> List[List[float]]:
+        """Convert several text notes into embeddings in batches."""
+        if any(not note or not note.strip() for note in notes):
             raise ValueError("Note cannot be empty")
         
-        embedding = self.embed_text(note)
+        if not notes:
+            return []
+        
+        try:
+            with metrics.span("encode"):
+                embeddings = self.encoder.encode(notes, batch_size=batch_size, convert_to_tensor=False)
+            metrics.observe("encode_batch_size", len(notes), buckets=metrics.SIZE_BUCKETS)
+            metrics.inc("encoded_texts_total", len(notes))
+            return [embedding.tolist() for embedding in embeddings]
+        except Exception as e:
+            logger.error(f"Failed to convert texts to embeddings: {e}")
+            raise
+    
+    def _check_model(self, backend) -> None:
+        """
+        Make sure this brain embeds in the same space as the stored notes.
         
-        note_id = str(uuid.uuid4())
-        document = {
-            "_id": note_id,
+        Must run before anything is embedded for the store. A brain that
+        follows the store switches to its model (or the default model if
+        none was ever recorded); any other brain refuses to mix models.
+        """
+        model_name = active_model(backend)
+        if self.follow_store:
+            model_name = model_name or DEFAULT_MODEL
+            if model_name != self.model_name:
+                self.model_name = model_name
+                self.model = None
+        elif model_name is not None and model_name != self.model_name:
+            raise ValueError(f"Stored notes are embedded with {model_name}, not {self.model_name}")
+    
+    def _note_document(self, note: str, embedding: List[float]) -> Dict[str, Any]:
+        """Build the stored document for a new text note."""
+        now = datetime.utcnow()
+        return {
+            "_id": str(uuid.uuid4()),
             "note": note.strip(),
             "embedding": embedding,
+            "embedding_model": self.model_name,
             "type": "text",
-            "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow()
+            "created_at": now,
+            "updated_at": now
         }
+    
+    def _add_derived_fields(self, backend, documents: List[Dict[str, Any]], embeddings: List[List[float]],
+                            index: Optional[DuplicateIndex]) -> None:
+        """Give documents the reduced vectors and duplicate index buckets matching what is stored."""
+        embeddings = np.array(embeddings, dtype=np.float32)
+        
+        projector = EmbeddingProjector.load(backend)
+        if projector is not None:
+            for document, vector in zip(documents, projector.transform(embeddings)):
+                document["embedding_reduced"] = vector.tolist()
+        
+        if index is not None:
+            for document, buckets in zip(documents, index.buckets(embeddings)):
+                document["lsh_buckets"] = buckets.tolist()
+    
+    def _duplicate_index(self, backend, duplicates: Optional[str]) -> Optional[DuplicateIndex]:
+        """Index new notes are hashed into, built first if a near-duplicate check needs it."""
+        if duplicates is None:
+            return DuplicateIndex.load(backend)
+        return ensure_duplicate_index(backend)
+    
+    def _check_duplicates(self, backend, document: Dict[str, Any], index: Optional[DuplicateIndex],
+                          duplicates: Optional[str], threshold: float) -> List[Dict[str, Any]]:
+        """Run the optional near-duplicate check on a new document, flagging it if asked to."""
+        if duplicates is None or index is None:
+            return []
+        with metrics.span("dedup.check"):
+            matches = check_duplicates(backend, document["embedding"], duplicates, threshold, index)
+        if matches:
+            logger.info(f"Note {document['_id']} is a possible duplicate of {len(matches)} notes")
+            document["possible_duplicates"] = matches
+        return matches
+    
+    def store_note(self, note: str, db_uri: str = "mongodb://localhost:27017",
+                   duplicates: Optional[str] = None, duplicate_threshold: float = DEFAULT_THRESHOLD,
+                   tenant: Optional[str] = None) -> str:
+        """
+        Save your note along with its embedding in the database.
+        
+        Args:
+            note: Note text
+            db_uri: Storage URI, see ``storage.open_backend``
+            duplicates: None to skip the near-duplicate check, "flag" to store
+                the note with its matches in "possible_duplicates", or
+                "reject" to raise DuplicateNoteError instead of storing it
+            duplicate_threshold: Cosine similarity at which a stored note
+                counts as a near-duplicate
+            tenant: Tenant whose notes to use, see ``storage.open_backend``
+            
+        Returns:
+            ID of the stored note; use ``store_note_with_matches`` to also get
+            the flagged matches
+        """
+        return self.store_note_with_matches(note, db_uri, duplicates, duplicate_threshold, tenant)["note_id"]
+    
+    def store_note_with_matches(self, note: str, db_uri: str = "mongodb://localhost:27017",
+                                duplicates: Optional[str] = None, duplicate_threshold: float = DEFAULT_THRESHOLD,
+                                tenant: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Save your note like ``store_note``, returning the near-duplicates it was flagged with.
+        
+        Returns:
+            Dict with the stored note's "note_id" and its flagged
+            "possible_duplicates" (empty unless ``duplicates`` is "flag")
+        """
+        if not note or not note.strip():
+            raise ValueError("Note cannot be empty")
+        if duplicates is not None and duplicates not in DUPLICATE_ACTIONS:
+            raise ValueError(f"Unknown duplicate action: {duplicates}")
         
         try:
-            client = MongoClient(db_uri, serverSelectionTimeoutMS=5000)
-            client.admin.command('ping')
+            backend = open_backend(db_uri, tenant)
             logger.info("Successfully connected to database")
+            self._check_model(backend)
             
-            db = client.notes_db
-            collection = db.notes
+            embedding = self.embed_text(note)
+            document = self._note_document(note, embedding)
+            note_id = document["_id"]
             
-            result = collection.insert_one(document)
+            index = self._duplicate_index(backend, duplicates)
+            matches = self._check_duplicates(backend, document, index, duplicates, duplicate_threshold)
+            self._add_derived_fields(backend, [document], [embedding], index)
             
-            if result.inserted_id:
+            inserted = backend.insert_notes([document])
+            
+            if inserted:
                 logger.info(f"Successfully stored note with ID: {note_id}")
-                return note_id
+                return {"note_id": note_id, "possible_duplicates": matches}
             else:
                 raise Exception("Failed to save note to database")
                 
         except (ConnectionFailure, ServerSelectionTimeoutError) as e:
             logger.error(f"Database connection failed: {e}")
             raise
+        except DuplicateNoteError as e:
+            logger.info(f"Rejected note: {e}")
+            raise
         except Exception as e:
             logger.error(f"Failed to store note: {e}")
             raise
         finally:
-            if 'client' in locals():
-                client.close()
+            if 'backend' in locals():
+                backend.close()
     
-    def store_pdf(self, pdf_file: bytes, filename: str, db_uri: str = "mongodb://localhost:27017") -> Dict[str, Any]:
-        """Process and store a PDF file, extracting its text and creating embeddings."""
+    def store_pdf(self, pdf_file: bytes, filename: str, db_uri: str = "mongodb://localhost:27017",
+                  duplicates: Optional[str] = None, duplicate_threshold: float = DEFAULT_THRESHOLD,
+                  tenant: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Process and store a PDF file, extracting its text and creating embeddings.
+        
+        The near-duplicate check works as in ``store_note``; flagged matches
+        are also returned under "possible_duplicates".
+        """
+        if duplicates is not None and duplicates not in DUPLICATE_ACTIONS:
+            raise ValueError(f"Unknown duplicate action: {duplicates}")
+        
         try:
             is_valid, error_message = self.pdf_processor.validate_pdf(pdf_file, filename)
             if not is_valid:
                 raise ValueError(error_message)
             
-            pdf_data = self.pdf_processor.extract_text_from_pdf(pdf_file, filename)
+            with metrics.span("pdf.extract"):
+                pdf_data = self.pdf_processor.extract_text_from_pdf(pdf_file, filename)
             
             if not pdf_data["text_content"].strip():
                 raise ValueError("No text content could be extracted from the PDF")
             
+            backend = open_backend(db_uri, tenant)
+            self._check_model(backend)
+            
             embedding = self.embed_text(pdf_data["text_content"])
             
             pdf_id = pdf_data["pdf_id"]
@@ -124,6 +308,7 @@ class BrainCore:
                 "_id": pdf_id,
                 "note": pdf_data["text_content"],
                 "embedding": embedding,
+                "embedding_model": self.model_name,
                 "type": "pdf",
                 "filename": filename,
                 "pdf_metadata": pdf_data["metadata"],
@@ -135,15 +320,13 @@ class BrainCore:
                 "updated_at": datetime.utcnow()
             }
             
-            client = MongoClient(db_uri, serverSelectionTimeoutMS=5000)
-            client.admin.command('ping')
-            
-            db = client.notes_db
-            collection = db.notes
+            index = self._duplicate_index(backend, duplicates)
+            matches = self._check_duplicates(backend, document, index, duplicates, duplicate_threshold)
+            self._add_derived_fields(backend, [document], [embedding], index)
             
-            result = collection.insert_one(document)
+            inserted = backend.insert_notes([document])
             
-            if result.inserted_id:
+            if inserted:
                 logger.info(f"Successfully processed and stored PDF with ID: {pdf_id}")
                 return {
                     "pdf_id": pdf_id,
@@ -151,36 +334,29 @@ class BrainCore:
                     "total_pages": pdf_data["total_pages"],
                     "pages_with_text": pdf_data["pages_with_text"],
                     "file_size_bytes": pdf_data["file_size_bytes"],
+                    "possible_duplicates": matches,
                     "success": True
                 }
             else:
                 raise Exception("Failed to save PDF to database")
                 
+        except DuplicateNoteError as e:
+            logger.info(f"Rejected PDF {filename}: {e}")
+            raise
         except Exception as e:
             logger.error(f"Failed to process PDF {filename}: {e}")
             raise
         finally:
-            if 'client' in locals():
-                client.close()
+            if 'backend' in locals():
+                backend.close()
     
-    def get_all_notes(self, db_uri: str = "mongodb://localhost:27017") -> List[Dict[str, Any]]:
+    def get_all_notes(self, db_uri: str = "mongodb://localhost:27017",
+                      tenant: Optional[str] = None) -> List[Dict[str, Any]]:
         """Retrieve all your stored notes from the database."""
         try:
-            client = MongoClient(db_uri, serverSelectionTimeoutMS=5000)
-            client.admin.command('ping')
-            
-            db = client.notes_db
-            collection = db.notes
-            
-            notes = list(collection.find({}, {
-                "_id": 1, 
-                "note": 1, 
-                "type": 1, 
-                "filename": 1,
-                "total_pages": 1,
-                "created_at": 1, 
-                "updated_at": 1
-            }))
+            backend = open_backend(db_uri, tenant)
+            
+            notes = backend.list_notes()
             
             for note in notes:
                 note["_id"] = str(note["_id"])
@@ -193,19 +369,16 @@ class BrainCore:
             logger.error(f"Failed to retrieve notes: {e}")
             raise
         finally:
-            if 'client' in locals():
-                client.close()
+            if 'backend' in locals():
+                backend.close()
     
-    def get_note_with_embedding(self, note_id: str, db_uri: str = "mongodb://localhost:27017") -> Optional[Dict[str, Any]]:
+    def get_note_with_embedding(self, note_id: str, db_uri: str = "mongodb://localhost:27017",
+                                tenant: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """Get a specific note along with its embedding."""
         try:
-            client = MongoClient(db_uri, serverSelectionTimeoutMS=5000)
-            client.admin.command('ping')
-            
-            db = client.notes_db
-            collection = db.notes
+            backend = open_backend(db_uri, tenant)
             
-            note = collection.find_one({"_id": note_id})
+            note = backend.get_note(note_id)
             
             if note:
                 note["_id"] = str(note["_id"])
@@ -218,64 +391,390 @@ class BrainCore:
             logger.error(f"Failed to retrieve note {note_id}: {e}")
             raise
         finally:
-            if 'client' in locals():
-                client.close()
+            if 'backend' in locals():
+                backend.close()
     
-    def delete_note(self, note_id: str, db_uri: str = "mongodb://localhost:27017") -> bool:
+    def delete_note(self, note_id: str, db_uri: str = "mongodb://localhost:27017",
+                    tenant: Optional[str] = None) -> bool:
         """Remove a note from the database."""
         try:
-            client = MongoClient(db_uri, serverSelectionTimeoutMS=5000)
-            client.admin.command('ping')
-            
-            db = client.notes_db
-            collection = db.notes
-            
-            note = collection.find_one({"_id": note_id})
-            if not note:
-                logger.warning(f"Note with ID {note_id} not found")
-                return False
+            backend = open_backend(db_uri, tenant)
             
-            result = collection.delete_one({"_id": note_id})
-            
-            if result.deleted_count > 0:
+            if backend.delete_note(note_id):
                 logger.info(f"Successfully deleted note with ID: {note_id}")
                 return True
             else:
-                logger.warning(f"Failed to delete note with ID: {note_id}")
+                logger.warning(f"Note with ID {note_id} not found")
                 return False
                 
         except Exception as e:
             logger.error(f"Failed to delete note {note_id}: {e}")
             raise
         finally:
-            if 'client' in locals():
-                client.close()
+            if 'backend' in locals():
+                backend.close()
 
-brain_core = BrainCore()
+    def store_notes(self, notes: List[str], db_uri: str = "mongodb://localhost:27017",
+                    tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Save many notes with one batched encode and one bulk insert.
+        
+        Notes are not checked for near-duplicates; check them first with
+        ``find_duplicates`` or clean up afterwards with ``dedup.py find_groups``.
+        
+        Args:
+            notes: Note texts
+            db_uri: Storage URI, see ``storage.open_backend``
+            tenant: Tenant whose notes to use, see ``storage.open_backend``
+            
+        Returns:
+            One result per note, in input order: {"noteId", "success": True},
+            or {"error", "success": False} for notes that were not stored
+        """
+        results = [{"error": "Note cannot be empty", "success": False} for _ in notes]
+        valid = [i for i, note in enumerate(notes) if isinstance(note, str) and note.strip()]
+        if not valid:
+            return results
+        
+        try:
+            backend = open_backend(db_uri, tenant)
+            self._check_model(backend)
+            
+            embeddings = self.embed_texts([notes[i] for i in valid])
+            documents = [self._note_document(notes[i], embedding) for i, embedding in zip(valid, embeddings)]
+            
+            self._add_derived_fields(backend, documents, embeddings, DuplicateIndex.load(backend))
+            
+            inserted = set(backend.insert_notes(documents))
+            
+            for i, document in zip(valid, documents):
+                if document["_id"] in inserted:
+                    results[i] = {"noteId": document["_id"], "success": True}
+                else:
+                    results[i] = {"error": "Failed to save note to database", "success": False}
+            
+            logger.info(f"Successfully stored {len(inserted)} of {len(notes)} notes")
+            return results
+            
+        except Exception as e:
+            logger.error(f"Failed to store notes: {e}")
+            raise
+        finally:
+            if 'backend' in locals():
+                backend.close()
+    
+    def update_notes(self, updates: List[Dict[str, Any]],
+                     db_uri: str = "mongodb://localhost:27017",
+                     tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Replace the text of many notes, re-embedding them in one batch.
+        
+        Like ``store_notes``, this skips the near-duplicate check.
+        
+        Args:
+            updates: Items with "note_id" and the new "note" text
+            db_uri: Storage URI, see ``storage.open_backend``
+            tenant: Tenant whose notes to use, see ``storage.open_backend``
+            
+        Returns:
+            One result per item, in input order: {"noteId", "updated", "success": True},
+            with "updated" False for ids that don't exist, or {"noteId", "error",
+            "success": False} for invalid items
+        """
+        results = []
+        valid = []
+        seen = set()
+        for i, update in enumerate(updates):
+            note_id = update.get("note_id")
+            note = update.get("note")
+            if not note_id:
+                results.append({"noteId": note_id, "error": "Note ID is required", "success": False})
+            elif not isinstance(note, str) or not note.strip():
+                results.append({"noteId": note_id, "error": "Note cannot be empty", "success": False})
+            elif note_id in seen:
+                results.append({"noteId": note_id, "error": "Duplicate note ID in request", "success": False})
+            else:
+                results.append(None)
+                valid.append(i)
+                seen.add(note_id)
+        if not valid:
+            return results
+        
+        try:
+            backend = open_backend(db_uri, tenant)
+            self._check_model(backend)
+            
+            embeddings = self.embed_texts([updates[i]["note"] for i in valid])
+            now = datetime.utcnow()
+            documents = [{
+                "_id": updates[i]["note_id"],
+                "note": updates[i]["note"].strip(),
+                "embedding": embedding,
+                "embedding_model": self.model_name,
+                "updated_at": now
+            } for i, embedding in zip(valid, embeddings)]
+            
+            self._add_derived_fields(backend, documents, embeddings, DuplicateIndex.load(backend))
+            
+            updated = backend.update_notes(documents)
+            
+            for i, document, was_updated in zip(valid, documents, updated):
+                results[i] = {"noteId": document["_id"], "updated": was_updated, "success": True}
+            
+            logger.info(f"Successfully updated {sum(updated)} of {len(updates)} notes")
+            return results
+            
+        except Exception as e:
+            logger.error(f"Failed to update notes: {e}")
+            raise
+        finally:
+            if 'backend' in locals():
+                backend.close()
+    
+    def delete_notes(self, note_ids: List[str], db_uri: str = "mongodb://localhost:27017",
+                     tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Remove many notes with one bulk delete.
+        
+        Returns:
+            One {"noteId", "deleted"} result per id, in input order
+        """
+        try:
+            backend = open_backend(db_uri, tenant)
+            
+            deleted = backend.delete_notes(list(note_ids))
+            
+            logger.info(f"Successfully deleted {sum(deleted)} of {len(note_ids)} notes")
+            return [{"noteId": note_id, "deleted": was_deleted} for note_id, was_deleted in zip(note_ids, deleted)]
+            
+        except Exception as e:
+            logger.error(f"Failed to delete notes: {e}")
+            raise
+        finally:
+            if 'backend' in locals():
+                backend.close()
 
-def embed_text(note: str) -> List[float]:
-    """Convert your text note into an embedding."""
-    return brain_core.embed_text(note)
+    def search(self, query: str, limit: int = 10, mode: str = "hybrid",
+               db_uri: str = "mongodb://localhost:27017",
+               tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Find notes matching a query by keyword, by meaning, or both.
+        
+        Args:
+            query: Free-text query
+            limit: Maximum number of notes to return
+            mode: "lexical" for BM25 only, "semantic" for embedding similarity
+                only, or "hybrid" to fuse both rankings with reciprocal rank fusion
+            db_uri: Storage URI, see ``storage.open_backend``
+            tenant: Tenant whose notes to use, see ``storage.open_backend``
+            
+        Returns:
+            List of notes, best match first, each with a "score"
+        """
+        if not query or not query.strip():
+            raise ValueError("Query cannot be empty")
+        if mode not in ("lexical", "semantic", "hybrid"):
+            raise ValueError(f"Unknown search mode: {mode}")
+        
+        # Each ranking contributes a deeper candidate list than we return so
+        # that fusion can promote notes that rank well in both
+        num_candidates = limit if mode != "hybrid" else max(limit * 5, 50)
+        
+        try:
+            backend = open_backend(db_uri, tenant)
+            
+            rankings = []
+            scores = {}
+            
+            if mode in ("lexical", "hybrid"):
+                with metrics.span("search.lexical"):
+                    hits = backend.lexical_search(query, num_candidates)
+                rankings.append([note_id for note_id, _ in hits])
+                if mode == "lexical":
+                    scores = dict(hits)
+            
+            if mode in ("semantic", "hybrid"):
+                self._check_model(backend)
+                query_embedding = np.array(self.embed_text(query))
+                with metrics.span("search.semantic"):
+                    hits = semantic_ranking(backend, query_embedding, num_candidates)
+                rankings.append([note_id for note_id, _ in hits])
+                if mode == "semantic":
+                    scores = dict(hits)
+            
+            if mode == "hybrid":
+                scores = dict(reciprocal_rank_fusion(rankings)[:limit])
+            
+            ranked_ids = sorted(scores, key=scores.get, reverse=True)[:limit]
+            if not ranked_ids:
+                return []
+            
+            results = []
+            for note in backend.get_notes(ranked_ids):
+                note_id = note["_id"]
+                note["_id"] = str(note["_id"])
+                note["created_at"] = note["created_at"].isoformat()
+                note["updated_at"] = note["updated_at"].isoformat()
+                note["score"] = scores[note_id]
+                results.append(note)
+            
+            logger.info(f"Search ({mode}) returned {len(results)} notes")
+            return results
+            
+        except Exception as e:
+            logger.error(f"Failed to search notes: {e}")
+            raise
+        finally:
+            if 'backend' in locals():
+                backend.close()
+    
+    def find_duplicates(self, note: str, threshold: float = DEFAULT_THRESHOLD, limit: int = 5,
+                        db_uri: str = "mongodb://localhost:27017",
+                        tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Find stored notes that a text would be a near-duplicate of, without storing it.
+        
+        Returns:
+            Matches as {"note_id", "similarity"}, most similar first
+        """
+        if not note or not note.strip():
+            raise ValueError("Note cannot be empty")
+        
+        try:
+            backend = open_backend(db_uri, tenant)
+            self._check_model(backend)
+            
+            embedding = self.embed_text(note)
+            with metrics.span("dedup.check"):
+                return find_similar_notes(backend, np.array(embedding), threshold, limit)
+            
+        except Exception as e:
+            logger.error(f"Failed to find duplicates: {e}")
+            raise
+        finally:
+            if 'backend' in locals():
+                backend.close()
+    
+    def rebuild_lexical_index(self, db_uri: str = "mongodb://localhost:27017",
+                              tenant: Optional[str] = None) -> int:
+        """Re-tokenize every stored note and rebuild the keyword index."""
+        try:
+            backend = open_backend(db_uri, tenant)
+            
+            return backend.rebuild_lexical_index()
+            
+        except Exception as e:
+            logger.error(f"Failed to rebuild lexical index: {e}")
+            raise
+        finally:
+            if 'backend' in locals():
+                backend.close()
+    
+    def compact_lexical_index(self, db_uri: str = "mongodb://localhost:27017",
+                              tenant: Optional[str] = None) -> Dict[str, int]:
+        """
+        Merge the keyword index's incremental writes and drop entries of deleted notes.
+        
+        Writes only append to the index, so this should run periodically,
+        e.g. nightly. It also indexes notes whose indexing failed earlier.
+        """
+        try:
+            backend = open_backend(db_uri, tenant)
+            
+            return backend.compact_lexical_index()
+            
+        except Exception as e:
+            logger.error(f"Failed to compact lexical index: {e}")
+            raise
+        finally:
+            if 'backend' in locals():
+                backend.close()
 
-def store_note(note: str, db_uri: str = "mongodb://localhost:27017") -> str:
+def get_brain_core() -> BrainCore:
+    """
+    Get a brain for the module-level helpers.
+    
+    It embeds with whatever model the store it opens was last cut over to,
+    see ``migrate.py``, or the default model if it never was. Models load
+    on first use and are shared across brains.
+    """
+    return BrainCore(follow_store=True)
+
+def embed_text(note: str, db_uri: Optional[str] = None, tenant: Optional[str] = None) -> List[float]:
+    """Convert your text note into an embedding, with the model of a tenant's notes if ``db_uri`` is given."""
+    core = get_brain_core()
+    if db_uri is not None:
+        with open_backend(db_uri, tenant) as backend:
+            core._check_model(backend)
+    return core.embed_text(note)
+
+def store_note(note: str, db_uri: str = "mongodb://localhost:27017",
+               duplicates: Optional[str] = None, duplicate_threshold: float = DEFAULT_THRESHOLD,
+               tenant: Optional[str] = None) -> str:
     """Save your note with its embedding."""
-    return brain_core.store_note(note, db_uri)
+    return get_brain_core().store_note(note, db_uri, duplicates, duplicate_threshold, tenant)
+
+def store_note_with_matches(note: str, db_uri: str = "mongodb://localhost:27017",
+                            duplicates: Optional[str] = None, duplicate_threshold: float = DEFAULT_THRESHOLD,
+                            tenant: Optional[str] = None) -> Dict[str, Any]:
+    """Save your note with its embedding, returning the near-duplicates it was flagged with."""
+    return get_brain_core().store_note_with_matches(note, db_uri, duplicates, duplicate_threshold, tenant)
 
-def store_pdf(pdf_file: bytes, filename: str, db_uri: str = "mongodb://localhost:27017") -> Dict[str, Any]:
+def store_pdf(pdf_file: bytes, filename: str, db_uri: str = "mongodb://localhost:27017",
+              duplicates: Optional[str] = None, duplicate_threshold: float = DEFAULT_THRESHOLD,
+              tenant: Optional[str] = None) -> Dict[str, Any]:
     """Process and store a PDF file with embeddings."""
-    return brain_core.store_pdf(pdf_file, filename, db_uri)
+    return get_brain_core().store_pdf(pdf_file, filename, db_uri, duplicates, duplicate_threshold, tenant)
 
-def get_all_notes(db_uri: str = "mongodb://localhost:27017") -> List[Dict[str, Any]]:
+def get_all_notes(db_uri: str = "mongodb://localhost:27017",
+                  tenant: Optional[str] = None) -> List[Dict[str, Any]]:
     """Get all your stored notes."""
-    return brain_core.get_all_notes(db_uri)
+    return get_brain_core().get_all_notes(db_uri, tenant)
 
-def get_note_with_embedding(note_id: str, db_uri: str = "mongodb://localhost:27017") -> Optional[Dict[str, Any]]:
+def get_note_with_embedding(note_id: str, db_uri: str = "mongodb://localhost:27017",
+                            tenant: Optional[str] = None) -> Optional[Dict[str, Any]]:
     """Get a specific note with its embedding."""
-    return brain_core.get_note_with_embedding(note_id, db_uri)
+    return get_brain_core().get_note_with_embedding(note_id, db_uri, tenant)
 
-def delete_note(note_id: str, db_uri: str = "mongodb://localhost:27017") -> bool:
+def delete_note(note_id: str, db_uri: str = "mongodb://localhost:27017",
+                tenant: Optional[str] = None) -> bool:
     """Remove a note from the database."""
-    return brain_core.delete_note(note_id, db_uri)
+    return get_brain_core().delete_note(note_id, db_uri, tenant)
+
+def store_notes(notes: List[str], db_uri: str = "mongodb://localhost:27017",
+                tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Save many notes in one batch."""
+    return get_brain_core().store_notes(notes, db_uri, tenant)
+
+def update_notes(updates: List[Dict[str, Any]], db_uri: str = "mongodb://localhost:27017",
+                 tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Replace the text of many notes in one batch."""
+    return get_brain_core().update_notes(updates, db_uri, tenant)
+
+def delete_notes(note_ids: List[str], db_uri: str = "mongodb://localhost:27017",
+                 tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Remove many notes in one batch."""
+    return get_brain_core().delete_notes(note_ids, db_uri, tenant)
+
+def search(query: str, limit: int = 10, mode: str = "hybrid",
+           db_uri: str = "mongodb://localhost:27017", tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Find notes matching a query by keyword, by meaning, or both."""
+    return get_brain_core().search(query, limit, mode, db_uri, tenant)
+
+def find_duplicates(note: str, threshold: float = DEFAULT_THRESHOLD, limit: int = 5,
+                    db_uri: str = "mongodb://localhost:27017",
+                    tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Find stored notes that a text would be a near-duplicate of."""
+    return get_brain_core().find_duplicates(note, threshold, limit, db_uri, tenant)
+
+def rebuild_lexical_index(db_uri: str = "mongodb://localhost:27017", tenant: Optional[str] = None) -> int:
+    """Rebuild the keyword index from all stored notes."""
+    return get_brain_core().rebuild_lexical_index(db_uri, tenant)
+
+def compact_lexical_index(db_uri: str = "mongodb://localhost:27017",
+                          tenant: Optional[str] = None) -> Dict[str, int]:
+    """Merge the keyword index's incremental writes."""
+    return get_brain_core().compact_lexical_index(db_uri, tenant)
 
 def handle_command_line():
     """Handle requests from the web server to process notes."""
@@ -288,16 +787,28 @@ def handle_command_line():
     
     if len(sys.argv) > 2:
         try:
-            data = json.loads(sys.argv[2])
+            # Bulk payloads can outgrow the argument size limit and come on stdin
+            data = json.loads(sys.stdin.read() if sys.argv[2] == "-" else sys.argv[2])
         except json.JSONDecodeError:
             print(json.dumps({"error": "Invalid JSON data"}))
             return
     
+    if data.get("timings"):
+        metrics.enable()
+    started = time.perf_counter()
+    db_uri = configured_db_uri()
+    tenant = data.get("tenant")
+    
     try:
+        # Checked up front so a bad id is reported rather than read as an empty corpus
+        validate_tenant(tenant)
+        
         if function_name == "store_note":
             note = data.get("note", "")
-            note_id = store_note(note)
-            result = {"noteId": note_id, "success": True}
+            duplicates = data.get("duplicates")
+            duplicate_threshold = data.get("duplicate_threshold", DEFAULT_THRESHOLD)
+            note_result = store_note_with_matches(note, db_uri, duplicates, duplicate_threshold, tenant)
+            result = {"noteId": note_result["note_id"], "success": True, **note_result}
             
         elif function_name == "store_pdf":
             import base64
@@ -308,34 +819,82 @@ def handle_command_line():
                 raise ValueError("PDF data is required")
             
             pdf_bytes = base64.b64decode(pdf_base64)
-            pdf_result = store_pdf(pdf_bytes, filename)
+            duplicates = data.get("duplicates")
+            duplicate_threshold = data.get("duplicate_threshold", DEFAULT_THRESHOLD)
+            pdf_result = store_pdf(pdf_bytes, filename, db_uri, duplicates, duplicate_threshold, tenant)
             result = {"pdfId": pdf_result["pdf_id"], "success": True, **pdf_result}
             
         elif function_name == "get_all_notes":
-            notes = get_all_notes()
+            notes = get_all_notes(db_uri, tenant)
             result = {"notes": notes, "success": True}
             
         elif function_name == "embed_text":
             note = data.get("note", "")
-            embedding = embed_text(note)
+            embedding = embed_text(note, db_uri, tenant)
             result = {"embedding": embedding, "success": True}
             
         elif function_name == "get_note_with_embedding":
             note_id = data.get("note_id", "")
-            note = get_note_with_embedding(note_id)
+            note = get_note_with_embedding(note_id, db_uri, tenant)
             result = {"note": note, "success": True}
             
         elif function_name == "delete_note":
             note_id = data.get("note_id", "")
-            deleted = delete_note(note_id)
+            deleted = delete_note(note_id, db_uri, tenant)
             result = {"deleted": deleted, "success": True}
             
+        elif function_name == "store_notes":
+            notes = data.get("notes", [])
+            results = store_notes(notes, db_uri, tenant)
+            result = {"results": results, "stored": sum(1 for r in results if r["success"]), "success": True}
+            
+        elif function_name == "update_notes":
+            updates = data.get("updates", [])
+            results = update_notes(updates, db_uri, tenant)
+            result = {"results": results, "updated": sum(1 for r in results if r.get("updated")), "success": True}
+            
+        elif function_name == "delete_notes":
+            note_ids = data.get("note_ids", [])
+            results = delete_notes(note_ids, db_uri, tenant)
+            result = {"results": results, "deleted": sum(1 for r in results if r["deleted"]), "success": True}
+            
+        elif function_name == "search":
+            query = data.get("query", "")
+            limit = data.get("limit", 10)
+            mode = data.get("mode", "hybrid")
+            notes = search(query, limit, mode, db_uri, tenant)
+            result = {"notes": notes, "success": True}
+            
+        elif function_name == "find_duplicates":
+            note = data.get("note", "")
+            threshold = data.get("threshold", DEFAULT_THRESHOLD)
+            limit = data.get("limit", 5)
+            matches = find_duplicates(note, threshold, limit, db_uri, tenant)
+            result = {"duplicates": matches, "success": True}
+            
+        elif function_name == "rebuild_lexical_index":
+            indexed = rebuild_lexical_index(db_uri, tenant)
+            result = {"indexed": indexed, "success": True}
+            
+        elif function_name == "compact_lexical_index":
+            counts = compact_lexical_index(db_uri, tenant)
+            result = {**counts, "success": True}
+            
+        elif function_name == "metrics":
+            output_format = data.get("format", "json")
+            result = {"metrics": metrics.dump_metrics(output_format), "format": output_format, "success": True}
+            
         else:
             result = {"error": f"Unknown function: {function_name}"}
             
+    except DuplicateNoteError as e:
+        result = {"error": str(e), "duplicates": e.matches, "success": False}
     except Exception as e:
         result = {"error": str(e), "success": False}
     
+    if data.get("timings"):
+        result["timings"] = {"total_ms": round((time.perf_counter() - started) * 1000, 3), **metrics.timings()}
+    
     print(json.dumps(result))
 
 if __name__ == "__main__":
@@ -2,27 +2,38 @@
 Cortex - Clustering Module
 
 This module provides clustering functionality for:
-- Retrieving notes and embeddings from MongoDB
+- Retrieving notes and embeddings from the storage backend
 - Clustering notes using KMeans based on semantic embeddings
 - Automatically determining optimal cluster count using Silhouette Score
+- Optionally clustering on reduced-dimension embeddings for speed
+- Precomputing a cluster tree for drill-down at any granularity
 - Returning clustered notes for visualization and organization
+- Clustering each tenant's notes on their own
 """
 
 import json
 import logging
 import sys
+import time
 from typing import List, Dict, Any, Optional, Tuple
 import numpy as np
 
-# MongoDB
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
-
 # Clustering
 from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import silhouette_score
 
+try:
+    from . import metrics
+    from .projection import fit_corpus_projection, DEFAULT_COMPONENTS
+    from .hierarchy import ClusterTree, StoredClusterTree, DEFAULT_LEAF_SIZE, DEFAULT_MAX_DEPTH
+    from .storage import open_backend, configured_db_uri, validate_tenant
+except ImportError:
+    import metrics
+    from projection import fit_corpus_projection, DEFAULT_COMPONENTS
+    from hierarchy import ClusterTree, StoredClusterTree, DEFAULT_LEAF_SIZE, DEFAULT_MAX_DEPTH
+    from storage import open_backend, configured_db_uri, validate_tenant
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -33,46 +44,60 @@ class BrainClusterer:
         """Initialize the brain clusterer."""
         self.scaler = StandardScaler()
     
-    def get_notes_with_embeddings(self, db_uri: str = "mongodb://localhost:27017") -> List[Dict[str, Any]]:
+    def load_embeddings(self, db_uri: str = "mongodb://localhost:27017",
+                        reduced: bool = False,
+                        tenant: Optional[str] = None) -> Tuple[List[Dict[str, Any]], np.ndarray]:
         """
-        Retrieve all notes with their embeddings from MongoDB.
+        Retrieve all notes and their embeddings as one matrix.
+        
+        On the embedded backend the matrix maps the vector file directly,
+        so nothing is copied until it is scaled or clustered.
         
         Args:
-            db_uri: MongoDB connection URI
+            db_uri: Storage URI, see ``storage.open_backend``
+            reduced: Load the reduced vectors instead of the full embeddings
+            tenant: Tenant whose notes to use, see ``storage.open_backend``
             
         Returns:
-            List of note documents with embeddings
+            Tuple of (notes without embeddings, matrix with one row per note)
         """
         try:
-            client = MongoClient(db_uri, serverSelectionTimeoutMS=5000)
-            client.admin.command('ping')
+            backend = open_backend(db_uri, tenant)
             
-            db = client.notes_db
-            collection = db.notes
+            notes, embeddings = backend.load_notes_with_vectors(reduced)
             
-            # Get all notes with embeddings
-            notes = list(collection.find({}, {
-                "_id": 1, 
-                "note": 1, 
-                "embedding": 1, 
-                "created_at": 1, 
-                "updated_at": 1
-            }))
-            
-            # Convert ObjectId to string for JSON serialization
             for note in notes:
                 note["_id"] = str(note["_id"])
                 note["created_at"] = note["created_at"].isoformat()
                 note["updated_at"] = note["updated_at"].isoformat()
             
-            return notes
+            return notes, embeddings
             
         except Exception as e:
             logger.error(f"Failed to retrieve notes with embeddings: {e}")
             raise
         finally:
-            if 'client' in locals():
-                client.close()
+            if 'backend' in locals():
+                backend.close()
+    
+    def get_notes_with_embeddings(self, db_uri: str = "mongodb://localhost:27017",
+                                  reduced: bool = False,
+                                  tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Retrieve all notes with their embeddings.
+        
+        Args:
+            db_uri: Storage URI, see ``storage.open_backend``
+            reduced: Return the reduced "embedding_reduced" vectors instead of
+                the full embeddings
+            tenant: Tenant whose notes to use, see ``storage.open_backend``
+            
+        Returns:
+            List of note documents with embeddings
+        """
+        notes, embeddings = self.load_embeddings(db_uri, reduced, tenant)
+        _attach_embeddings(notes, embeddings, reduced)
+        return notes
     
     def find_optimal_k(self, embeddings: np.ndarray, max_k: int = 10) -> Tuple[int, float]:
         """
@@ -99,15 +124,17 @@ class BrainClusterer:
         # Test different values of k
         for k in range(2, max_k + 1):
             try:
-                kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
-                cluster_labels = kmeans.fit_predict(embeddings)
+                with metrics.span("cluster.kmeans_fit", k=k, phase="search"):
+                    kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
+                    cluster_labels = kmeans.fit_predict(embeddings)
                 
                 # Calculate silhouette score - handle edge cases
                 if len(np.unique(cluster_labels)) < 2:
                     # Skip if we can't form at least 2 clusters
                     continue
                 
-                silhouette_avg = silhouette_score(embeddings, cluster_labels)
+                with metrics.span("cluster.silhouette", k=k, phase="search"):
+                    silhouette_avg = silhouette_score(embeddings, cluster_labels)
                 
                 logger.info(f"k={k}: Silhouette Score = {silhouette_avg:.4f}")
                 
@@ -123,22 +150,29 @@ class BrainClusterer:
         return optimal_k, best_score
     
     def get_clusters(self, k: Optional[int] = None, db_uri: str = "mongodb://localhost:27017", 
-                    auto_k: bool = True, max_k: int = 10) -> Dict[int, List[Dict[str, Any]]]:
+                    auto_k: bool = True, max_k: int = 10, reduced: bool = False,
+                    tenant: Optional[str] = None) -> Dict[int, List[Dict[str, Any]]]:
         """
         Cluster notes based on their semantic embeddings using KMeans.
         
         Args:
             k: Number of clusters to create (if None and auto_k=True, will be determined automatically)
-            db_uri: MongoDB connection URI
+            db_uri: Storage URI, see ``storage.open_backend``
             auto_k: Whether to automatically determine optimal k using Silhouette Score
             max_k: Maximum number of clusters to test when auto_k=True
+            reduced: Cluster on the reduced vectors kept by ``fit_projection``
+                instead of the full embeddings
+            tenant: Tenant whose notes to use, see ``storage.open_backend``
             
         Returns:
             Dictionary mapping cluster indices to lists of notes
         """
         try:
             # Get all notes with embeddings
-            notes = self.get_notes_with_embeddings(db_uri)
+            with metrics.span("cluster.fetch"):
+                notes, embeddings_array = self.load_embeddings(db_uri, reduced, tenant)
+            _attach_embeddings(notes, embeddings_array, reduced)
+            metrics.observe("cluster_notes", len(notes), buckets=metrics.SIZE_BUCKETS)
             
             if not notes:
                 logger.warning("No notes found for clustering")
@@ -149,11 +183,13 @@ class BrainClusterer:
                 logger.info("Only one note found, returning single cluster")
                 return {0: notes}
             
-            embeddings = [note["embedding"] for note in notes]
-            embeddings_array = np.array(embeddings)
-            
-            # Standardize embeddings
-            embeddings_scaled = self.scaler.fit_transform(embeddings_array)
+            if reduced:
+                # The projection already standardizes before reducing
+                embeddings_scaled = embeddings_array
+            else:
+                # Standardize embeddings
+                with metrics.span("cluster.scale"):
+                    embeddings_scaled = self.scaler.fit_transform(embeddings_array)
             
             # Determine optimal k if auto_k is enabled
             if auto_k and k is None:
@@ -162,7 +198,8 @@ class BrainClusterer:
                     k = 1
                     logger.info(f"Very few notes ({len(notes)}), using k=1")
                 else:
-                    optimal_k, silhouette_score_val = self.find_optimal_k(embeddings_scaled, max_k)
+                    with metrics.span("cluster.find_optimal_k", max_k=max_k):
+                        optimal_k, silhouette_score_val = self.find_optimal_k(embeddings_scaled, max_k)
                     k = optimal_k
                     logger.info(f"Automatically determined optimal k: {k}")
             elif k is None:
@@ -178,12 +215,14 @@ class BrainClusterer:
                 logger.info("k=1, returning single cluster with all notes")
                 return {0: notes}
             
-            kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
-            cluster_labels = kmeans.fit_predict(embeddings_scaled)
+            with metrics.span("cluster.kmeans_fit", k=k, phase="final"):
+                kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
+                cluster_labels = kmeans.fit_predict(embeddings_scaled)
             
             if len(np.unique(cluster_labels)) > 1:
                 try:
-                    final_silhouette = silhouette_score(embeddings_scaled, cluster_labels)
+                    with metrics.span("cluster.silhouette", k=k, phase="final"):
+                        final_silhouette = silhouette_score(embeddings_scaled, cluster_labels)
                     logger.info(f"Final clustering with k={k}: Silhouette Score = {final_silhouette:.4f}")
                 except Exception as e:
                     logger.warning(f"Could not calculate silhouette score: {e}")
@@ -204,7 +243,7 @@ class BrainClusterer:
         except Exception as e:
             logger.error(f"Failed to cluster notes: {e}")
             try:
-                notes = self.get_notes_with_embeddings(db_uri)
+                notes = self.get_notes_with_embeddings(db_uri, reduced, tenant)
                 if notes:
                     logger.info("Returning fallback single cluster")
                     return {0: notes}
@@ -215,21 +254,24 @@ class BrainClusterer:
                 return {}
     
     def get_cluster_summary(self, k: Optional[int] = None, db_uri: str = "mongodb://localhost:27017",
-                           auto_k: bool = True, max_k: int = 10) -> Dict[str, Any]:
+                           auto_k: bool = True, max_k: int = 10, reduced: bool = False,
+                           tenant: Optional[str] = None) -> Dict[str, Any]:
         """
         Get a summary of clusters with statistics.
         
         Args:
             k: Number of clusters to create (if None and auto_k=True, will be determined automatically)
-            db_uri: MongoDB connection URI
+            db_uri: Storage URI, see ``storage.open_backend``
             auto_k: Whether to automatically determine optimal k using Silhouette Score
             max_k: Maximum number of clusters to test when auto_k=True
+            reduced: Cluster on reduced vectors instead of full embeddings
+            tenant: Tenant whose notes to use, see ``storage.open_backend``
             
         Returns:
             Dictionary with cluster summary information
         """
         try:
-            clusters = self.get_clusters(k, db_uri, auto_k, max_k)
+            clusters = self.get_clusters(k, db_uri, auto_k, max_k, reduced, tenant)
             
             summary = {
                 "total_notes": sum(len(notes) for notes in clusters.values()),
@@ -254,21 +296,218 @@ class BrainClusterer:
             logger.error(f"Failed to get cluster summary: {e}")
             raise
 
+    def fit_projection(self, method: str = "pca", n_components: int = DEFAULT_COMPONENTS,
+                       db_uri: str = "mongodb://localhost:27017",
+                       tenant: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Fit a dimensionality-reducing projection and store a reduced vector per note.
+        
+        Args:
+            method: "pca" or "random"
+            n_components: Dimension of the reduced vectors
+            db_uri: Storage URI, see ``storage.open_backend``
+            tenant: Tenant whose notes to use, see ``storage.open_backend``
+            
+        Returns:
+            Summary of the fitted projection
+        """
+        try:
+            backend = open_backend(db_uri, tenant)
+            
+            return fit_corpus_projection(backend, method, n_components)
+            
+        except Exception as e:
+            logger.error(f"Failed to fit projection: {e}")
+            raise
+        finally:
+            if 'backend' in locals():
+                backend.close()
+
+    def build_cluster_tree(self, db_uri: str = "mongodb://localhost:27017", leaf_size: int = DEFAULT_LEAF_SIZE,
+                           max_depth: int = DEFAULT_MAX_DEPTH, reduced: bool = False,
+                           tenant: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Build and store a cluster tree over every note by recursive bisection.
+        
+        Args:
+            db_uri: Storage URI, see ``storage.open_backend``
+            leaf_size: Clusters with at most this many notes are not split further
+            max_depth: Maximum depth of the tree
+            reduced: Build on the reduced vectors kept by ``fit_projection``
+            tenant: Tenant whose notes to use, see ``storage.open_backend``
+            
+        Returns:
+            Summary of the built tree
+        """
+        try:
+            backend = open_backend(db_uri, tenant)
+            
+            with metrics.span("cluster.fetch"):
+                ids, embeddings = backend.load_vectors(reduced)
+            metrics.observe("cluster_notes", len(ids), buckets=metrics.SIZE_BUCKETS)
+            
+            if not reduced and len(ids) > 1:
+                with metrics.span("cluster.scale"):
+                    embeddings = StandardScaler().fit_transform(embeddings)
+            
+            with metrics.span("cluster.tree_build"):
+                tree = ClusterTree(leaf_size, max_depth).build(ids, embeddings)
+            tree.save(backend)
+            
+            return {
+                "notes": len(ids),
+                "nodes": len(tree.parent),
+                "leaves": int((tree.left < 0).sum()),
+                "height": tree.height,
+                "levels": [len(level) for level in tree.levels],
+                "built_at": tree.built_at.isoformat()
+            }
+            
+        except Exception as e:
+            logger.error(f"Failed to build cluster tree: {e}")
+            raise
+        finally:
+            if 'backend' in locals():
+                backend.close()
+    
+    def _describe_nodes(self, backend, nodes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Structure and representative notes of stored tree nodes, with notes fetched in one call."""
+        wanted = [note_id for node in nodes for note_id in node["representatives"]]
+        notes = {note["_id"]: note for note in backend.get_notes(wanted)}
+        described = []
+        for node in nodes:
+            samples = [notes[note_id]["note"] for note_id in node["representatives"] if note_id in notes]
+            described.append({
+                **{key: node[key] for key in ("id", "parent", "depth", "size", "children")},
+                "sample_notes": [sample[:100] + "..." if len(sample) > 100 else sample for sample in samples]
+            })
+        return described
+    
+    def get_cluster_level(self, level: int = 1, db_uri: str = "mongodb://localhost:27017",
+                          tenant: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Read the clusters at one depth of the stored tree, without re-clustering.
+        
+        Level 0 is a single cluster of every note; each level below splits
+        clusters in two until they are small. Levels deeper than the tree
+        return its leaves.
+        
+        Args:
+            level: Depth in the tree
+            db_uri: Storage URI, see ``storage.open_backend``
+            tenant: Tenant whose notes to use, see ``storage.open_backend``
+            
+        Returns:
+            Dictionary with the level, the tree height and its clusters
+        """
+        try:
+            backend = open_backend(db_uri, tenant)
+            
+            tree = StoredClusterTree.open(backend)
+            if tree is None:
+                raise ValueError("No cluster tree has been built; run build_cluster_tree first")
+            
+            return {
+                "level": min(level, tree.height),
+                "height": tree.height,
+                "built_at": tree.built_at.isoformat() if tree.built_at else None,
+                "clusters": self._describe_nodes(backend, tree.level(level))
+            }
+            
+        except Exception as e:
+            logger.error(f"Failed to read cluster level {level}: {e}")
+            raise
+        finally:
+            if 'backend' in locals():
+                backend.close()
+    
+    def get_cluster_node(self, node_id: int = 0, db_uri: str = "mongodb://localhost:27017",
+                         include_notes: bool = True, tenant: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Read one cluster of the stored tree with its children, for zooming in.
+        
+        Args:
+            node_id: Tree node to read; 0 is the root
+            db_uri: Storage URI, see ``storage.open_backend``
+            include_notes: Also return every note in the cluster
+            tenant: Tenant whose notes to use, see ``storage.open_backend``
+            
+        Returns:
+            Dictionary describing the node, its children and optionally its notes
+        """
+        try:
+            backend = open_backend(db_uri, tenant)
+            
+            tree = StoredClusterTree.open(backend)
+            if tree is None:
+                raise ValueError("No cluster tree has been built; run build_cluster_tree first")
+            
+            stored, stored_children = tree.node(node_id)
+            node, *children = self._describe_nodes(backend, [stored] + stored_children)
+            node["children"] = children
+            
+            if include_notes:
+                notes = backend.get_notes(tree.note_ids(stored))
+                for note in notes:
+                    note["_id"] = str(note["_id"])
+                    note["created_at"] = note["created_at"].isoformat()
+                    note["updated_at"] = note["updated_at"].isoformat()
+                node["notes"] = notes
+            
+            return node
+            
+        except Exception as e:
+            logger.error(f"Failed to read cluster node {node_id}: {e}")
+            raise
+        finally:
+            if 'backend' in locals():
+                backend.close()
+
+def _attach_embeddings(notes: List[Dict[str, Any]], embeddings: np.ndarray, reduced: bool) -> None:
+    """Add each note's row of the matrix to it as a list, as API responses carry them."""
+    field = "embedding_reduced" if reduced else "embedding"
+    for note, embedding in zip(notes, embeddings):
+        note[field] = embedding.tolist()
+
 brain_clusterer = BrainClusterer()
 
 def get_clusters(k: Optional[int] = None, db_uri: str = "mongodb://localhost:27017", 
-                auto_k: bool = True, max_k: int = 10) -> Dict[int, List[Dict[str, Any]]]:
+                auto_k: bool = True, max_k: int = 10, reduced: bool = False,
+                tenant: Optional[str] = None) -> Dict[int, List[Dict[str, Any]]]:
     """Cluster notes based on their semantic embeddings."""
-    return brain_clusterer.get_clusters(k, db_uri, auto_k, max_k)
+    return brain_clusterer.get_clusters(k, db_uri, auto_k, max_k, reduced, tenant)
 
 def get_cluster_summary(k: Optional[int] = None, db_uri: str = "mongodb://localhost:27017",
-                       auto_k: bool = True, max_k: int = 10) -> Dict[str, Any]:
+                       auto_k: bool = True, max_k: int = 10, reduced: bool = False,
+                       tenant: Optional[str] = None) -> Dict[str, Any]:
     """Get a summary of clusters with statistics."""
-    return brain_clusterer.get_cluster_summary(k, db_uri, auto_k, max_k)
+    return brain_clusterer.get_cluster_summary(k, db_uri, auto_k, max_k, reduced, tenant)
+
+def get_notes_with_embeddings(db_uri: str = "mongodb://localhost:27017", reduced: bool = False,
+                              tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Retrieve all notes with their embeddings."""
+    return brain_clusterer.get_notes_with_embeddings(db_uri, reduced, tenant)
 
-def get_notes_with_embeddings(db_uri: str = "mongodb://localhost:27017") -> List[Dict[str, Any]]:
-    """Retrieve all notes with their embeddings from MongoDB."""
-    return brain_clusterer.get_notes_with_embeddings(db_uri)
+def fit_projection(method: str = "pca", n_components: int = DEFAULT_COMPONENTS,
+                   db_uri: str = "mongodb://localhost:27017", tenant: Optional[str] = None) -> Dict[str, Any]:
+    """Fit a projection and store a reduced vector for every note."""
+    return brain_clusterer.fit_projection(method, n_components, db_uri, tenant)
+
+def build_cluster_tree(db_uri: str = "mongodb://localhost:27017", leaf_size: int = DEFAULT_LEAF_SIZE,
+                       max_depth: int = DEFAULT_MAX_DEPTH, reduced: bool = False,
+                       tenant: Optional[str] = None) -> Dict[str, Any]:
+    """Build and store a cluster tree over every note."""
+    return brain_clusterer.build_cluster_tree(db_uri, leaf_size, max_depth, reduced, tenant)
+
+def get_cluster_level(level: int = 1, db_uri: str = "mongodb://localhost:27017",
+                      tenant: Optional[str] = None) -> Dict[str, Any]:
+    """Read the clusters at one depth of the stored tree."""
+    return brain_clusterer.get_cluster_level(level, db_uri, tenant)
+
+def get_cluster_node(node_id: int = 0, db_uri: str = "mongodb://localhost:27017",
+                     include_notes: bool = True, tenant: Optional[str] = None) -> Dict[str, Any]:
+    """Read one cluster of the stored tree with its children."""
+    return brain_clusterer.get_cluster_node(node_id, db_uri, include_notes, tenant)
 
 def find_optimal_k(embeddings: np.ndarray, max_k: int = 10) -> Tuple[int, float]:
     """Find the optimal number of clusters using Silhouette Score."""
@@ -290,31 +529,71 @@ def handle_command_line():
             print(json.dumps({"error": "Invalid JSON data"}))
             return
     
+    if data.get("timings"):
+        metrics.enable()
+    started = time.perf_counter()
+    db_uri = configured_db_uri()
+    tenant = data.get("tenant")
+    
     try:
+        # Checked up front so a bad id is reported rather than read as an empty corpus
+        validate_tenant(tenant)
+        
         if function_name == "get_clusters":
             k = data.get("k")
             auto_k = data.get("auto_k", True)
             max_k = data.get("max_k", 10)
-            clusters = get_clusters(k, auto_k=auto_k, max_k=max_k)
+            reduced = data.get("reduced", False)
+            clusters = get_clusters(k, db_uri, auto_k=auto_k, max_k=max_k, reduced=reduced, tenant=tenant)
             result = {"clusters": clusters, "success": True}
             
         elif function_name == "get_cluster_summary":
             k = data.get("k")
             auto_k = data.get("auto_k", True)
             max_k = data.get("max_k", 10)
-            summary = get_cluster_summary(k, auto_k=auto_k, max_k=max_k)
+            reduced = data.get("reduced", False)
+            summary = get_cluster_summary(k, db_uri, auto_k=auto_k, max_k=max_k, reduced=reduced, tenant=tenant)
             result = {"summary": summary, "success": True}
             
         elif function_name == "get_notes_with_embeddings":
-            notes = get_notes_with_embeddings()
+            notes = get_notes_with_embeddings(db_uri, tenant=tenant)
             result = {"notes": notes, "success": True}
             
+        elif function_name == "fit_projection":
+            method = data.get("method", "pca")
+            n_components = data.get("n_components", DEFAULT_COMPONENTS)
+            projection = fit_projection(method, n_components, db_uri, tenant)
+            result = {"projection": projection, "success": True}
+            
+        elif function_name == "build_cluster_tree":
+            leaf_size = data.get("leaf_size", DEFAULT_LEAF_SIZE)
+            max_depth = data.get("max_depth", DEFAULT_MAX_DEPTH)
+            reduced = data.get("reduced", False)
+            tree = build_cluster_tree(db_uri, leaf_size, max_depth, reduced, tenant)
+            result = {"tree": tree, "success": True}
+            
+        elif function_name == "get_cluster_level":
+            level = data.get("level", 1)
+            result = {**get_cluster_level(level, db_uri, tenant), "success": True}
+            
+        elif function_name == "get_cluster_node":
+            node_id = data.get("node_id", 0)
+            include_notes = data.get("include_notes", True)
+            result = {"node": get_cluster_node(node_id, db_uri, include_notes, tenant), "success": True}
+            
+        elif function_name == "metrics":
+            output_format = data.get("format", "json")
+            result = {"metrics": metrics.dump_metrics(output_format), "format": output_format, "success": True}
+            
         else:
             result = {"error": f"Unknown function: {function_name}"}
             
     except Exception as e:
         result = {"error": str(e), "success": False}
     
+    if data.get("timings"):
+        result["timings"] = {"total_ms": round((time.perf_counter() - started) * 1000, 3), **metrics.timings()}
+    
     print(json.dumps(result))
 
 if __name__ == "__main__":
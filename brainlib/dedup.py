@@ -0,0 +1,506 @@
+"""
+Cortex - Near-Duplicate Module
+
+This module finds notes that say almost the same thing:
+- Indexing embeddings with random-hyperplane LSH, so a new note is compared
+  with the few stored notes that share a hash bucket instead of all of them
+- Flagging or rejecting new notes above a cosine similarity threshold
+- Finding every near-duplicate pair offline, exactly with blocked matrix
+  products or approximately with LSH, in bounded memory
+- Reporting the pairs as merge groups, oldest note first
+"""
+
+import json
+import logging
+import os
+import sys
+import tempfile
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime
+
+import numpy as np
+from bson.binary import Binary
+
+try:
+    from .projection import cosine_top_k
+    from .storage import open_backend, configured_db_uri
+except ImportError:
+    from projection import cosine_top_k
+    from storage import open_backend, configured_db_uri
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 0.95
+DEFAULT_BITS = 16
+DEFAULT_TABLES = 20
+DUPLICATE_ACTIONS = ("flag", "reject")
+GROUP_METHODS = ("blocked", "lsh")
+
+# Upper bound on the notes compared exactly with a new one
+MAX_CANDIDATES = 200
+
+_INDEX_ARTIFACT = "duplicate_index"
+
+
+class DuplicateNoteError(ValueError):
+    """Raised when a note is rejected for being too similar to stored ones."""
+
+    def __init__(self, message: str, matches: List[Dict[str, Any]]):
+        super().__init__(message)
+        self.matches = matches
+
+
+class DuplicateIndex:
+    """
+    Random-hyperplane LSH for cosine similarity.
+
+    Each of ``tables`` hash tables signs an embedding with ``bits`` random
+    hyperplanes. Two embeddings at angle theta agree on a bit with probability
+    1 - theta / pi, so near-duplicates share a bucket in at least one table
+    with high probability while unrelated notes rarely do. With the defaults,
+    a pair at cosine 0.95 shares a bucket about 98% of the time.
+    """
+
+    def __init__(self, bits: int = DEFAULT_BITS, tables: int = DEFAULT_TABLES):
+        """
+        Initialize an unfitted index.
+
+        Args:
+            bits: Hyperplanes per table; more bits mean smaller buckets
+            tables: Number of hash tables; more tables mean better recall
+        """
+        if not 1 <= bits <= 32:
+            raise ValueError("bits must be between 1 and 32")
+        if tables < 1:
+            raise ValueError("tables must be positive")
+        self.bits = bits
+        self.tables = tables
+        self.planes = None
+
+    @property
+    def is_fitted(self) -> bool:
+        """Whether hyperplanes have been drawn."""
+        return self.planes is not None
+
+    def fit(self, dim: int, random_state: int = 42) -> "DuplicateIndex":
+        """Draw the hyperplanes for embeddings of dimension ``dim``."""
+        rng = np.random.default_rng(random_state)
+        self.planes = rng.standard_normal((self.tables * self.bits, dim)).astype(np.float32)
+        return self
+
+    def buckets(self, embeddings: np.ndarray) -> np.ndarray:
+        """
+        Hash embeddings of shape (n, dim) or (dim,) into one bucket per table.
+
+        Returns:
+            Array of shape (n, tables); buckets of different tables never collide
+        """
+        if not self.is_fitted:
+            raise RuntimeError("duplicate index not fitted")
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        signs = (embeddings @ self.planes.T > 0).reshape(len(embeddings), self.tables, self.bits)
+        codes = signs.astype(np.int64) @ (np.int64(1) << np.arange(self.bits, dtype=np.int64))
+        return codes + (np.arange(self.tables, dtype=np.int64) << self.bits)
+
+    def to_document(self) -> Dict[str, Any]:
+        """Serialize the hyperplanes for storage."""
+        return {
+            "bits": self.bits,
+            "tables": self.tables,
+            "dim": int(self.planes.shape[1]),
+            "planes": Binary(self.planes.tobytes()),
+            "built_at": datetime.utcnow()
+        }
+
+    @classmethod
+    def from_document(cls, document: Dict[str, Any]) -> "DuplicateIndex":
+        """Rebuild a fitted index from its stored form."""
+        index = cls(document["bits"], document["tables"])
+        index.planes = np.frombuffer(document["planes"], dtype=np.float32).reshape(-1, document["dim"])
+        return index
+
+    def save(self, backend) -> None:
+        """Store the index as the current one."""
+        backend.put_artifact(_INDEX_ARTIFACT, self.to_document())
+
+    @classmethod
+    def load(cls, backend) -> Optional["DuplicateIndex"]:
+        """Load the current index, or None if none has been built."""
+        document = backend.get_artifact(_INDEX_ARTIFACT)
+        if document is None:
+            return None
+        return cls.from_document(document)
+
+    @staticmethod
+    def discard(backend) -> None:
+        """Remove the current index and every note's buckets."""
+        backend.delete_artifact(_INDEX_ARTIFACT)
+        backend.clear_lsh_buckets()
+
+
+def build_duplicate_index(backend, bits: int = DEFAULT_BITS, tables: int = DEFAULT_TABLES,
+                          batch_size: int = 10000) -> Dict[str, Any]:
+    """
+    Draw a new index and put every stored note in it.
+
+    Notes stored afterwards are added as they are stored.
+
+    Args:
+        backend: Storage backend holding the notes
+        bits: Hyperplanes per table
+        tables: Number of hash tables
+        batch_size: Number of notes hashed and written at a time
+
+    Returns:
+        Summary of the built index
+    """
+    dim = backend.embedding_dim()
+    if not dim:
+        raise ValueError("No notes to index")
+
+    index = DuplicateIndex(bits, tables).fit(dim)
+    # Saved first so notes stored during the build are hashed with the new planes
+    index.save(backend)
+    indexed = 0
+    for notes, embeddings in backend.iter_notes(batch_size):
+        backend.set_lsh_buckets([note["_id"] for note in notes], index.buckets(embeddings))
+        indexed += len(notes)
+
+    logger.info(f"Indexed {indexed} notes for near-duplicate lookup in {tables} tables of {bits} bits")
+    return {"bits": bits, "tables": tables, "indexed": indexed}
+
+
+def ensure_duplicate_index(backend) -> Optional[DuplicateIndex]:
+    """
+    Load the near-duplicate index, building it first if there is none.
+
+    Building reads every stored note once; checks after that only compare a
+    few candidates.
+
+    Returns:
+        The index, or None if no notes are stored yet
+    """
+    index = DuplicateIndex.load(backend)
+    if index is None and backend.embedding_dim():
+        logger.warning("No near-duplicate index; building one now. Run build_index ahead of time to avoid the wait")
+        build_duplicate_index(backend)
+        index = DuplicateIndex.load(backend)
+    return index
+
+
+def find_similar_notes(backend, embedding: np.ndarray, threshold: float = DEFAULT_THRESHOLD,
+                       limit: int = 5, index: Optional[DuplicateIndex] = None) -> List[Dict[str, Any]]:
+    """
+    Find stored notes whose embedding is within a cosine threshold of one embedding.
+
+    Only notes sharing an LSH bucket with the embedding are compared exactly.
+    Without a built index one is built first, see ``ensure_duplicate_index``.
+
+    Args:
+        backend: Storage backend holding the notes
+        embedding: Full embedding to compare against
+        threshold: Minimum cosine similarity to report
+        limit: Maximum number of notes to return
+        index: Index already loaded from the backend, to save loading it again
+
+    Returns:
+        Matches as {"note_id", "similarity"}, most similar first
+    """
+    embedding = np.asarray(embedding, dtype=np.float32)
+    if index is None:
+        index = ensure_duplicate_index(backend)
+    if index is None:
+        return []
+    candidates = backend.lsh_candidates(index.buckets(embedding)[0].tolist(), MAX_CANDIDATES)
+    ids, vectors = backend.get_vectors(candidates) if candidates else ([], None)
+    if not ids:
+        return []
+
+    top, similarities = cosine_top_k(vectors, embedding, limit)
+    return [
+        {"note_id": ids[i], "similarity": round(float(similarity), 4)}
+        for i, similarity in zip(top, similarities) if similarity >= threshold
+    ]
+
+
+def check_duplicates(backend, embedding: np.ndarray, action: str,
+                     threshold: float = DEFAULT_THRESHOLD,
+                     index: Optional[DuplicateIndex] = None) -> List[Dict[str, Any]]:
+    """
+    Check a new note's embedding against stored notes before it is inserted.
+
+    Args:
+        backend: Storage backend holding the notes
+        embedding: Full embedding of the new note
+        action: "flag" to return the matches, or "reject" to raise if there are any
+        threshold: Minimum cosine similarity of a near-duplicate
+        index: Index already loaded from the backend, to save loading it again
+
+    Returns:
+        Matches as {"note_id", "similarity"}, most similar first
+
+    Raises:
+        DuplicateNoteError: If action is "reject" and a near-duplicate exists
+    """
+    if action not in DUPLICATE_ACTIONS:
+        raise ValueError(f"Unknown duplicate action: {action}")
+
+    matches = find_similar_notes(backend, embedding, threshold, index=index)
+    if matches and action == "reject":
+        best = matches[0]
+        raise DuplicateNoteError(
+            f"Near-duplicate of note {best['note_id']} (similarity {best['similarity']:.3f})", matches)
+    return matches
+
+
+def _spill_embeddings(backend, directory: str, batch_size: int) -> Tuple[List[str], np.ndarray]:
+    """
+    Copy every stored embedding into a float32 file and map it read-only.
+
+    Notes are streamed a batch at a time, so only the ids are held in memory
+    and the matrix is paged in by the tiles that read it.
+
+    Returns:
+        Tuple of (note ids, memory-mapped matrix with one row per note)
+    """
+    path = os.path.join(directory, "embeddings.f32")
+    ids, dim = [], 0
+    with open(path, "wb") as spill:
+        for notes, embeddings in backend.iter_notes(batch_size):
+            ids.extend(note["_id"] for note in notes)
+            dim = embeddings.shape[1]
+            np.ascontiguousarray(embeddings, dtype=np.float32).tofile(spill)
+    if not ids:
+        return [], np.empty((0, 0), dtype=np.float32)
+    return ids, np.memmap(path, dtype=np.float32, mode="r", shape=(len(ids), dim))
+
+
+def _norms(embeddings: np.ndarray, block_size: int) -> np.ndarray:
+    """Row norms, computed a block at a time so memory-mapped matrices stay on disk."""
+    norms = np.empty(len(embeddings), dtype=np.float32)
+    for start in range(0, len(embeddings), block_size):
+        norms[start:start + block_size] = np.linalg.norm(embeddings[start:start + block_size], axis=1)
+    return np.maximum(norms, 1e-12)
+
+
+def _blocked_pairs(embeddings: np.ndarray, norms: np.ndarray, threshold: float,
+                   block_size: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Every pair of rows with cosine similarity at or above the threshold.
+
+    Similarities are computed one (block_size, block_size) tile of the upper
+    triangle at a time, so memory stays bounded however many rows there are.
+
+    Returns:
+        Tuple of (first rows, second rows, similarities), first < second
+    """
+    n = len(embeddings)
+    first, second, similarities = [], [], []
+    for row_start in range(0, n, block_size):
+        rows = embeddings[row_start:row_start + block_size] / norms[row_start:row_start + block_size, None]
+        for col_start in range(row_start, n, block_size):
+            if col_start == row_start:
+                cols = rows
+            else:
+                cols = embeddings[col_start:col_start + block_size] / norms[col_start:col_start + block_size, None]
+            tile = rows @ cols.T
+            hits = tile >= threshold
+            if col_start == row_start:
+                # Only the upper triangle, without each row paired with itself
+                hits &= np.triu(np.ones(hits.shape, dtype=bool), k=1)
+            i, j = np.nonzero(hits)
+            first.append(i + row_start)
+            second.append(j + col_start)
+            similarities.append(tile[i, j])
+    if not first:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    return np.concatenate(first), np.concatenate(second), np.concatenate(similarities)
+
+
+def _lsh_pairs(embeddings: np.ndarray, norms: np.ndarray, index: DuplicateIndex, threshold: float,
+               block_size: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Near-duplicate pairs among rows that share an LSH bucket.
+
+    Tables are processed one at a time. Buckets up to ``block_size`` rows
+    yield candidate pairs with vectorized offsets over the sorted codes, and
+    larger ones are compared with blocked products, so memory is bounded by
+    one table's candidates. Candidates are checked with exact cosine.
+
+    Returns:
+        Tuple of (first rows, second rows, similarities), first < second
+    """
+    n = len(embeddings)
+    buckets = np.concatenate([index.buckets(embeddings[start:start + block_size])
+                              for start in range(0, n, block_size)])
+    found = {}
+    for table in range(index.tables):
+        order = np.argsort(buckets[:, table], kind="stable")
+        codes = buckets[order, table]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        lengths = np.diff(np.r_[starts, n])
+
+        candidates_first, candidates_second = [], []
+        small = np.repeat(lengths <= block_size, lengths)
+        for offset in range(1, int(lengths[lengths <= block_size].max(initial=1))):
+            same = (codes[:-offset] == codes[offset:]) & small[:-offset]
+            if not same.any():
+                break
+            candidates_first.append(order[:-offset][same])
+            candidates_second.append(order[offset:][same])
+
+        if candidates_first:
+            i = np.concatenate(candidates_first)
+            j = np.concatenate(candidates_second)
+            i, j = np.minimum(i, j), np.maximum(i, j)
+            for start in range(0, len(i), block_size * 16):
+                chunk_i, chunk_j = i[start:start + block_size * 16], j[start:start + block_size * 16]
+                similarities = np.einsum("ij,ij->i", embeddings[chunk_i], embeddings[chunk_j]) / (norms[chunk_i] * norms[chunk_j])
+                for a, b, similarity in zip(chunk_i[similarities >= threshold], chunk_j[similarities >= threshold],
+                                            similarities[similarities >= threshold]):
+                    found[(int(a), int(b))] = float(similarity)
+
+        for bucket_start, length in zip(starts[lengths > block_size], lengths[lengths > block_size]):
+            members = np.sort(order[bucket_start:bucket_start + length])
+            first, second, similarities = _blocked_pairs(embeddings[members], norms[members], threshold, block_size)
+            for a, b, similarity in zip(members[first], members[second], similarities):
+                found[(int(a), int(b))] = float(similarity)
+
+    if not found:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    pairs = np.array(list(found), dtype=np.int64)
+    return pairs[:, 0], pairs[:, 1], np.array(list(found.values()), dtype=np.float32)
+
+
+def _find_pairs(backend, embeddings: np.ndarray, threshold: float, method: str,
+                block_size: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Near-duplicate pairs of rows with the given method, see ``find_duplicate_groups``."""
+    norms = _norms(embeddings, block_size)
+    if method == "blocked":
+        return _blocked_pairs(embeddings, norms, threshold, block_size)
+    index = DuplicateIndex.load(backend)
+    if index is None:
+        index = DuplicateIndex().fit(embeddings.shape[1])
+    return _lsh_pairs(embeddings, norms, index, threshold, block_size)
+
+
+def find_duplicate_groups(backend, threshold: float = DEFAULT_THRESHOLD, method: str = "blocked",
+                          block_size: int = 2048) -> Dict[str, Any]:
+    """
+    Find every near-duplicate pair of stored notes and group them for merging.
+
+    Pairs are joined transitively into groups, so a note edited twice ends up
+    in one group with both of its revisions. Embeddings are streamed into a
+    temporary memory-mapped file rather than loaded whole.
+
+    Args:
+        backend: Storage backend holding the notes
+        threshold: Minimum cosine similarity of a near-duplicate pair
+        method: "blocked" to compare every pair exactly in O(n^2) time, or
+            "lsh" to compare only pairs sharing a bucket of the stored index,
+            which may miss a few pairs
+        block_size: Rows per tile and per streamed batch; memory grows with
+            its square
+
+    Returns:
+        Report with the number of notes and pairs, and the groups, largest
+        first, each with the note to "keep" (the oldest) and its "duplicates"
+    """
+    if not 0 < threshold <= 1:
+        raise ValueError("threshold must be in (0, 1]")
+    if method not in GROUP_METHODS:
+        raise ValueError(f"Unknown method: {method}")
+
+    with tempfile.TemporaryDirectory(prefix="cortex-dedup-") as directory:
+        ids, embeddings = _spill_embeddings(backend, directory, block_size)
+        report = {"notes": len(ids), "method": method, "threshold": threshold, "pairs": 0, "groups": []}
+        if len(ids) < 2:
+            return report
+        first, second, similarities = _find_pairs(backend, embeddings, threshold, method, block_size)
+        # Closed before the directory is removed
+        del embeddings
+
+    report["pairs"] = len(first)
+    if not len(first):
+        return report
+
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    graph = coo_matrix((np.ones(len(first)), (first, second)), shape=(len(ids), len(ids)))
+    _, labels = connected_components(graph, directed=False)
+    grouped = np.unique(np.concatenate([first, second]))
+    pair_labels = labels[first]
+
+    members = {}
+    for row in grouped:
+        members.setdefault(int(labels[row]), []).append(ids[row])
+    created = {note["_id"]: note["created_at"] for note in backend.get_notes([note_id for group in members.values() for note_id in group])}
+
+    groups = []
+    for label, note_ids in members.items():
+        note_ids.sort(key=lambda note_id: created.get(note_id) or datetime.max)
+        group_similarities = similarities[pair_labels == label]
+        groups.append({
+            "keep": note_ids[0],
+            "duplicates": note_ids[1:],
+            "size": len(note_ids),
+            "min_similarity": round(float(group_similarities.min()), 4),
+            "max_similarity": round(float(group_similarities.max()), 4)
+        })
+    groups.sort(key=lambda group: group["size"], reverse=True)
+    report["groups"] = groups
+
+    logger.info(f"Found {len(first)} near-duplicate pairs in {len(groups)} groups among {len(ids)} notes")
+    return report
+
+
+def handle_command_line():
+    """Handle command line arguments for the near-duplicate index and report."""
+    if len(sys.argv) < 2:
+        print(json.dumps({"error": "Function name required"}))
+        return
+
+    function_name = sys.argv[1]
+    data = {}
+
+    if len(sys.argv) > 2:
+        try:
+            data = json.loads(sys.argv[2])
+        except json.JSONDecodeError:
+            print(json.dumps({"error": "Invalid JSON data"}))
+            return
+
+    db_uri = configured_db_uri()
+    tenant = data.get("tenant")
+
+    try:
+        backend = open_backend(db_uri, tenant)
+
+        if function_name == "build_index":
+            bits = data.get("bits", DEFAULT_BITS)
+            tables = data.get("tables", DEFAULT_TABLES)
+            index = build_duplicate_index(backend, bits, tables)
+            result = {"index": index, "success": True}
+
+        elif function_name == "find_groups":
+            threshold = data.get("threshold", DEFAULT_THRESHOLD)
+            method = data.get("method", "blocked")
+            block_size = data.get("block_size", 2048)
+            report = find_duplicate_groups(backend, threshold, method, block_size)
+            result = {**report, "success": True}
+
+        else:
+            result = {"error": f"Unknown function: {function_name}"}
+
+    except Exception as e:
+        result = {"error": str(e), "success": False}
+    finally:
+        if 'backend' in locals():
+            backend.close()
+
+    print(json.dumps(result))
+
+if __name__ == "__main__":
+    handle_command_line()
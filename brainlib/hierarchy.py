@@ -0,0 +1,378 @@
+"""
+Cortex - Cluster Hierarchy Module
+
+This module builds a multi-resolution cluster tree for drill-down:
+- Recursively bisecting the notes with 2-means until clusters are small
+- Keeping every node's notes as one contiguous range of a single ordering
+- Precomputing the partition at every depth and each node's representative notes
+- Storing the tree with the storage backend so reads never re-cluster, one
+  blob per level and per chunk of note ids, so a read loads only the level
+  or node it asks for
+"""
+
+import bisect
+import logging
+import uuid
+import zlib
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime
+
+import bson
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEAF_SIZE = 50
+DEFAULT_MAX_DEPTH = 16
+REPRESENTATIVES = 3
+
+_TREE_ARTIFACT = "cluster_tree"
+_TREE_FORMAT = 2
+
+# Note ids are stored in blobs of this many, so a node's notes load without the rest
+IDS_PER_BLOB = 10000
+
+
+def _bisect(points: np.ndarray, rng: np.random.Generator, iterations: int = 20) -> np.ndarray:
+    """
+    Split points into two groups with 2-means.
+
+    The centroids start at the two ends of an approximate diameter (a random
+    point's farthest point, and that point's farthest point), which separates
+    well-defined groups without the restarts plain KMeans needs.
+
+    Returns:
+        Boolean array, True for points in the second group
+    """
+    start = points[rng.integers(len(points))]
+    first = points[np.argmax(((points - start) ** 2).sum(axis=1))]
+    second = points[np.argmax(((points - first) ** 2).sum(axis=1))]
+
+    labels = None
+    for _ in range(iterations):
+        # Closer to the second centroid, compared with one projection on their difference
+        new_labels = points @ (second - first) > (second @ second - first @ first) / 2
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        if labels.all() or not labels.any():
+            break
+        first = points[~labels].mean(axis=0)
+        second = points[labels].mean(axis=0)
+    return labels
+
+
+class ClusterTree:
+    """
+    A binary tree of clusters over a fixed set of notes.
+
+    Notes are kept in one ordering in which every node covers the range
+    ``order[start:end]``, so a node's notes, its children and the partition
+    at any depth can be read without touching the embeddings. Nodes are
+    numbered breadth-first, so the nodes at each depth have consecutive ids.
+    """
+
+    def __init__(self, leaf_size: int = DEFAULT_LEAF_SIZE, max_depth: int = DEFAULT_MAX_DEPTH,
+                 random_state: int = 42):
+        """
+        Initialize an empty tree.
+
+        Args:
+            leaf_size: Clusters with at most this many notes are not split further
+            max_depth: Depth at which splitting stops regardless of size
+            random_state: Seed for the initial centroids
+        """
+        self.leaf_size = max(1, leaf_size)
+        self.max_depth = max_depth
+        self.random_state = random_state
+        self.ids: List[str] = []
+        self.parent = np.empty(0, dtype=np.int32)
+        self.depth = np.empty(0, dtype=np.int32)
+        self.start = np.empty(0, dtype=np.int64)
+        self.end = np.empty(0, dtype=np.int64)
+        self.left = np.empty(0, dtype=np.int32)
+        self.right = np.empty(0, dtype=np.int32)
+        self.representatives = np.empty((0, REPRESENTATIVES), dtype=np.int64)
+        self.levels: List[np.ndarray] = []
+        self.built_at = None
+
+    @property
+    def height(self) -> int:
+        """Depth of the deepest node."""
+        return int(self.depth.max()) if len(self.depth) else 0
+
+    def build(self, ids: List[str], embeddings: np.ndarray) -> "ClusterTree":
+        """
+        Build the tree over notes and their (already scaled) embeddings.
+
+        Every level of the tree touches each note once, so a build costs
+        O(n * dim * height), with a height of about log2(n / leaf_size).
+
+        Args:
+            ids: Note ids, one per row of ``embeddings``
+            embeddings: Array of shape (n, dim)
+
+        Returns:
+            The built tree
+        """
+        n = len(ids)
+        if n == 0:
+            raise ValueError("No notes to build a cluster tree from")
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        rng = np.random.default_rng(self.random_state)
+
+        order = np.arange(n)
+        parent, depth, start, end, left, right, representatives = [], [], [], [], [], [], []
+
+        # Depth-first with an explicit stack; children are numbered after their parent
+        stack = [(-1, 0, 0, n)]
+        while stack:
+            parent_id, node_depth, node_start, node_end = stack.pop()
+            node_id = len(parent)
+            parent.append(parent_id)
+            depth.append(node_depth)
+            start.append(node_start)
+            end.append(node_end)
+            left.append(-1)
+            right.append(-1)
+            if parent_id >= 0:
+                if left[parent_id] == -1:
+                    left[parent_id] = node_id
+                else:
+                    right[parent_id] = node_id
+
+            members = order[node_start:node_end]
+            points = embeddings[members]
+            distances = ((points - points.mean(axis=0)) ** 2).sum(axis=1)
+            if len(distances) > REPRESENTATIVES:
+                closest = np.argpartition(distances, REPRESENTATIVES)[:REPRESENTATIVES]
+            else:
+                closest = np.arange(len(distances))
+            # Kept as note indices; positions change as descendants are split
+            nearest = members[closest[np.argsort(distances[closest])]]
+            representatives.append(np.pad(nearest, (0, REPRESENTATIVES - len(nearest)), constant_values=-1))
+
+            if node_end - node_start <= self.leaf_size or node_depth >= self.max_depth:
+                continue
+            labels = _bisect(points, rng)
+            split = int((~labels).sum())
+            if split == 0 or split == len(labels):
+                # Identical points can't be separated; keep them as one leaf
+                continue
+
+            # Reorder this node's range so each child is contiguous
+            order[node_start:node_end] = np.concatenate([members[~labels], members[labels]])
+            # Push the right child first so the left one is numbered next
+            stack.append((node_id, node_depth + 1, node_start + split, node_end))
+            stack.append((node_id, node_depth + 1, node_start, node_start + split))
+
+        # Renumber breadth-first; a stable sort by depth keeps siblings in order
+        depth = np.array(depth, dtype=np.int32)
+        renumbered = np.argsort(depth, kind="stable")
+        new_id = np.empty(len(renumbered), dtype=np.int32)
+        new_id[renumbered] = np.arange(len(renumbered), dtype=np.int32)
+
+        def remap(links: List[int]) -> np.ndarray:
+            links = np.array(links, dtype=np.int32)[renumbered]
+            return np.where(links >= 0, new_id[np.maximum(links, 0)], -1).astype(np.int32)
+
+        self.ids = [ids[i] for i in order]
+        self.parent = remap(parent)
+        self.depth = depth[renumbered]
+        self.start = np.array(start, dtype=np.int64)[renumbered]
+        self.end = np.array(end, dtype=np.int64)[renumbered]
+        self.left = remap(left)
+        self.right = remap(right)
+        position = np.empty(n, dtype=np.int64)
+        position[order] = np.arange(n)
+        representatives = np.array(representatives, dtype=np.int64)[renumbered]
+        self.representatives = np.where(representatives >= 0, position[np.maximum(representatives, 0)], -1)
+        self._compute_levels()
+        self.built_at = datetime.utcnow()
+
+        logger.info(f"Built cluster tree over {n} notes: {len(parent)} nodes, height {self.height}")
+        return self
+
+    def is_leaf(self, node_id: int) -> bool:
+        """Whether a node has no children."""
+        return self.left[node_id] < 0
+
+    def children(self, node_id: int) -> List[int]:
+        """Ids of a node's children, empty for a leaf."""
+        if self.is_leaf(node_id):
+            return []
+        return [int(self.left[node_id]), int(self.right[node_id])]
+
+    def _compute_levels(self) -> None:
+        """Precompute the partition of all notes at every depth."""
+        is_leaf = self.left < 0
+        self.levels = []
+        for level in range(self.height + 1):
+            members = (self.depth == level) | (is_leaf & (self.depth < level))
+            nodes = np.flatnonzero(members)
+            # Listed in note order, so neighbouring clusters are siblings
+            self.levels.append(nodes[np.argsort(self.start[nodes], kind="stable")].astype(np.int32))
+
+    def level(self, level: int) -> List[int]:
+        """Node ids partitioning every note at a depth; deeper than the tree means its leaves."""
+        if level < 0:
+            raise ValueError("Level must not be negative")
+        return self.levels[min(level, self.height)].tolist()
+
+    def note_ids(self, node_id: int) -> List[str]:
+        """Ids of every note under a node."""
+        return self.ids[self.start[node_id]:self.end[node_id]]
+
+    def representative_ids(self, node_id: int) -> List[str]:
+        """Ids of the notes closest to a node's centroid."""
+        return [self.ids[position] for position in self.representatives[node_id] if position >= 0]
+
+    def node_info(self, node_id: int) -> Dict[str, Any]:
+        """Structure of one node, without note contents."""
+        return {
+            "id": node_id,
+            "parent": int(self.parent[node_id]) if self.parent[node_id] >= 0 else None,
+            "depth": int(self.depth[node_id]),
+            "size": int(self.end[node_id] - self.start[node_id]),
+            "children": self.children(node_id)
+        }
+
+    def level_entries(self, level: int) -> List[Dict[str, Any]]:
+        """Every node of a level with its note range and representative note ids, as stored."""
+        return [
+            {
+                **self.node_info(node_id),
+                "start": int(self.start[node_id]),
+                "end": int(self.end[node_id]),
+                "representatives": self.representative_ids(node_id)
+            }
+            for node_id in self.level(level)
+        ]
+
+    def save(self, backend) -> None:
+        """
+        Store the tree as the current one.
+
+        Every level and every chunk of the note order goes into a new blob
+        before the header pointing at them is replaced, so readers always see
+        a matching set. The previous tree's blobs are kept until the next
+        save, so a read that started on it can still finish.
+        """
+        previous = backend.get_artifact(_TREE_ARTIFACT)
+        prefix = f"{_TREE_ARTIFACT}:{uuid.uuid4()}"
+        blobs = []
+        for level in range(self.height + 1):
+            name = f"{prefix}:level:{level}"
+            backend.put_blob(name, zlib.compress(bson.encode({"nodes": self.level_entries(level)})))
+            blobs.append(name)
+        for chunk, start in enumerate(range(0, len(self.ids), IDS_PER_BLOB)):
+            name = f"{prefix}:ids:{chunk}"
+            backend.put_blob(name, zlib.compress("\n".join(self.ids[start:start + IDS_PER_BLOB]).encode("utf-8")))
+            blobs.append(name)
+
+        backend.put_artifact(_TREE_ARTIFACT, {
+            "format": _TREE_FORMAT,
+            "leaf_size": self.leaf_size,
+            "max_depth": self.max_depth,
+            "n_notes": len(self.ids),
+            "n_nodes": len(self.parent),
+            "height": self.height,
+            # First node id at each depth, ending with the node count
+            "depth_offsets": np.searchsorted(self.depth, np.arange(self.height + 2)).tolist(),
+            "blob_prefix": prefix,
+            "blobs": blobs,
+            "retired_blobs": _blob_names(previous),
+            "built_at": self.built_at
+        })
+        if previous is not None:
+            for name in previous.get("retired_blobs", []):
+                backend.delete_blob(name)
+
+    @staticmethod
+    def discard(backend) -> None:
+        """Remove the current tree."""
+        document = backend.get_artifact(_TREE_ARTIFACT)
+        if document is not None:
+            backend.delete_artifact(_TREE_ARTIFACT)
+            for name in _blob_names(document) + document.get("retired_blobs", []):
+                backend.delete_blob(name)
+
+
+def _blob_names(document: Optional[Dict[str, Any]]) -> List[str]:
+    """Blobs holding a stored tree, including trees stored before it was split by level."""
+    if document is None:
+        return []
+    if "ids_blob" in document:
+        return [document["ids_blob"]]
+    return list(document.get("blobs", []))
+
+
+class StoredClusterTree:
+    """
+    A saved cluster tree, read a part at a time.
+
+    Opening one reads only its small header. A level, a node with its
+    children, and the note ids under a node each load just the blobs
+    holding them, so a read costs the size of its answer rather than the
+    size of the corpus.
+    """
+
+    def __init__(self, backend, header: Dict[str, Any]):
+        """Wrap the header of a stored tree."""
+        self.backend = backend
+        self.header = header
+
+    @classmethod
+    def open(cls, backend) -> Optional["StoredClusterTree"]:
+        """Open the current tree, or None if none has been built."""
+        header = backend.get_artifact(_TREE_ARTIFACT)
+        if header is None or header.get("format") != _TREE_FORMAT:
+            return None
+        return cls(backend, header)
+
+    @property
+    def height(self) -> int:
+        """Depth of the deepest node."""
+        return self.header["height"]
+
+    @property
+    def built_at(self) -> Optional[datetime]:
+        """When the tree was built."""
+        return self.header.get("built_at")
+
+    def _blob(self, name: str) -> bytes:
+        """Load and decompress one of the tree's blobs."""
+        data = self.backend.get_blob(f"{self.header['blob_prefix']}:{name}")
+        if data is None:
+            raise ValueError("The cluster tree was rebuilt while it was being read; try again")
+        return zlib.decompress(data)
+
+    def level(self, level: int) -> List[Dict[str, Any]]:
+        """Nodes partitioning every note at a depth; deeper than the tree means its leaves."""
+        if level < 0:
+            raise ValueError("Level must not be negative")
+        return bson.decode(self._blob(f"level:{min(level, self.height)}"))["nodes"]
+
+    def node(self, node_id: int) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """One node and its children, read from the levels of their depths."""
+        if not 0 <= node_id < self.header["n_nodes"]:
+            raise ValueError(f"Unknown cluster node: {node_id}")
+        depth = bisect.bisect_right(self.header["depth_offsets"], node_id) - 1
+        node = next(entry for entry in self.level(depth) if entry["id"] == node_id)
+        if not node["children"]:
+            return node, []
+        children = set(node["children"])
+        return node, [entry for entry in self.level(depth + 1) if entry["id"] in children]
+
+    def note_ids(self, node: Dict[str, Any]) -> List[str]:
+        """Ids of every note under a node, loading only the blobs that hold them."""
+        start, end = node["start"], node["end"]
+        if end <= start:
+            return []
+        first_chunk = start // IDS_PER_BLOB
+        ids = []
+        for chunk in range(first_chunk, (end - 1) // IDS_PER_BLOB + 1):
+            ids.extend(self._blob(f"ids:{chunk}").decode("utf-8").split("\n"))
+        offset = first_chunk * IDS_PER_BLOB
+        return ids[start - offset:end - offset]
@@ -0,0 +1,586 @@
+"""
+Cortex - Lexical Index Module
+
+This module provides keyword search over stored notes:
+- Tokenizing note and PDF text at write time
+- Maintaining an inverted index of compact, delta-encoded posting blocks
+  that writers only ever append to, merged offline by ``compact``
+- Scoring matches with BM25
+- Fusing lexical and semantic rankings with reciprocal rank fusion
+"""
+
+import logging
+import math
+import re
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+from typing import List, Dict, Any, Iterable, Iterator, Tuple
+
+import numpy as np
+
+from bson.binary import Binary
+from pymongo import ReturnDocument, UpdateOne
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# Words are runs of letters, digits, underscores and combining marks in any
+# script, as in FTS5's unicode61 tokenizer on the embedded store. Identifiers
+# such as ``store_note`` or ``brainlib.brain`` are kept whole and also split
+# into their parts so either form matches.
+_SPLIT_RE = re.compile(r"[.:/\-]")
+
+
+@lru_cache(maxsize=None)
+def _token_re() -> "re.Pattern":
+    """
+    Compile the token pattern on first use.
+
+    ``re`` has no class for combining marks, so one is built from the Unicode
+    database; that takes tens of milliseconds, which commands that never
+    tokenize should not pay at import.
+    """
+    ranges = []
+    start = None
+    for code in range(0x20001):
+        is_mark = code < 0x20000 and unicodedata.category(chr(code)).startswith("M")
+        if is_mark and start is None:
+            start = code
+        elif not is_mark and start is not None:
+            ranges.append(f"\\U{start:08x}-\\U{code - 1:08x}")
+            start = None
+    word = rf"[\w{''.join(ranges)}]+"
+    return re.compile(rf"{word}(?:[.:/\-]{word})*")
+
+
+# Accents on Latin, Greek and Cyrillic letters, which unicode61 also drops
+_DIACRITICS_RE = re.compile(r"[\u0300-\u036f]")
+MAX_TOKEN_LENGTH = 64
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Reciprocal rank fusion constant (Cormack et al.)
+RRF_K = 60
+
+# Document lengths are stored next to each posting as a single byte on a log
+# scale, the same trade-off Lucene makes for its norms.
+_NORM_SCALE = 255 / math.log1p(2 ** 32)
+
+# Posting blocks stay far below MongoDB's 16MB document limit: at most 7
+# bytes per posting, so well under 1MB per block
+BLOCK_POSTINGS = 65536
+
+# Version of the posting layout; indexes written by older versions need a rebuild
+INDEX_FORMAT = 2
+
+_STATS_ID = "stats"
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into case-folded search terms without accents."""
+    text = unicodedata.normalize("NFC", _DIACRITICS_RE.sub("", unicodedata.normalize("NFD", text.casefold())))
+    tokens = []
+    for token in _token_re().findall(text):
+        if len(token) > MAX_TOKEN_LENGTH:
+            continue
+        tokens.append(token)
+        if _SPLIT_RE.search(token):
+            tokens.extend(part for part in _SPLIT_RE.split(token) if part)
+    return tokens
+
+
+def encode_norm(length: int) -> int:
+    """Quantize a document length into one byte."""
+    return min(255, int(round(math.log1p(length) * _NORM_SCALE)))
+
+
+def decode_norms(norms: np.ndarray) -> np.ndarray:
+    """Recover approximate document lengths from quantized norms."""
+    return np.expm1(norms.astype(np.float64) / _NORM_SCALE)
+
+
+def encode_postings(seqs: np.ndarray, base: int = 0) -> Tuple[bytes, int]:
+    """Delta-encode sorted document numbers, all at least ``base``, into the narrowest integer width."""
+    if len(seqs) == 0:
+        return b"", 1
+    deltas = np.diff(seqs, prepend=base)
+    max_delta = int(deltas.max())
+    if max_delta <= np.iinfo(np.uint8).max:
+        dtype = np.uint8
+    elif max_delta <= np.iinfo(np.uint16).max:
+        dtype = np.uint16
+    else:
+        dtype = np.uint32
+    return deltas.astype(dtype).tobytes(), np.dtype(dtype).itemsize
+
+
+def decode_postings(data: bytes, width: int, base: int = 0) -> np.ndarray:
+    """Decode a delta-encoded posting list back into document numbers."""
+    dtype = {1: np.uint8, 2: np.uint16, 4: np.uint32}[width]
+    return base + np.frombuffer(data, dtype=dtype).astype(np.int64).cumsum()
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[str]], k: int = RRF_K) -> List[Tuple[str, float]]:
+    """Fuse several ranked lists of ids into one, best first."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def _sealed_blocks(term: str, seqs: np.ndarray, tfs: np.ndarray, norms: np.ndarray) -> Iterator[Dict[str, Any]]:
+    """Split a term's postings, sorted by document number, into packed block documents."""
+    for start in range(0, len(seqs), BLOCK_POSTINGS):
+        block = seqs[start:start + BLOCK_POSTINGS]
+        encoded, width = encode_postings(block, int(block[0]))
+        yield {
+            "term": term,
+            "first": int(block[0]),
+            "count": len(block),
+            "width": width,
+            "postings": Binary(encoded),
+            "tfs": Binary(tfs[start:start + BLOCK_POSTINGS].astype(np.uint16).tobytes()),
+            "norms": Binary(norms[start:start + BLOCK_POSTINGS].astype(np.uint8).tobytes())
+        }
+
+
+def _decode_block(block: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Document numbers, term frequencies and norms of one posting block."""
+    if block.get("open"):
+        return (np.array(block["seqs"], dtype=np.int64),
+                np.array(block["tfs"], dtype=np.uint16),
+                np.array(block["norms"], dtype=np.uint8))
+    return (decode_postings(block["postings"], block["width"], block["first"]),
+            np.frombuffer(block["tfs"], dtype=np.uint16),
+            np.frombuffer(block["norms"], dtype=np.uint8))
+
+
+def _merge_blocks(blocks: List[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Postings of one term's blocks in document order, each document once."""
+    decoded = [_decode_block(block) for block in blocks]
+    seqs = np.concatenate([d[0] for d in decoded])
+    tfs = np.concatenate([d[1] for d in decoded])
+    norms = np.concatenate([d[2] for d in decoded])
+    # A note re-added by ``repair`` can appear twice
+    seqs, first = np.unique(seqs, return_index=True)
+    return seqs, tfs[first], norms[first]
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over note text, stored alongside the notes.
+
+    Each term's postings are split over block documents. Writers only append:
+    new postings are pushed onto a small open block per term, and removing a
+    note just decrements the document frequencies of its terms, so a write
+    costs the same however large the corpus is and concurrent writers never
+    conflict. Postings of removed notes are skipped at search time and
+    dropped by ``compact``, which also packs open blocks into delta-encoded
+    blocks of at most ``BLOCK_POSTINGS`` postings.
+
+    Notes are stored with ``lex_pending`` set until their postings are
+    written, so a note whose indexing failed is picked up by ``repair``.
+    """
+
+    # Postings pushed onto one open block before another is started
+    OPEN_BLOCK_POSTINGS = 1024
+
+    def __init__(self, lexicon: str = "lexicon", terms: str = "lexicon_terms", meta: str = "lexicon_meta"):
+        """Initialize the index with the names of its backing collections."""
+        self.lexicon_name = lexicon
+        self.terms_name = terms
+        self.meta_name = meta
+        self._indexes_ready = False
+
+    def ensure_indexes(self, db) -> None:
+        """Create the lookup indexes the postings need, once per index object."""
+        if self._indexes_ready:
+            return
+        db[self.lexicon_name].create_index([("term", 1), ("open", 1)])
+        db.notes.create_index("lex_seq", sparse=True)
+        self._indexes_ready = True
+
+    def prepare(self, db, text: str) -> Dict[str, Any]:
+        """
+        Tokenize text and reserve a document number for it.
+
+        Args:
+            db: Database holding the notes collection
+            text: Note or PDF text to index
+
+        Returns:
+            Fields to store on the note document before calling ``add``
+        """
+        return self.prepare_many(db, [text])[0]
+
+    def prepare_many(self, db, texts: List[str]) -> List[Dict[str, Any]]:
+        """Tokenize several texts and reserve a block of document numbers in one round trip."""
+        if not texts:
+            return []
+        meta = db[self.meta_name].find_one_and_update(
+            {"_id": _STATS_ID},
+            {"$inc": {"next_seq": len(texts)}, "$setOnInsert": {"format": INDEX_FORMAT}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        first_seq = int(meta["next_seq"]) - len(texts) + 1
+
+        prepared = []
+        for offset, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            prepared.append({
+                "lex_seq": first_seq + offset,
+                "lex_len": sum(counts.values()),
+                "lex_terms": {term: min(tf, 65535) for term, tf in counts.items()},
+                "lex_pending": True
+            })
+        return prepared
+
+    def add(self, db, fields: Dict[str, Any]) -> None:
+        """Append a prepared document to the posting blocks of its terms."""
+        self.add_many(db, [fields])
+
+    def add_many(self, db, fields_list: List[Dict[str, Any]]) -> None:
+        """Append prepared documents to the posting blocks of their terms."""
+        if not fields_list:
+            return
+        additions: Dict[str, List[Tuple[int, int, int]]] = {}
+        for fields in fields_list:
+            norm = encode_norm(fields["lex_len"])
+            for term, tf in fields["lex_terms"].items():
+                additions.setdefault(term, []).append((fields["lex_seq"], tf, norm))
+
+        self.ensure_indexes(db)
+        lexicon = db[self.lexicon_name]
+        pushes = []
+        for term, entries in additions.items():
+            for start in range(0, len(entries), self.OPEN_BLOCK_POSTINGS):
+                chunk = entries[start:start + self.OPEN_BLOCK_POSTINGS]
+                # Once the open block is full the filter no longer matches
+                # and the upsert starts a new one
+                pushes.append(UpdateOne(
+                    {"term": term, "open": True, "count": {"$lt": self.OPEN_BLOCK_POSTINGS}},
+                    {
+                        "$push": {
+                            "seqs": {"$each": [seq for seq, _, _ in chunk]},
+                            "tfs": {"$each": [tf for _, tf, _ in chunk]},
+                            "norms": {"$each": [norm for _, _, norm in chunk]}
+                        },
+                        "$inc": {"count": len(chunk)}
+                    },
+                    upsert=True
+                ))
+        for start in range(0, len(pushes), 1000):
+            lexicon.bulk_write(pushes[start:start + 1000], ordered=False)
+
+        self._count_terms(db, {term: len(entries) for term, entries in additions.items()})
+        db[self.meta_name].update_one(
+            {"_id": _STATS_ID},
+            {"$inc": {"n_docs": len(fields_list), "total_len": sum(f["lex_len"] for f in fields_list)}},
+            upsert=True
+        )
+
+    def mark_indexed(self, db, note_ids: List[str]) -> None:
+        """Clear ``lex_pending`` on notes whose postings have been written."""
+        if note_ids:
+            db.notes.update_many({"_id": {"$in": note_ids}}, {"$unset": {"lex_pending": ""}})
+
+    def remove(self, db, note: Dict[str, Any]) -> None:
+        """Drop a stored note from the index."""
+        self.remove_many(db, [note])
+
+    def remove_many(self, db, notes: List[Dict[str, Any]]) -> None:
+        """
+        Drop stored notes from the index.
+
+        Only document frequencies and corpus statistics change here; the
+        postings themselves stay until ``compact``, and search skips them
+        because no note carries their document number any more.
+        """
+        notes = [note for note in notes if "lex_seq" in note]
+        if not notes:
+            return
+        removals: Dict[str, int] = {}
+        for note in notes:
+            for term in note.get("lex_terms", {}):
+                removals[term] = removals.get(term, 0) - 1
+
+        self._count_terms(db, removals)
+        db[self.meta_name].update_one(
+            {"_id": _STATS_ID},
+            {"$inc": {"n_docs": -len(notes), "total_len": -sum(note.get("lex_len", 0) for note in notes)}}
+        )
+
+    def _count_terms(self, db, changes: Dict[str, int]) -> None:
+        """Add to the document frequency of each term."""
+        ops = [UpdateOne({"_id": term}, {"$inc": {"df": change}}, upsert=True)
+               for term, change in changes.items()]
+        for start in range(0, len(ops), 1000):
+            db[self.terms_name].bulk_write(ops[start:start + 1000], ordered=False)
+
+    def search(self, db, query: str, limit: int = 10) -> List[Tuple[str, float]]:
+        """
+        Score indexed notes against a query with BM25.
+
+        Args:
+            db: Database holding the notes collection
+            query: Free-text query
+            limit: Maximum number of results to return
+
+        Returns:
+            List of (note id, score) pairs, best first
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        stats = db[self.meta_name].find_one({"_id": _STATS_ID}) or {}
+        if stats and stats.get("format") != INDEX_FORMAT:
+            logger.warning("Keyword index was built by an older version; run rebuild_lexical_index")
+            return []
+        n_docs = stats.get("n_docs", 0)
+        if n_docs <= 0:
+            return []
+        avg_len = max(stats.get("total_len", 0) / n_docs, 1.0)
+
+        dfs = {doc["_id"]: doc["df"] for doc in db[self.terms_name].find({"_id": {"$in": terms}})}
+        blocks: Dict[str, List[Dict[str, Any]]] = {}
+        for block in db[self.lexicon_name].find({"term": {"$in": [term for term in terms if dfs.get(term, 0) > 0]}}):
+            blocks.setdefault(block["term"], []).append(block)
+
+        all_seqs = []
+        all_scores = []
+        for term, term_blocks in blocks.items():
+            seqs, tfs, norms = _merge_blocks(term_blocks)
+            tfs = tfs.astype(np.float64)
+            lengths = decode_norms(norms)
+            df = dfs[term]
+            idf = math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            denom = tfs + BM25_K1 * (1.0 - BM25_B + BM25_B * lengths / avg_len)
+            all_seqs.append(seqs)
+            all_scores.append(idf * tfs * (BM25_K1 + 1.0) / denom)
+
+        if not all_seqs:
+            return []
+
+        seqs = np.concatenate(all_seqs)
+        scores = np.concatenate(all_scores)
+        unique_seqs, inverse = np.unique(seqs, return_inverse=True)
+        totals = np.bincount(inverse, weights=scores)
+
+        # Postings of removed notes are only dropped by compaction, so the
+        # best candidates are checked against the notes until enough are live
+        window = min(len(totals), 2 * limit)
+        if window < len(totals):
+            top = np.argpartition(-totals, window - 1)[:window]
+            top = top[np.lexsort((unique_seqs[top], -totals[top]))]
+        else:
+            top = np.lexsort((unique_seqs, -totals))
+
+        hits = []
+        order = None
+        position = 0
+        while True:
+            seq_to_id = {
+                doc["lex_seq"]: doc["_id"]
+                for doc in db.notes.find({"lex_seq": {"$in": unique_seqs[top].tolist()}}, {"_id": 1, "lex_seq": 1})
+            }
+            for i in top:
+                note_id = seq_to_id.get(int(unique_seqs[i]))
+                if note_id is not None:
+                    hits.append((note_id, float(totals[i])))
+                    if len(hits) >= limit:
+                        return hits
+            if order is None:
+                if window >= len(totals):
+                    return hits
+                order = np.lexsort((unique_seqs, -totals))
+                order = order[~np.isin(order, top)]
+            if position >= len(order):
+                return hits
+            top = order[position:position + max(4 * limit, 1000)]
+            position += len(top)
+
+    def repair(self, db, batch_size: int = 1000) -> int:
+        """
+        Write the postings of notes still marked ``lex_pending``.
+
+        A note is marked before it is stored and cleared once its postings
+        are written, so this catches notes whose indexing failed or was cut
+        short. Postings written twice are merged by search and ``compact``.
+
+        Returns:
+            Number of notes indexed
+        """
+        repaired = 0
+        while True:
+            notes = list(db.notes.find({"lex_pending": True},
+                                       {"lex_seq": 1, "lex_len": 1, "lex_terms": 1}).limit(batch_size))
+            if not notes:
+                break
+            self.add_many(db, [note for note in notes if "lex_seq" in note])
+            # A note re-indexed since it was read keeps the flag for its new postings
+            db.notes.bulk_write([
+                UpdateOne({"_id": note["_id"], "lex_seq": note.get("lex_seq")}, {"$unset": {"lex_pending": ""}})
+                for note in notes
+            ], ordered=False)
+            repaired += len(notes)
+        if repaired:
+            logger.info(f"Indexed {repaired} notes left pending")
+        return repaired
+
+    def compact(self, db) -> Dict[str, int]:
+        """
+        Merge each term's posting blocks and drop postings of removed notes.
+
+        Meant to run off-peak. Writers may keep appending meanwhile: open
+        blocks are only deleted if nothing was pushed onto them since they
+        were read, and postings pushed twice are merged by search.
+
+        Returns:
+            Counts of terms, blocks before and after, postings dropped and
+            pending notes repaired
+        """
+        repaired = self.repair(db)
+        stats = db[self.meta_name].find_one({"_id": _STATS_ID}) or {}
+
+        live = []
+        total_len = 0
+        for note in db.notes.find({"lex_seq": {"$exists": True}}, {"lex_seq": 1, "lex_len": 1, "lex_pending": 1}):
+            live.append(note["lex_seq"])
+            if not note.get("lex_pending"):
+                total_len += note.get("lex_len", 0)
+        live = np.array(sorted(live), dtype=np.int64)
+
+        lexicon = db[self.lexicon_name]
+        counts = {"terms": 0, "blocks_before": 0, "blocks_after": 0, "dropped": 0, "repaired": repaired}
+        for term, blocks in self._iter_term_blocks(lexicon):
+            counts["terms"] += 1
+            counts["blocks_before"] += len(blocks)
+            term_doc = db[self.terms_name].find_one({"_id": term})
+            seqs, tfs, norms = _merge_blocks(blocks)
+
+            alive = np.isin(seqs, live)
+            if not alive.all():
+                # Notes stored after ``live`` was read may already have postings
+                missing = seqs[~alive].tolist()
+                for start in range(0, len(missing), 10000):
+                    recent = [doc["lex_seq"] for doc in db.notes.find(
+                        {"lex_seq": {"$in": missing[start:start + 10000]}}, {"lex_seq": 1})]
+                    alive |= np.isin(seqs, recent)
+            counts["dropped"] += int((~alive).sum())
+            seqs, tfs, norms = seqs[alive], tfs[alive], norms[alive]
+
+            if len(blocks) == 1 and not blocks[0].get("open") and alive.all():
+                counts["blocks_after"] += 1
+                continue
+            sealed = list(_sealed_blocks(term, seqs, tfs, norms))
+            if sealed:
+                lexicon.insert_many(sealed, ordered=False)
+            lexicon.delete_many({"_id": {"$in": [block["_id"] for block in blocks if not block.get("open")]}})
+            for block in blocks:
+                if block.get("open"):
+                    lexicon.delete_one({"_id": block["_id"], "count": block["count"]})
+            counts["blocks_after"] += len(sealed)
+
+            # Only corrected if no writer changed it since it was read
+            if term_doc is not None and term_doc["df"] != len(seqs):
+                if len(seqs):
+                    db[self.terms_name].update_one({"_id": term, "df": term_doc["df"]}, {"$set": {"df": len(seqs)}})
+                else:
+                    db[self.terms_name].delete_one({"_id": term, "df": term_doc["df"]})
+
+        n_docs = int(db.notes.count_documents({"lex_seq": {"$exists": True}, "lex_pending": {"$exists": False}}))
+        if stats:
+            db[self.meta_name].update_one(
+                {"_id": _STATS_ID, "n_docs": stats.get("n_docs"), "total_len": stats.get("total_len")},
+                {"$set": {"n_docs": n_docs, "total_len": total_len}}
+            )
+        logger.info(f"Compacted lexical index: {counts}")
+        return counts
+
+    def _iter_term_blocks(self, lexicon) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """Every posting block, grouped by term."""
+        term = None
+        blocks = []
+        for block in lexicon.find({}).sort([("term", 1), ("open", 1)]):
+            if block["term"] != term and blocks:
+                yield term, blocks
+                blocks = []
+            term = block["term"]
+            blocks.append(block)
+        if blocks:
+            yield term, blocks
+
+    def rebuild(self, db, batch_size: int = 50000) -> int:
+        """
+        Rebuild the whole index from the notes collection.
+
+        Notes are tokenized ``batch_size`` at a time and each batch is written
+        as packed blocks, so memory stays bounded on large corpora.
+
+        Returns:
+            Number of documents indexed
+        """
+        db[self.lexicon_name].drop()
+        db[self.terms_name].drop()
+        db[self.meta_name].drop()
+        self._indexes_ready = False
+        self.ensure_indexes(db)
+        lexicon = db[self.lexicon_name]
+
+        postings: Dict[str, List[Tuple[int, int, int]]] = {}
+        updates = []
+        total_len = 0
+        seq = 0
+
+        def flush_postings():
+            blocks = []
+            for term, entries in postings.items():
+                data = np.array(entries, dtype=np.int64)
+                blocks.extend(_sealed_blocks(term, data[:, 0], data[:, 1], data[:, 2]))
+                if len(blocks) >= 1000:
+                    lexicon.insert_many(blocks, ordered=False)
+                    blocks = []
+            if blocks:
+                lexicon.insert_many(blocks, ordered=False)
+            self._count_terms(db, {term: len(entries) for term, entries in postings.items()})
+            postings.clear()
+
+        for note in db.notes.find({}, {"_id": 1, "note": 1}):
+            seq += 1
+            counts = Counter(tokenize(note.get("note", "")))
+            length = sum(counts.values())
+            norm = encode_norm(length)
+            terms = {term: min(tf, 65535) for term, tf in counts.items()}
+            for term, tf in terms.items():
+                postings.setdefault(term, []).append((seq, tf, norm))
+            total_len += length
+            updates.append(UpdateOne(
+                {"_id": note["_id"]},
+                {"$set": {"lex_seq": seq, "lex_len": length, "lex_terms": terms}, "$unset": {"lex_pending": ""}}
+            ))
+            if len(updates) >= 1000:
+                db.notes.bulk_write(updates, ordered=False)
+                updates = []
+            if seq % batch_size == 0:
+                flush_postings()
+        if updates:
+            db.notes.bulk_write(updates, ordered=False)
+        flush_postings()
+        n_terms = db[self.terms_name].count_documents({})
+
+        db[self.meta_name].insert_one({
+            "_id": _STATS_ID,
+            "format": INDEX_FORMAT,
+            "next_seq": seq,
+            "n_docs": seq,
+            "total_len": total_len
+        })
+        logger.info(f"Rebuilt lexical index over {seq} documents and {n_terms} terms")
+        return seq
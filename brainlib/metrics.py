@@ -0,0 +1,353 @@
+"""
+Cortex - Metrics Module
+
+This module provides lightweight instrumentation for brainlib:
+- Counters and histograms with optional labels
+- Spans that time a block of code and record it in a histogram
+- Per-command timing of every MongoDB round trip
+- A per-request timings block and Prometheus or JSON dumps
+
+Instrumentation is off unless CORTEX_METRICS=1 is set or ``enable`` is
+called; while off, every call returns after a single flag check. Because the
+server runs each command in a fresh process, metrics are merged into the file
+named by CORTEX_METRICS_FILE when a process exits, and the ``metrics``
+command reads them back from there.
+"""
+
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from typing import Dict, Any, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384)
+
+DEFAULT_METRICS_FILE = os.path.join(tempfile.gettempdir(), "cortex-metrics.json")
+
+# Spans kept for the timings block; older ones are dropped in long-running processes
+MAX_TIMINGS = 1000
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class _NoopSpan:
+    """Span returned while metrics are disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    """Times a block and records it on exit."""
+
+    def __init__(self, registry: "MetricsRegistry", name: str, labels: Dict[str, Any]):
+        """Initialize a span that records into ``registry``."""
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.record = None
+
+    def __enter__(self):
+        # Reserve the timings slot on entry so nested spans list in start order
+        self.record = {"name": self.name, **self.labels}
+        self.registry._add_timing(self.record)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        self.record["ms"] = round(elapsed * 1000, 3)
+        if exc_type is not None:
+            self.record["error"] = exc_type.__name__
+        self.registry.observe(f"{self.name}_seconds", elapsed, **self.labels)
+        return False
+
+
+class MetricsRegistry:
+    """Holds counters, histograms and the timings of the current request."""
+
+    def __init__(self):
+        """Initialize an empty, disabled registry."""
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], Dict[str, Any]] = {}
+        self._timings: deque = deque(maxlen=MAX_TIMINGS)
+        self._dropped_timings = 0
+        self._mongo: Dict[str, Dict[str, float]] = {}
+
+    def enable(self) -> None:
+        """Start collecting metrics in this process."""
+        if self.enabled:
+            return
+        self.enabled = True
+        _register_mongo_listener(self)
+
+    def span(self, name: str, **labels):
+        """Time a block of code as a named span."""
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _Span(self, name, labels)
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """Add to a counter."""
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = LATENCY_BUCKETS, **labels) -> None:
+        """Record a value in a histogram."""
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = {"buckets": list(buckets), "counts": [0] * (len(buckets) + 1), "sum": 0.0, "count": 0}
+                self._histograms[key] = histogram
+            histogram["counts"][bisect_left(histogram["buckets"], value)] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def _add_timing(self, record: Dict[str, Any]) -> None:
+        """Keep a span's record for the next timings block."""
+        with self._lock:
+            if len(self._timings) == self._timings.maxlen:
+                self._dropped_timings += 1
+            self._timings.append(record)
+
+    def _record_mongo(self, command: str, seconds: float) -> None:
+        """Record one MongoDB round trip."""
+        self.observe("mongo_command_seconds", seconds, command=command)
+        with self._lock:
+            totals = self._mongo.setdefault(command, {"count": 0, "total_ms": 0.0})
+            totals["count"] += 1
+            totals["total_ms"] += seconds * 1000
+
+    def timings(self) -> Dict[str, Any]:
+        """
+        Spans and MongoDB round trips recorded since the last call, for a response's timings block.
+
+        Reading clears them, so each request reports only its own work.
+        """
+        with self._lock:
+            spans, self._timings = list(self._timings), deque(maxlen=MAX_TIMINGS)
+            mongo, self._mongo = self._mongo, {}
+            dropped, self._dropped_timings = self._dropped_timings, 0
+        result = {
+            "spans": spans,
+            "mongo": {
+                command: {"count": totals["count"], "total_ms": round(totals["total_ms"], 3)}
+                for command, totals in mongo.items()
+            }
+        }
+        if dropped:
+            result["dropped_spans"] = dropped
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters and histograms in a JSON-serializable form."""
+        with self._lock:
+            return {
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in self._counters.items()
+                ],
+                "histograms": [
+                    {"name": name, "labels": dict(labels), **histogram}
+                    for (name, labels), histogram in self._histograms.items()
+                ]
+            }
+
+    def flush(self, path: Optional[str] = None) -> None:
+        """Merge this process's metrics into the shared metrics file."""
+        if not self.enabled:
+            return
+        path = path or metrics_file()
+        snapshot = self.snapshot()
+        if not snapshot["counters"] and not snapshot["histograms"]:
+            return
+        try:
+            with open(path, "a+") as handle:
+                _lock_file(handle)
+                handle.seek(0)
+                content = handle.read()
+                merged = merge_snapshots(json.loads(content) if content.strip() else None, snapshot)
+                handle.seek(0)
+                handle.truncate()
+                json.dump(merged, handle)
+        except Exception as e:
+            logger.warning(f"Failed to write metrics to {path}: {e}")
+
+
+def _label_key(labels: Dict[str, Any]) -> Labels:
+    """Hashable, order-independent form of a label set."""
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _lock_file(handle) -> None:
+    """Hold an exclusive lock on a file until it is closed, where supported."""
+    try:
+        import fcntl
+    except ImportError:
+        return
+    fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+
+
+def _register_mongo_listener(registry: MetricsRegistry) -> None:
+    """Time every MongoDB command issued by clients created from now on."""
+    from pymongo import monitoring
+
+    class _CommandTimer(monitoring.CommandListener):
+        """Records the duration of each command reported by pymongo."""
+
+        def started(self, event):
+            pass
+
+        def succeeded(self, event):
+            registry._record_mongo(event.command_name, event.duration_micros / 1e6)
+
+        def failed(self, event):
+            registry._record_mongo(event.command_name, event.duration_micros / 1e6)
+            registry.inc("mongo_command_failures_total", command=event.command_name)
+
+    monitoring.register(_CommandTimer())
+
+
+def merge_snapshots(base: Optional[Dict[str, Any]], update: Dict[str, Any]) -> Dict[str, Any]:
+    """Add the counters and histograms of one snapshot into another."""
+    if not base:
+        return update
+
+    counters = {(c["name"], _label_key(c["labels"])): dict(c) for c in base.get("counters", [])}
+    for counter in update.get("counters", []):
+        key = (counter["name"], _label_key(counter["labels"]))
+        if key in counters:
+            counters[key]["value"] += counter["value"]
+        else:
+            counters[key] = dict(counter)
+
+    histograms = {(h["name"], _label_key(h["labels"])): dict(h) for h in base.get("histograms", [])}
+    for histogram in update.get("histograms", []):
+        key = (histogram["name"], _label_key(histogram["labels"]))
+        existing = histograms.get(key)
+        if existing is None or existing["buckets"] != histogram["buckets"]:
+            histograms[key] = dict(histogram)
+            continue
+        existing["counts"] = [a + b for a, b in zip(existing["counts"], histogram["counts"])]
+        existing["sum"] += histogram["sum"]
+        existing["count"] += histogram["count"]
+
+    return {"counters": list(counters.values()), "histograms": list(histograms.values())}
+
+
+def _prometheus_name(name: str) -> str:
+    """Turn a metric name like ``cluster.fetch_seconds`` into a Prometheus name."""
+    return "cortex_" + "".join(char if char.isalnum() else "_" for char in name)
+
+
+def _prometheus_labels(labels: Dict[str, str], extra: Optional[Tuple[str, str]] = None) -> str:
+    """Format labels as ``{key="value",...}``, escaping values."""
+    items = list(labels.items()) + ([extra] if extra else [])
+    if not items:
+        return ""
+    escaped = []
+    for key, value in items:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{key}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def render_prometheus(snapshot: Dict[str, Any]) -> str:
+    """Render a snapshot in the Prometheus text exposition format."""
+    lines = []
+    typed = set()
+    for counter in sorted(snapshot.get("counters", []), key=lambda c: c["name"]):
+        name = _prometheus_name(counter["name"])
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_prometheus_labels(counter['labels'])} {counter['value']}")
+
+    for histogram in sorted(snapshot.get("histograms", []), key=lambda h: h["name"]):
+        name = _prometheus_name(histogram["name"])
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for bound, count in zip(histogram["buckets"] + ["+Inf"], histogram["counts"]):
+            cumulative += count
+            lines.append(f"{name}_bucket{_prometheus_labels(histogram['labels'], ('le', str(bound)))} {cumulative}")
+        lines.append(f"{name}_sum{_prometheus_labels(histogram['labels'])} {histogram['sum']}")
+        lines.append(f"{name}_count{_prometheus_labels(histogram['labels'])} {histogram['count']}")
+
+    return "\n".join(lines) + "\n"
+
+
+def metrics_file() -> str:
+    """Path of the file metrics are merged into across processes."""
+    return os.environ.get("CORTEX_METRICS_FILE", DEFAULT_METRICS_FILE)
+
+
+def load_metrics(path: Optional[str] = None) -> Dict[str, Any]:
+    """Read the metrics collected by all processes so far."""
+    path = path or metrics_file()
+    try:
+        with open(path) as handle:
+            content = handle.read()
+    except FileNotFoundError:
+        return {"counters": [], "histograms": []}
+    return json.loads(content) if content.strip() else {"counters": [], "histograms": []}
+
+
+def dump_metrics(output_format: str = "json", path: Optional[str] = None):
+    """
+    Collected metrics, including this process's, as Prometheus text or JSON.
+
+    Args:
+        output_format: "prometheus" or "json"
+        path: Metrics file to read instead of the default
+    """
+    snapshot = merge_snapshots(load_metrics(path), registry.snapshot())
+    if output_format == "prometheus":
+        return render_prometheus(snapshot)
+    if output_format == "json":
+        return snapshot
+    raise ValueError(f"Unknown metrics format: {output_format}")
+
+
+registry = MetricsRegistry()
+
+# Module-level shortcuts so call sites read ``metrics.span(...)``
+span = registry.span
+inc = registry.inc
+observe = registry.observe
+enable = registry.enable
+timings = registry.timings
+
+
+def is_enabled() -> bool:
+    """Whether metrics are being collected in this process."""
+    return registry.enabled
+
+
+if os.environ.get("CORTEX_METRICS", "").lower() in ("1", "true", "yes"):
+    registry.enable()
+    atexit.register(registry.flush)
@@ -0,0 +1,313 @@
+"""
+Cortex - Embedding Migration Module
+
+This module re-embeds stored notes when the embedding model changes:
+- Tagging every embedding with the model that produced it
+- Re-embedding stale notes in length-sorted batches with a resumable checkpoint
+- Throttling itself so production traffic is not starved
+- Switching reads over to the new vectors in a single cutover step, and
+  recording the new model so later notes and queries are embedded with it
+
+Migrations run through the storage backend interface, on MongoDB or the
+embedded store, one tenant at a time.
+"""
+
+import json
+import logging
+import sys
+import time
+from typing import Dict, Any, Optional
+from datetime import datetime
+
+try:
+    from . import metrics
+    from .brain import BrainCore, set_active_model
+    from .dedup import DuplicateIndex
+    from .hierarchy import ClusterTree
+    from .projection import EmbeddingProjector
+    from .storage import open_backend, configured_db_uri
+except ImportError:
+    import metrics
+    from brain import BrainCore, set_active_model
+    from dedup import DuplicateIndex
+    from hierarchy import ClusterTree
+    from projection import EmbeddingProjector
+    from storage import open_backend, configured_db_uri
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Notes stored before embeddings were tagged were all produced by this model
+LEGACY_MODEL = "all-MiniLM-L6-v2"
+
+# Artifact holding the checkpoint of the migration to a model
+_CHECKPOINT_ARTIFACT = "migration:{model_name}"
+
+
+class EmbeddingMigrator:
+    """Re-embeds notes with a new model while reads keep using the old vectors."""
+
+    def __init__(self, model_name: str, batch_size: int = 512, encode_batch_size: int = 64,
+                 max_docs_per_second: Optional[float] = None):
+        """
+        Initialize the migrator.
+
+        Args:
+            model_name: Model to migrate embeddings to
+            batch_size: Number of notes fetched, encoded and written per round trip
+            encode_batch_size: Batch size passed to the model when encoding
+            max_docs_per_second: Upper bound on throughput, or None for no limit
+        """
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.encode_batch_size = encode_batch_size
+        self.max_docs_per_second = max_docs_per_second
+        self._core = None
+
+    @property
+    def core(self) -> BrainCore:
+        """The brain used to encode notes with the target model, loaded on first use."""
+        if self._core is None:
+            self._core = BrainCore(model_name=self.model_name)
+        return self._core
+
+    def _checkpoint_name(self) -> str:
+        """Artifact name of this migration's checkpoint."""
+        return _CHECKPOINT_ARTIFACT.format(model_name=self.model_name)
+
+    def _save_checkpoint(self, backend, checkpoint: Dict[str, Any], **changes) -> Dict[str, Any]:
+        """Update and store the checkpoint of this migration."""
+        checkpoint = {**checkpoint, **changes, "updated_at": datetime.utcnow()}
+        backend.put_artifact(self._checkpoint_name(), checkpoint)
+        return checkpoint
+
+    def migrate(self, db_uri: str = "mongodb://localhost:27017",
+                legacy_model: str = LEGACY_MODEL, tenant: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Stage new embeddings for every stale note.
+
+        New vectors are staged next to the current ones so that reads keep
+        using the old vectors until ``cutover`` runs. Progress is checkpointed
+        in a stored artifact after every batch; since finished notes are no
+        longer stale, rerunning picks up where it stopped.
+
+        Args:
+            db_uri: Storage URI, see ``storage.open_backend``
+            legacy_model: Model assumed for notes stored without a model tag
+            tenant: Tenant whose notes to migrate, see ``storage.open_backend``
+
+        Returns:
+            Final checkpoint for this migration
+        """
+        try:
+            backend = open_backend(db_uri, tenant)
+
+            tagged = backend.tag_embedding_models(legacy_model)
+            if tagged:
+                logger.info(f"Tagged {tagged} untagged notes as {legacy_model}")
+
+            # Plan the work shortest-first so every encode batch holds texts of
+            # similar length and wastes little time on padding
+            plan = backend.stale_notes(self.model_name)
+
+            checkpoint = backend.get_artifact(self._checkpoint_name()) or {
+                "model_name": self.model_name, "processed": 0, "started_at": datetime.utcnow()
+            }
+            checkpoint.pop("_id", None)
+            checkpoint = self._save_checkpoint(backend, checkpoint, state="running", remaining=len(plan))
+            logger.info(f"Migrating {len(plan)} notes to {self.model_name} "
+                        f"({checkpoint['processed']} already processed)")
+
+            started = time.monotonic()
+            processed = 0
+            for start in range(0, len(plan), self.batch_size):
+                batch_ids = plan[start:start + self.batch_size]
+                texts = backend.stale_texts(batch_ids, self.model_name)
+                # Keep the planned length order; skip notes deleted or migrated meanwhile
+                ids = [note_id for note_id in batch_ids if note_id in texts]
+
+                if ids:
+                    with metrics.span("encode"):
+                        embeddings = self.core.encoder.encode(
+                            [texts[note_id] for note_id in ids],
+                            batch_size=self.encode_batch_size,
+                            convert_to_tensor=False
+                        )
+                    metrics.observe("encode_batch_size", len(ids), buckets=metrics.SIZE_BUCKETS)
+                    metrics.inc("encoded_texts_total", len(ids))
+                    backend.stage_embeddings(ids, embeddings, self.model_name)
+
+                processed += len(ids)
+                checkpoint = self._save_checkpoint(backend, checkpoint,
+                                                   processed=checkpoint["processed"] + len(ids),
+                                                   remaining=len(plan) - start - len(batch_ids))
+                logger.info(f"Migrated {processed}/{len(plan)} notes")
+                self._throttle(processed, started)
+
+            checkpoint = self._save_checkpoint(backend, checkpoint, state="staged", remaining=0)
+            return self._format_checkpoint(checkpoint)
+
+        except Exception as e:
+            logger.error(f"Failed to migrate embeddings to {self.model_name}: {e}")
+            raise
+        finally:
+            if 'backend' in locals():
+                backend.close()
+
+    def _throttle(self, processed: int, started: float) -> None:
+        """Sleep long enough to keep average throughput under the configured limit."""
+        if not self.max_docs_per_second:
+            return
+        ahead = processed / self.max_docs_per_second - (time.monotonic() - started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+    def cutover(self, db_uri: str = "mongodb://localhost:27017", force: bool = False,
+                tenant: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Swap staged embeddings into place so reads use the new model.
+
+        The model is recorded with the notes, so ``brain.get_brain_core``
+        embeds every later note and query with it.
+
+        Args:
+            db_uri: Storage URI, see ``storage.open_backend``
+            force: Cut over even if some notes have not been re-embedded yet
+            tenant: Tenant whose notes to switch, see ``storage.open_backend``
+
+        Returns:
+            Number of notes switched over and any still stale
+        """
+        try:
+            backend = open_backend(db_uri, tenant)
+
+            stale = backend.count_stale(self.model_name)
+            if stale and not force:
+                raise RuntimeError(f"{stale} notes have not been re-embedded with {self.model_name}; "
+                                   f"run migrate again before cutting over")
+
+            switched = backend.cutover_embeddings(self.model_name)
+            set_active_model(backend, self.model_name)
+            # Reduced vectors, duplicate buckets and the cluster tree were derived from the old model's space
+            EmbeddingProjector.discard(backend)
+            DuplicateIndex.discard(backend)
+            ClusterTree.discard(backend)
+
+            checkpoint = backend.get_artifact(self._checkpoint_name()) or {"model_name": self.model_name}
+            checkpoint.pop("_id", None)
+            self._save_checkpoint(backend, checkpoint, state="complete", completed_at=datetime.utcnow())
+            logger.info(f"Cut over {switched} notes to {self.model_name}")
+            return {"switched": switched, "stale": stale}
+
+        except Exception as e:
+            logger.error(f"Failed to cut over embeddings to {self.model_name}: {e}")
+            raise
+        finally:
+            if 'backend' in locals():
+                backend.close()
+
+    def status(self, db_uri: str = "mongodb://localhost:27017", tenant: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Report how many notes each model has embedded and how far the migration got.
+
+        Args:
+            db_uri: Storage URI, see ``storage.open_backend``
+            tenant: Tenant whose notes to report on, see ``storage.open_backend``
+
+        Returns:
+            Dictionary with per-model counts, pending count and checkpoint
+        """
+        try:
+            backend = open_backend(db_uri, tenant)
+
+            return {
+                "model_name": self.model_name,
+                "models": backend.embedding_model_counts(),
+                "staged": backend.count_staged(self.model_name),
+                "pending": backend.count_stale(self.model_name),
+                "checkpoint": self._format_checkpoint(backend.get_artifact(self._checkpoint_name()))
+            }
+
+        except Exception as e:
+            logger.error(f"Failed to get migration status: {e}")
+            raise
+        finally:
+            if 'backend' in locals():
+                backend.close()
+
+    @staticmethod
+    def _format_checkpoint(checkpoint: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Make a checkpoint document JSON serializable."""
+        if checkpoint is None:
+            return None
+        return {
+            key: value.isoformat() if isinstance(value, datetime) else value
+            for key, value in checkpoint.items() if key != "_id"
+        }
+
+def migrate_embeddings(model_name: str, db_uri: str = "mongodb://localhost:27017", batch_size: int = 512,
+                       max_docs_per_second: Optional[float] = None, tenant: Optional[str] = None) -> Dict[str, Any]:
+    """Stage embeddings from a new model for every stale note."""
+    migrator = EmbeddingMigrator(model_name, batch_size=batch_size, max_docs_per_second=max_docs_per_second)
+    return migrator.migrate(db_uri, tenant=tenant)
+
+def cutover_embeddings(model_name: str, db_uri: str = "mongodb://localhost:27017", force: bool = False,
+                       tenant: Optional[str] = None) -> Dict[str, Any]:
+    """Switch reads over to the staged embeddings."""
+    return EmbeddingMigrator(model_name).cutover(db_uri, force, tenant)
+
+def migration_status(model_name: str, db_uri: str = "mongodb://localhost:27017",
+                     tenant: Optional[str] = None) -> Dict[str, Any]:
+    """Report embedding model counts and migration progress."""
+    return EmbeddingMigrator(model_name).status(db_uri, tenant)
+
+def handle_command_line():
+    """Handle command line arguments for running migrations."""
+    if len(sys.argv) < 2:
+        print(json.dumps({"error": "Function name required"}))
+        return
+
+    function_name = sys.argv[1]
+    data = {}
+
+    if len(sys.argv) > 2:
+        try:
+            data = json.loads(sys.argv[2])
+        except json.JSONDecodeError:
+            print(json.dumps({"error": "Invalid JSON data"}))
+            return
+
+    db_uri = configured_db_uri()
+    tenant = data.get("tenant")
+
+    try:
+        model_name = data.get("model_name")
+        if not model_name:
+            raise ValueError("model_name is required")
+
+        if function_name == "migrate":
+            batch_size = data.get("batch_size", 512)
+            max_docs_per_second = data.get("max_docs_per_second")
+            checkpoint = migrate_embeddings(model_name, db_uri, batch_size=batch_size,
+                                            max_docs_per_second=max_docs_per_second, tenant=tenant)
+            result = {"checkpoint": checkpoint, "success": True}
+
+        elif function_name == "cutover":
+            force = data.get("force", False)
+            cutover = cutover_embeddings(model_name, db_uri, force=force, tenant=tenant)
+            result = {**cutover, "success": True}
+
+        elif function_name == "status":
+            status = migration_status(model_name, db_uri, tenant=tenant)
+            result = {"status": status, "success": True}
+
+        else:
+            result = {"error": f"Unknown function: {function_name}"}
+
+    except Exception as e:
+        result = {"error": str(e), "success": False}
+
+    print(json.dumps(result))
+
+if __name__ == "__main__":
+    handle_command_line()
@@ -10,6 +10,7 @@ This module provides PDF processing functionality for:
 import os
 import logging
 import tempfile
+import time
 from typing import Dict, Any, Optional, Tuple
 from datetime import datetime
 import uuid
@@ -18,6 +19,11 @@ import uuid
 import PyPDF2
 from io import BytesIO
 
+try:
+    from . import metrics
+except ImportError:
+    import metrics
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -41,8 +47,11 @@ class PDFProcessor:
             
             for page_num in range(total_pages):
                 try:
+                    page_started = time.perf_counter()
                     page = pdf_reader.pages[page_num]
                     page_text = page.extract_text()
+                    metrics.observe("pdf_page_extract_seconds", time.perf_counter() - page_started)
+                    metrics.inc("pdf_pages_total")
                     if page_text.strip():
                         text_content.append(page_text.strip())
                 except Exception as e:
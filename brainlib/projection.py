@@ -0,0 +1,242 @@
+"""
+Cortex - Embedding Projection Module
+
+This module provides reduced-dimension embeddings for fast scans:
+- Fitting a PCA or random projection over the stored embeddings
+- Storing the fitted projection as an artifact of the storage backend
+- Keeping a reduced vector on every note for clustering and candidate search
+- Re-ranking candidates exactly on the full vectors
+"""
+
+import logging
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime
+
+import numpy as np
+
+from bson.binary import Binary
+
+try:
+    from .storage import MissingReducedVectors
+except ImportError:
+    from storage import MissingReducedVectors
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PROJECTION_METHODS = ("pca", "random")
+DEFAULT_COMPONENTS = 96
+
+_PROJECTION_ARTIFACT = "projection"
+
+
+class EmbeddingProjector:
+    """A fitted linear map from full embeddings to a smaller space."""
+
+    def __init__(self, method: str = "pca", n_components: int = DEFAULT_COMPONENTS):
+        """
+        Initialize an unfitted projector.
+
+        Args:
+            method: "pca" for principal components or "random" for a Gaussian random projection
+            n_components: Dimension of the reduced vectors
+        """
+        if method not in PROJECTION_METHODS:
+            raise ValueError(f"Unknown projection method: {method}")
+        self.method = method
+        self.n_components = n_components
+        self.mean = None
+        self.scale = None
+        self.components = None
+
+    @property
+    def is_fitted(self) -> bool:
+        """Whether the projector has been fitted or loaded."""
+        return self.components is not None
+
+    def fit(self, embeddings: np.ndarray, random_state: int = 42) -> "EmbeddingProjector":
+        """
+        Fit the projection to a sample of embeddings.
+
+        Embeddings are standardized first, matching the scaling the clusterer
+        applies to full vectors, so distances in the reduced space approximate
+        the ones KMeans sees on the full path.
+
+        Args:
+            embeddings: Array of shape (n_samples, dim)
+            random_state: Seed for the random projection and randomized PCA
+
+        Returns:
+            The fitted projector
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        n_samples, dim = embeddings.shape
+        n_components = min(self.n_components, dim)
+
+        self.mean = embeddings.mean(axis=0)
+        std = embeddings.std(axis=0)
+        self.scale = np.where(std > 0, std, 1.0).astype(np.float32)
+        standardized = (embeddings - self.mean) / self.scale
+
+        if self.method == "pca":
+            from sklearn.decomposition import PCA
+
+            n_components = min(n_components, n_samples)
+            pca = PCA(n_components=n_components, random_state=random_state)
+            pca.fit(standardized)
+            self.components = pca.components_.astype(np.float32)
+            logger.info(f"Fitted PCA to {n_components} dims, "
+                        f"explained variance {pca.explained_variance_ratio_.sum():.3f}")
+        else:
+            rng = np.random.default_rng(random_state)
+            self.components = (rng.standard_normal((n_components, dim)) / np.sqrt(n_components)).astype(np.float32)
+            logger.info(f"Fitted random projection to {n_components} dims")
+
+        self.n_components = n_components
+        return self
+
+    def transform(self, embeddings: np.ndarray) -> np.ndarray:
+        """Project full embeddings of shape (n, dim) or (dim,) into the reduced space."""
+        if not self.is_fitted:
+            raise RuntimeError("projection not fitted")
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        return ((embeddings - self.mean) / self.scale) @ self.components.T
+
+    def to_document(self) -> Dict[str, Any]:
+        """Serialize the fitted projection for storage."""
+        return {
+            "method": self.method,
+            "n_components": self.n_components,
+            "dim": int(self.components.shape[1]),
+            "mean": Binary(self.mean.astype(np.float32).tobytes()),
+            "scale": Binary(self.scale.astype(np.float32).tobytes()),
+            "components": Binary(self.components.tobytes()),
+            "fitted_at": datetime.utcnow()
+        }
+
+    @classmethod
+    def from_document(cls, document: Dict[str, Any]) -> "EmbeddingProjector":
+        """Rebuild a fitted projector from its stored form."""
+        projector = cls(document["method"], document["n_components"])
+        dim = document["dim"]
+        projector.mean = np.frombuffer(document["mean"], dtype=np.float32)
+        projector.scale = np.frombuffer(document["scale"], dtype=np.float32)
+        projector.components = np.frombuffer(document["components"], dtype=np.float32).reshape(-1, dim)
+        return projector
+
+    def save(self, backend) -> None:
+        """Store the projection as the current one."""
+        backend.put_artifact(_PROJECTION_ARTIFACT, self.to_document())
+
+    @classmethod
+    def load(cls, backend) -> Optional["EmbeddingProjector"]:
+        """Load the current projection, or None if none has been fitted."""
+        document = backend.get_artifact(_PROJECTION_ARTIFACT)
+        if document is None:
+            return None
+        return cls.from_document(document)
+
+    @staticmethod
+    def discard(backend) -> None:
+        """Remove the current projection and every reduced vector made with it."""
+        backend.delete_artifact(_PROJECTION_ARTIFACT)
+        backend.clear_reduced_vectors()
+
+
+def fit_corpus_projection(backend, method: str = "pca", n_components: int = DEFAULT_COMPONENTS,
+                          sample_size: int = 20000, batch_size: int = 10000,
+                          random_state: int = 42) -> Dict[str, Any]:
+    """
+    Fit a projection over the stored notes and give every note a reduced vector.
+
+    Args:
+        backend: Storage backend holding the notes
+        method: Projection method, see ``EmbeddingProjector``
+        n_components: Dimension of the reduced vectors
+        sample_size: Maximum number of notes used to fit the projection
+        batch_size: Number of notes projected at a time
+        random_state: Seed for the fit sample and the projection itself
+
+    Returns:
+        Summary of the fitted projection
+    """
+    ids, embeddings = backend.load_vectors()
+    if len(ids) < 2:
+        raise ValueError("At least two notes are needed to fit a projection")
+
+    rng = np.random.default_rng(random_state)
+    sample = rng.choice(len(ids), size=min(sample_size, len(ids)), replace=False)
+    projector = EmbeddingProjector(method, n_components).fit(embeddings[np.sort(sample)], random_state)
+    projector.save(backend)
+
+    for start in range(0, len(ids), batch_size):
+        backend.set_reduced_vectors(ids[start:start + batch_size],
+                                    projector.transform(embeddings[start:start + batch_size]))
+
+    logger.info(f"Stored {projector.n_components}-dim reduced vectors for {len(ids)} notes")
+    return {
+        "method": projector.method,
+        "n_components": projector.n_components,
+        "fitted_on": len(sample),
+        "updated": len(ids)
+    }
+
+
+def cosine_top_k(matrix: np.ndarray, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the rows of a matrix most similar to a query by cosine similarity.
+
+    Returns:
+        Tuple of (row indices, similarities), best first
+    """
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+    similarities = matrix @ query / np.maximum(norms, 1e-12)
+    if len(similarities) > k:
+        top = np.argpartition(-similarities, k)[:k]
+    else:
+        top = np.arange(len(similarities))
+    top = top[np.argsort(-similarities[top])]
+    return top, similarities[top]
+
+
+def semantic_ranking(backend, query_embedding: np.ndarray, limit: int,
+                     rerank_factor: int = 10) -> List[Tuple[str, float]]:
+    """
+    Rank notes by cosine similarity to a query embedding.
+
+    When a projection has been fitted, candidates are generated by scanning
+    the reduced vectors and only the top ``limit * rerank_factor`` are
+    re-ranked with exact cosine on their full embeddings. Otherwise the full
+    embeddings are scanned directly.
+
+    Args:
+        backend: Storage backend holding the notes
+        query_embedding: Full embedding of the query
+        limit: Number of results to return
+        rerank_factor: How many candidates to re-rank per result
+
+    Returns:
+        List of (note id, cosine similarity) pairs, best first
+    """
+    query_embedding = np.asarray(query_embedding, dtype=np.float32)
+    projector = EmbeddingProjector.load(backend)
+
+    if projector is not None:
+        try:
+            ids, matrix = backend.load_vectors(reduced=True)
+        except MissingReducedVectors as e:
+            # Notes stored before the projection was fitted have no reduced vector
+            logger.warning(f"{e}; scanning full embeddings")
+            ids, matrix = backend.load_vectors()
+        else:
+            if ids:
+                top, _ = cosine_top_k(matrix, projector.transform(query_embedding), limit * rerank_factor)
+                ids, matrix = backend.get_vectors([ids[i] for i in top])
+    else:
+        ids, matrix = backend.load_vectors()
+
+    if not ids:
+        return []
+
+    top, similarities = cosine_top_k(matrix, query_embedding, limit)
+    return [(ids[i], float(similarity)) for i, similarity in zip(top, similarities)]
@@ -0,0 +1,313 @@
+"""
+Cortex - Snapshot Module
+
+This module moves a whole corpus between Cortex instances without re-embedding:
+- Exporting notes as a float32 embedding matrix in ``.npy`` plus a gzipped
+  columnar table of everything else, written in streaming batches
+- Importing a snapshot with bulk inserts, never loading the model
+- Working with either storage backend on both ends
+
+A snapshot is a directory holding ``manifest.json``, ``embeddings.npy`` and
+``notes.jsonl.gz``. Row ``i`` of the matrix belongs to the ``i``-th note of
+the table, whose lines each hold one batch as ``{column: [values...]}``.
+"""
+
+import gzip
+import json
+import logging
+import os
+import struct
+import sys
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+from datetime import datetime
+
+import numpy as np
+from bson import json_util
+
+try:
+    from .brain import active_model, set_active_model
+    from .dedup import DuplicateIndex
+    from .projection import EmbeddingProjector
+    from .storage import open_backend, configured_db_uri
+except ImportError:
+    from brain import active_model, set_active_model
+    from dedup import DuplicateIndex
+    from projection import EmbeddingProjector
+    from storage import open_backend, configured_db_uri
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+NOTES_FILE = "notes.jsonl.gz"
+
+# Fixed size reserved for the .npy header, so it can be rewritten once the
+# final row count is known without moving the data after it
+_NPY_HEADER_BYTES = 128
+
+_LOAD_OPTIONS = json_util.RELAXED_JSON_OPTIONS.with_options(tz_aware=False)
+
+
+def _npy_header(rows: int, dim: int) -> bytes:
+    """Version 1.0 ``.npy`` header for a C-ordered float32 matrix, padded to a fixed size."""
+    header = repr({"descr": "<f4", "fortran_order": False, "shape": (rows, dim)}).encode("latin1")
+    padding = _NPY_HEADER_BYTES - 10 - len(header) - 1
+    if padding < 0:
+        raise ValueError("Snapshot too large for the .npy header")
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", _NPY_HEADER_BYTES - 10) + header + b" " * padding + b"\n"
+
+
+def _to_columns(notes: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """Turn a batch of note documents into columns, with None where a note lacks a field."""
+    names = list(dict.fromkeys(name for note in notes for name in note))
+    return {name: [note.get(name) for note in notes] for name in names}
+
+
+def _from_columns(columns: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """Turn columns back into note documents, leaving out missing fields."""
+    count = len(columns.get("_id", []))
+    return [
+        {name: values[i] for name, values in columns.items() if values[i] is not None}
+        for i in range(count)
+    ]
+
+
+def export_snapshot(path: str, db_uri: str = "mongodb://localhost:27017",
+                    batch_size: int = 1000, tenant: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Write every note to a snapshot directory.
+
+    Notes are read, encoded and written one batch at a time, so memory stays
+    bounded by ``batch_size`` regardless of corpus size.
+
+    Args:
+        path: Directory to create the snapshot in
+        db_uri: Storage URI, see ``storage.open_backend``
+        batch_size: Number of notes read and written at a time
+        tenant: Tenant whose notes to export, see ``storage.open_backend``
+
+    Returns:
+        The snapshot manifest
+    """
+    os.makedirs(path, exist_ok=True)
+    try:
+        backend = open_backend(db_uri, tenant)
+
+        rows = 0
+        dim = None
+        models = {}
+        with open(os.path.join(path, EMBEDDINGS_FILE), "wb") as matrix_file, \
+                gzip.open(os.path.join(path, NOTES_FILE), "wt", encoding="utf-8", compresslevel=6) as table_file:
+            matrix_file.write(_npy_header(0, 0))
+            for notes, embeddings in backend.iter_notes(batch_size):
+                if dim is None:
+                    dim = embeddings.shape[1]
+                elif embeddings.shape[1] != dim:
+                    raise ValueError(f"Embedding dimension changed from {dim} to {embeddings.shape[1]} mid-export")
+
+                matrix_file.write(np.ascontiguousarray(embeddings, dtype="<f4").tobytes())
+                table_file.write(json_util.dumps(_to_columns(notes), json_options=json_util.RELAXED_JSON_OPTIONS))
+                table_file.write("\n")
+
+                for note in notes:
+                    model = note.get("embedding_model")
+                    models[model] = models.get(model, 0) + 1
+                rows += len(notes)
+                logger.info(f"Exported {rows} notes")
+
+            matrix_file.seek(0)
+            matrix_file.write(_npy_header(rows, dim or 0))
+
+        manifest = {
+            "version": SNAPSHOT_VERSION,
+            "notes": rows,
+            "dim": dim or 0,
+            "embedding_models": {str(model): count for model, count in models.items()},
+            "exported_at": datetime.utcnow().isoformat()
+        }
+        with open(os.path.join(path, MANIFEST_FILE), "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+
+        logger.info(f"Exported {rows} notes to {path}")
+        return manifest
+
+    except Exception as e:
+        logger.error(f"Failed to export snapshot to {path}: {e}")
+        raise
+    finally:
+        if 'backend' in locals():
+            backend.close()
+
+
+def read_manifest(path: str) -> Dict[str, Any]:
+    """Load and check the manifest of a snapshot directory."""
+    with open(os.path.join(path, MANIFEST_FILE)) as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version: {manifest.get('version')}")
+    return manifest
+
+
+def read_snapshot(path: str) -> Iterator[Tuple[List[Dict[str, Any]], np.ndarray]]:
+    """
+    Stream the notes of a snapshot back in the batches they were written in.
+
+    Yields:
+        Tuples of (note documents without embeddings, their embeddings)
+    """
+    manifest = read_manifest(path)
+
+    embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode="r")
+    if len(embeddings) != manifest["notes"]:
+        raise ValueError(f"Snapshot has {len(embeddings)} embeddings for {manifest['notes']} notes")
+
+    offset = 0
+    with gzip.open(os.path.join(path, NOTES_FILE), "rt", encoding="utf-8") as table_file:
+        for line in table_file:
+            notes = _from_columns(json_util.loads(line, json_options=_LOAD_OPTIONS))
+            yield notes, embeddings[offset:offset + len(notes)]
+            offset += len(notes)
+
+    if offset != len(embeddings):
+        raise ValueError(f"Snapshot table has {offset} notes for {len(embeddings)} embeddings")
+
+
+def _known_models(counts: Dict[str, int]) -> List[str]:
+    """Models with at least one note, leaving out notes stored without a model tag."""
+    return sorted(model for model, count in counts.items() if count and model != "None")
+
+
+def _stored_model(backend) -> Optional[str]:
+    """Model the stored notes are embedded with, or None if that isn't recorded anywhere."""
+    model_name = active_model(backend)
+    if model_name is not None:
+        return model_name
+    models = _known_models(backend.embedding_model_counts())
+    return models[0] if len(models) == 1 else None
+
+
+def import_snapshot(path: str, db_uri: str = "mongodb://localhost:27017",
+                    drop_existing: bool = False, tenant: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Bulk-load a snapshot into storage without re-embedding anything.
+
+    Notes whose id already exists are skipped. If the target has a fitted
+    projection or a near-duplicate index, imported notes are added to them.
+    Notes are inserted without touching the keyword index, which is rebuilt
+    once at the end.
+
+    Args:
+        path: Snapshot directory written by ``export_snapshot``
+        db_uri: Storage URI, see ``storage.open_backend``
+        drop_existing: Delete every stored note, index and artifact first
+        tenant: Tenant to import the notes into, see ``storage.open_backend``
+
+    Returns:
+        Counts of notes read and inserted
+
+    Raises:
+        ValueError: If the snapshot's embeddings don't match the model or the
+            dimension of the notes already stored
+    """
+    manifest = read_manifest(path)
+    snapshot_models = _known_models(manifest.get("embedding_models", {}))
+    if len(snapshot_models) > 1:
+        raise ValueError(f"Snapshot mixes embeddings from {', '.join(snapshot_models)}; "
+                         f"finish migrating the source before exporting it")
+    snapshot_model = snapshot_models[0] if snapshot_models else None
+    try:
+        backend = open_backend(db_uri, tenant)
+
+        if drop_existing:
+            backend.drop()
+        if backend.count_notes() == 0:
+            # An empty target takes on the snapshot's model, so later notes and queries match it
+            if snapshot_model is not None:
+                set_active_model(backend, snapshot_model)
+        else:
+            stored_model = _stored_model(backend)
+            if snapshot_model is not None and stored_model is not None and snapshot_model != stored_model:
+                raise ValueError(f"Snapshot embeddings are from {snapshot_model}, "
+                                 f"but the stored notes are embedded with {stored_model}")
+        dim = backend.embedding_dim()
+        if manifest["notes"] and dim is not None and dim != manifest["dim"]:
+            raise ValueError(f"Snapshot embeddings have {manifest['dim']} dimensions, "
+                             f"but the stored notes have {dim}")
+        projector = EmbeddingProjector.load(backend)
+        index = DuplicateIndex.load(backend)
+
+        read = 0
+        inserted = 0
+        for notes, embeddings in read_snapshot(path):
+            if projector is not None:
+                reduced = projector.transform(embeddings)
+            if index is not None:
+                buckets = index.buckets(embeddings)
+            for i, note in enumerate(notes):
+                note["embedding"] = embeddings[i].tolist()
+                if projector is not None:
+                    note["embedding_reduced"] = reduced[i].tolist()
+                if index is not None:
+                    note["lsh_buckets"] = buckets[i].tolist()
+            inserted += len(backend.insert_notes(notes, index_text=False))
+            read += len(notes)
+            logger.info(f"Imported {inserted} of {read} notes")
+
+        backend.rebuild_lexical_index()
+        logger.info(f"Imported {inserted} notes from {path}, skipped {read - inserted} existing")
+        return {"read": read, "inserted": inserted, "skipped": read - inserted}
+
+    except Exception as e:
+        logger.error(f"Failed to import snapshot from {path}: {e}")
+        raise
+    finally:
+        if 'backend' in locals():
+            backend.close()
+
+
+def handle_command_line():
+    """Handle command line arguments for exporting and importing snapshots."""
+    if len(sys.argv) < 2:
+        print(json.dumps({"error": "Function name required"}))
+        return
+
+    function_name = sys.argv[1]
+    data = {}
+
+    if len(sys.argv) > 2:
+        try:
+            data = json.loads(sys.argv[2])
+        except json.JSONDecodeError:
+            print(json.dumps({"error": "Invalid JSON data"}))
+            return
+
+    db_uri = configured_db_uri()
+    tenant = data.get("tenant")
+
+    try:
+        path = data.get("path")
+        if not path:
+            raise ValueError("path is required")
+
+        if function_name == "export":
+            batch_size = data.get("batch_size", 1000)
+            manifest = export_snapshot(path, db_uri, batch_size, tenant)
+            result = {"manifest": manifest, "success": True}
+
+        elif function_name == "import":
+            drop_existing = data.get("drop_existing", False)
+            counts = import_snapshot(path, db_uri, drop_existing, tenant)
+            result = {**counts, "success": True}
+
+        else:
+            result = {"error": f"Unknown function: {function_name}"}
+
+    except Exception as e:
+        result = {"error": str(e), "success": False}
+
+    print(json.dumps(result))
+
+if __name__ == "__main__":
+    handle_command_line()
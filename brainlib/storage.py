@@ -0,0 +1,1276 @@
+"""
+Cortex - Storage Module
+
+This module provides the storage backends behind BrainCore and BrainClusterer:
+- A common interface for notes, embeddings, keyword search, the near-duplicate
+  index and stored artifacts
+- A MongoDB backend for shared deployments
+- An embedded backend for single-node and edge deployments: SQLite for
+  metadata and text, and an append-only memory-mapped float32 file for
+  embeddings that clustering and search read without copying
+- Selection of the backend from the scheme of ``db_uri``
+- Partitioning storage per tenant, so each tenant's notes, embeddings,
+  indexes and artifacts are kept, and read, apart from everyone else's
+"""
+
+import logging
+import os
+import re
+import sqlite3
+from abc import ABC, abstractmethod
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+from datetime import datetime
+from urllib.parse import urlparse
+
+import numpy as np
+import bson
+from bson.binary import Binary
+
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+
+try:
+    from .lexical import LexicalIndex, tokenize
+except ImportError:
+    from lexical import LexicalIndex, tokenize
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_URI = "mongodb://localhost:27017"
+
+# Tenant ids become part of a MongoDB database name or a directory name
+_TENANT_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_-]{0,47}$")
+DEFAULT_DATABASE = "notes_db"
+TENANTS_DIR = "tenants"
+
+# Fields returned when listing notes, without their embeddings
+NOTE_FIELDS = ("_id", "note", "type", "filename", "total_pages", "possible_duplicates", "created_at", "updated_at")
+
+
+class MissingReducedVectors(ValueError):
+    """Raised when reduced vectors are requested but some notes don't have one."""
+
+
+class StorageBackend(ABC):
+    """Where notes, their embeddings and the indexes built over them are stored."""
+
+    @abstractmethod
+    def insert_notes(self, documents: List[Dict[str, Any]], index_text: bool = True) -> List[str]:
+        """
+        Store new note documents and index their text.
+
+        Args:
+            documents: Note documents with "_id", "note" and "embedding",
+                plus optionally "embedding_reduced", "lsh_buckets" and any
+                other fields
+            index_text: Add the notes to the keyword index; bulk loads turn
+                this off and call ``rebuild_lexical_index`` once at the end
+
+        Returns:
+            Ids of the notes that were stored; a note whose id already
+            exists is skipped rather than failing the whole batch
+        """
+
+    @abstractmethod
+    def get_note(self, note_id: str, with_embedding: bool = True) -> Optional[Dict[str, Any]]:
+        """Get one note with all its fields, or None if it doesn't exist."""
+
+    @abstractmethod
+    def get_notes(self, note_ids: List[str]) -> List[Dict[str, Any]]:
+        """Get the listing fields of several notes, in the order given, skipping missing ones."""
+
+    @abstractmethod
+    def list_notes(self) -> List[Dict[str, Any]]:
+        """Get the listing fields of every note."""
+
+    @abstractmethod
+    def count_notes(self) -> int:
+        """Number of stored notes."""
+
+    @abstractmethod
+    def embedding_dim(self) -> Optional[int]:
+        """Dimension of the stored embeddings, or None if there are none yet."""
+
+    @abstractmethod
+    def iter_notes(self, batch_size: int = 1000) -> Iterator[Tuple[List[Dict[str, Any]], np.ndarray]]:
+        """
+        Stream every note with all its fields in batches.
+
+        Yields:
+            Tuples of (notes without embeddings or index fields, matrix of
+            their full embeddings)
+        """
+
+    @abstractmethod
+    def update_notes(self, documents: List[Dict[str, Any]]) -> List[bool]:
+        """
+        Replace the text and embeddings of existing notes and re-index them.
+
+        Args:
+            documents: Documents with "_id", "note", "embedding" and the other
+                fields to set; without "embedding_reduced" the note's reduced
+                vector is dropped, and without "lsh_buckets" it leaves the
+                near-duplicate index
+
+        Returns:
+            Whether each note existed and was updated, in input order
+        """
+
+    @abstractmethod
+    def delete_notes(self, note_ids: List[str]) -> List[bool]:
+        """Delete notes and drop them from the keyword index; returns whether each existed."""
+
+    def delete_note(self, note_id: str) -> bool:
+        """Delete a note and drop it from the keyword index; False if it didn't exist."""
+        return self.delete_notes([note_id])[0]
+
+    @abstractmethod
+    def load_vectors(self, reduced: bool = False) -> Tuple[List[str], np.ndarray]:
+        """
+        Load the embeddings of every note.
+
+        Args:
+            reduced: Load the reduced vectors instead of the full embeddings
+
+        Returns:
+            Tuple of (note ids, matrix with one row per note)
+
+        Raises:
+            MissingReducedVectors: If reduced is set and some notes have none
+        """
+
+    @abstractmethod
+    def load_notes_with_vectors(self, reduced: bool = False) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+        """Like ``load_vectors``, but with the listing fields of each note instead of its id."""
+
+    @abstractmethod
+    def get_vectors(self, note_ids: List[str]) -> Tuple[List[str], np.ndarray]:
+        """Load the full embeddings of some notes, skipping missing ones."""
+
+    @abstractmethod
+    def set_reduced_vectors(self, note_ids: List[str], vectors: np.ndarray) -> None:
+        """Store reduced vectors for existing notes."""
+
+    @abstractmethod
+    def clear_reduced_vectors(self) -> None:
+        """Remove every stored reduced vector."""
+
+    @abstractmethod
+    def set_lsh_buckets(self, note_ids: List[str], buckets: np.ndarray) -> None:
+        """Put existing notes in the near-duplicate index under one hash bucket per table."""
+
+    @abstractmethod
+    def clear_lsh_buckets(self) -> None:
+        """Remove every note from the near-duplicate index."""
+
+    @abstractmethod
+    def lsh_candidates(self, buckets: List[int], limit: int) -> List[str]:
+        """Ids of notes in any of the hash buckets, those sharing the most buckets first."""
+
+    @abstractmethod
+    def lexical_search(self, query: str, limit: int) -> List[Tuple[str, float]]:
+        """Rank notes against a keyword query; returns (note id, score) pairs, best first."""
+
+    @abstractmethod
+    def rebuild_lexical_index(self) -> int:
+        """Rebuild the keyword index from every stored note; returns the number indexed."""
+
+    @abstractmethod
+    def compact_lexical_index(self) -> Dict[str, int]:
+        """Merge the keyword index's incremental writes and drop entries of removed notes."""
+
+    @abstractmethod
+    def tag_embedding_models(self, model_name: str) -> int:
+        """Tag notes stored without an embedding model as ``model_name``; returns the number tagged."""
+
+    @abstractmethod
+    def stale_notes(self, model_name: str) -> List[str]:
+        """Ids of notes with neither a current nor a staged embedding from ``model_name``, shortest text first."""
+
+    @abstractmethod
+    def stale_texts(self, note_ids: List[str], model_name: str) -> Dict[str, str]:
+        """Texts of those of ``note_ids`` that are still stale for ``model_name``, by id."""
+
+    @abstractmethod
+    def stage_embeddings(self, note_ids: List[str], embeddings: np.ndarray, model_name: str) -> None:
+        """
+        Store embeddings from a new model next to the current ones.
+
+        Staged embeddings are not read until ``cutover_embeddings``; updating
+        a note's text discards its staged embedding.
+        """
+
+    @abstractmethod
+    def count_stale(self, model_name: str) -> int:
+        """Number of notes with neither a current nor a staged embedding from ``model_name``."""
+
+    @abstractmethod
+    def count_staged(self, model_name: str) -> int:
+        """Number of notes with a staged embedding from ``model_name``."""
+
+    @abstractmethod
+    def embedding_model_counts(self) -> Dict[str, int]:
+        """Number of notes whose current embedding comes from each model."""
+
+    @abstractmethod
+    def cutover_embeddings(self, model_name: str) -> int:
+        """Swap staged embeddings from ``model_name`` in for the current ones; returns the number switched."""
+
+    @abstractmethod
+    def get_artifact(self, name: str) -> Optional[Dict[str, Any]]:
+        """Load a named artifact derived from the corpus, such as a fitted projection."""
+
+    @abstractmethod
+    def put_artifact(self, name: str, document: Dict[str, Any]) -> None:
+        """Store a named artifact, replacing any previous one."""
+
+    @abstractmethod
+    def delete_artifact(self, name: str) -> None:
+        """Remove a named artifact if it exists."""
+
+    @abstractmethod
+    def get_blob(self, name: str) -> Optional[bytes]:
+        """Load named binary data too large for an artifact, or None if it doesn't exist."""
+
+    @abstractmethod
+    def put_blob(self, name: str, data: bytes) -> None:
+        """Store named binary data of any size, replacing any previous data."""
+
+    @abstractmethod
+    def delete_blob(self, name: str) -> None:
+        """Remove named binary data if it exists."""
+
+    @abstractmethod
+    def drop(self) -> None:
+        """Delete every note, vector, index and artifact."""
+
+    @abstractmethod
+    def close(self) -> None:
+        """Release connections and file handles."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class MongoBackend(StorageBackend):
+    """
+    Stores notes in the ``notes`` collection of a MongoDB database.
+
+    The default tenant uses ``notes_db``; every other tenant has its own
+    ``notes_db_<tenant>`` database with the same collections and indexes.
+    """
+
+    # Blobs are split into documents well under MongoDB's 16MB limit
+    BLOB_CHUNK_BYTES = 8 * 1024 * 1024
+
+    def __init__(self, db_uri: str = DEFAULT_DB_URI, tenant: Optional[str] = None):
+        """Connect to MongoDB and check the server is reachable."""
+        self.database_name = tenant_database(tenant)
+        self.client = MongoClient(db_uri, serverSelectionTimeoutMS=5000)
+        try:
+            self.client.admin.command('ping')
+        except Exception:
+            self.client.close()
+            raise
+        self.db = self.client[self.database_name]
+        self.collection = self.db.notes
+        self.lexical_index = LexicalIndex()
+
+    def insert_notes(self, documents: List[Dict[str, Any]], index_text: bool = True) -> List[str]:
+        if not documents:
+            return []
+        lexical_fields = []
+        if index_text:
+            lexical_fields = self.lexical_index.prepare_many(self.db, [document["note"] for document in documents])
+            for document, fields in zip(documents, lexical_fields):
+                document.update(fields)
+
+        failed = set()
+        try:
+            self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            failed = {error["index"] for error in e.details["writeErrors"]}
+            logger.warning(f"{len(failed)} of {len(documents)} notes were not inserted")
+
+        inserted = [str(document["_id"]) for i, document in enumerate(documents) if i not in failed]
+        if index_text:
+            self._index_text(inserted, [fields for i, fields in enumerate(lexical_fields) if i not in failed])
+        return inserted
+
+    def _index_text(self, note_ids: List[str], lexical_fields: List[Dict[str, Any]],
+                    old: Optional[List[Dict[str, Any]]] = None) -> None:
+        """
+        Write the postings of stored notes, replacing those of ``old``.
+
+        The notes are already stored, so a failure here leaves them marked
+        ``lex_pending`` for ``compact_lexical_index`` to index rather than
+        reporting stored notes as failed.
+        """
+        try:
+            if old:
+                self.lexical_index.remove_many(self.db, old)
+            self.lexical_index.add_many(self.db, lexical_fields)
+            self.lexical_index.mark_indexed(self.db, note_ids)
+        except Exception as e:
+            logger.error(f"Failed to index {len(note_ids)} stored notes, left pending for repair: {e}")
+
+    def get_note(self, note_id: str, with_embedding: bool = True) -> Optional[Dict[str, Any]]:
+        projection = {"lex_seq": 0, "lex_len": 0, "lex_terms": 0, "lex_pending": 0,
+                      "embedding_reduced": 0, "lsh_buckets": 0}
+        if not with_embedding:
+            projection["embedding"] = 0
+        return self.collection.find_one({"_id": note_id}, projection)
+
+    def get_notes(self, note_ids: List[str]) -> List[Dict[str, Any]]:
+        notes = {note["_id"]: note for note in self.collection.find({"_id": {"$in": note_ids}},
+                                                                    {field: 1 for field in NOTE_FIELDS})}
+        return [notes[note_id] for note_id in note_ids if note_id in notes]
+
+    def list_notes(self) -> List[Dict[str, Any]]:
+        return list(self.collection.find({}, {field: 1 for field in NOTE_FIELDS}))
+
+    def count_notes(self) -> int:
+        return self.collection.count_documents({})
+
+    def embedding_dim(self) -> Optional[int]:
+        note = self.collection.find_one({"embedding": {"$exists": True}}, {"embedding": 1})
+        return None if note is None else len(note["embedding"])
+
+    def iter_notes(self, batch_size: int = 1000) -> Iterator[Tuple[List[Dict[str, Any]], np.ndarray]]:
+        # Index fields and staged or derived vectors are rebuilt wherever the notes are loaded
+        excluded = ("lex_seq", "lex_len", "lex_terms", "lex_pending", "embedding_reduced", "lsh_buckets",
+                    "embedding_next", "embedding_next_model")
+        notes = []
+        for note in self.collection.find({}, {field: 0 for field in excluded}, batch_size=batch_size):
+            notes.append(note)
+            if len(notes) >= batch_size:
+                yield notes, _to_matrix([note.pop("embedding") for note in notes])
+                notes = []
+        if notes:
+            yield notes, _to_matrix([note.pop("embedding") for note in notes])
+
+    def _lexical_state(self, note_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Keyword index fields of existing notes, by id."""
+        return {
+            note["_id"]: note
+            for note in self.collection.find({"_id": {"$in": note_ids}},
+                                             {"lex_seq": 1, "lex_len": 1, "lex_terms": 1})
+        }
+
+    def update_notes(self, documents: List[Dict[str, Any]]) -> List[bool]:
+        old = self._lexical_state([document["_id"] for document in documents])
+        present = [document for document in documents if document["_id"] in old]
+        if present:
+            lexical_fields = self.lexical_index.prepare_many(self.db, [document["note"] for document in present])
+            operations = []
+            for document, fields in zip(present, lexical_fields):
+                unset = {"embedding_next": "", "embedding_next_model": ""}
+                for field in ("embedding_reduced", "lsh_buckets"):
+                    if field not in document:
+                        unset[field] = ""
+                changes = {key: value for key, value in document.items() if key != "_id"}
+                operations.append(UpdateOne({"_id": document["_id"]},
+                                            {"$set": {**changes, **fields}, "$unset": unset}))
+            self.collection.bulk_write(operations, ordered=False)
+
+            self._index_text([document["_id"] for document in present], lexical_fields,
+                             [old[document["_id"]] for document in present])
+
+        return [document["_id"] in old for document in documents]
+
+    def delete_notes(self, note_ids: List[str]) -> List[bool]:
+        notes = self._lexical_state(note_ids)
+        if notes:
+            self.collection.delete_many({"_id": {"$in": list(notes)}})
+            self.lexical_index.remove_many(self.db, list(notes.values()))
+        return [note_id in notes for note_id in note_ids]
+
+    def _vector_field(self, reduced: bool) -> str:
+        """Name of the field holding the requested vectors, checking reduced ones are complete."""
+        if not reduced:
+            return "embedding"
+        missing = self.collection.count_documents({"embedding_reduced": {"$exists": False}})
+        if missing:
+            raise MissingReducedVectors(f"{missing} notes have no reduced embedding; run fit_projection first")
+        return "embedding_reduced"
+
+    def load_vectors(self, reduced: bool = False) -> Tuple[List[str], np.ndarray]:
+        field = self._vector_field(reduced)
+        docs = list(self.collection.find({}, {"_id": 1, field: 1}))
+        return [doc["_id"] for doc in docs], _to_matrix([doc[field] for doc in docs])
+
+    def load_notes_with_vectors(self, reduced: bool = False) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+        field = self._vector_field(reduced)
+        notes = list(self.collection.find({}, {**{name: 1 for name in NOTE_FIELDS}, field: 1}))
+        return notes, _to_matrix([note.pop(field) for note in notes])
+
+    def get_vectors(self, note_ids: List[str]) -> Tuple[List[str], np.ndarray]:
+        docs = list(self.collection.find({"_id": {"$in": note_ids}}, {"_id": 1, "embedding": 1}))
+        return [doc["_id"] for doc in docs], _to_matrix([doc["embedding"] for doc in docs])
+
+    def set_reduced_vectors(self, note_ids: List[str], vectors: np.ndarray, batch_size: int = 1000) -> None:
+        for start in range(0, len(note_ids), batch_size):
+            self.collection.bulk_write([
+                UpdateOne({"_id": note_id}, {"$set": {"embedding_reduced": vector.tolist()}})
+                for note_id, vector in zip(note_ids[start:start + batch_size], vectors[start:start + batch_size])
+            ], ordered=False)
+
+    def clear_reduced_vectors(self) -> None:
+        self.collection.update_many({}, {"$unset": {"embedding_reduced": ""}})
+
+    def set_lsh_buckets(self, note_ids: List[str], buckets: np.ndarray, batch_size: int = 1000) -> None:
+        self.collection.create_index("lsh_buckets", sparse=True)
+        for start in range(0, len(note_ids), batch_size):
+            self.collection.bulk_write([
+                UpdateOne({"_id": note_id}, {"$set": {"lsh_buckets": [int(bucket) for bucket in note_buckets]}})
+                for note_id, note_buckets in zip(note_ids[start:start + batch_size], buckets[start:start + batch_size])
+            ], ordered=False)
+
+    def clear_lsh_buckets(self) -> None:
+        self.collection.update_many({"lsh_buckets": {"$exists": True}}, {"$unset": {"lsh_buckets": ""}})
+
+    def lsh_candidates(self, buckets: List[int], limit: int) -> List[str]:
+        buckets = [int(bucket) for bucket in buckets]
+        docs = self.collection.aggregate([
+            {"$match": {"lsh_buckets": {"$in": buckets}}},
+            {"$project": {"lsh_buckets": 1}},
+            {"$unwind": "$lsh_buckets"},
+            {"$match": {"lsh_buckets": {"$in": buckets}}},
+            {"$group": {"_id": "$_id", "shared": {"$sum": 1}}},
+            {"$sort": {"shared": -1}},
+            {"$limit": limit}
+        ])
+        return [doc["_id"] for doc in docs]
+
+    def lexical_search(self, query: str, limit: int) -> List[Tuple[str, float]]:
+        return self.lexical_index.search(self.db, query, limit)
+
+    def rebuild_lexical_index(self) -> int:
+        return self.lexical_index.rebuild(self.db)
+
+    def compact_lexical_index(self) -> Dict[str, int]:
+        return self.lexical_index.compact(self.db)
+
+    @staticmethod
+    def _stale_filter(model_name: str) -> Dict[str, Any]:
+        """Match notes that have neither a current nor a staged embedding from a model."""
+        return {"embedding_model": {"$ne": model_name}, "embedding_next_model": {"$ne": model_name}}
+
+    def tag_embedding_models(self, model_name: str) -> int:
+        return self.collection.update_many(
+            {"embedding_model": {"$exists": False}},
+            {"$set": {"embedding_model": model_name}}
+        ).modified_count
+
+    def stale_notes(self, model_name: str) -> List[str]:
+        return [doc["_id"] for doc in self.collection.aggregate([
+            {"$match": self._stale_filter(model_name)},
+            {"$project": {"_id": 1, "length": {"$strLenCP": {"$ifNull": ["$note", ""]}}}},
+            {"$sort": {"length": 1, "_id": 1}}
+        ], allowDiskUse=True)]
+
+    def stale_texts(self, note_ids: List[str], model_name: str) -> Dict[str, str]:
+        return {
+            doc["_id"]: doc.get("note", "")
+            for doc in self.collection.find({"_id": {"$in": note_ids}, **self._stale_filter(model_name)},
+                                            {"_id": 1, "note": 1})
+        }
+
+    def stage_embeddings(self, note_ids: List[str], embeddings: np.ndarray, model_name: str) -> None:
+        if note_ids:
+            self.collection.bulk_write([
+                UpdateOne({"_id": note_id}, {"$set": {
+                    "embedding_next": np.asarray(embedding, dtype=np.float32).tolist(),
+                    "embedding_next_model": model_name
+                }})
+                for note_id, embedding in zip(note_ids, embeddings)
+            ], ordered=False)
+
+    def count_stale(self, model_name: str) -> int:
+        return self.collection.count_documents(self._stale_filter(model_name))
+
+    def count_staged(self, model_name: str) -> int:
+        return self.collection.count_documents({"embedding_next_model": model_name})
+
+    def embedding_model_counts(self) -> Dict[str, int]:
+        return {
+            str(group["_id"]): group["count"]
+            for group in self.collection.aggregate([{"$group": {"_id": "$embedding_model", "count": {"$sum": 1}}}])
+        }
+
+    def cutover_embeddings(self, model_name: str) -> int:
+        return self.collection.update_many(
+            {"embedding_next_model": model_name},
+            [
+                {"$set": {"embedding": "$embedding_next", "embedding_model": "$embedding_next_model"}},
+                {"$unset": ["embedding_next", "embedding_next_model"]}
+            ]
+        ).modified_count
+
+    def get_artifact(self, name: str) -> Optional[Dict[str, Any]]:
+        return self.db.artifacts.find_one({"_id": name})
+
+    def put_artifact(self, name: str, document: Dict[str, Any]) -> None:
+        self.db.artifacts.replace_one({"_id": name}, {**document, "_id": name}, upsert=True)
+
+    def delete_artifact(self, name: str) -> None:
+        self.db.artifacts.delete_one({"_id": name})
+
+    def get_blob(self, name: str) -> Optional[bytes]:
+        chunks = list(self.db.blobs.find({"name": name}).sort("n", 1))
+        if not chunks:
+            return None
+        return b"".join(chunk["data"] for chunk in chunks)
+
+    def put_blob(self, name: str, data: bytes) -> None:
+        self.delete_blob(name)
+        self.db.blobs.insert_many([
+            {"name": name, "n": n, "data": Binary(data[start:start + self.BLOB_CHUNK_BYTES])}
+            for n, start in enumerate(range(0, max(len(data), 1), self.BLOB_CHUNK_BYTES))
+        ])
+        self.db.blobs.create_index([("name", 1), ("n", 1)])
+
+    def delete_blob(self, name: str) -> None:
+        self.db.blobs.delete_many({"name": name})
+
+    def drop(self) -> None:
+        self.client.drop_database(self.database_name)
+        # Its indexes went with it
+        self.lexical_index = LexicalIndex()
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class EmbeddedBackend(StorageBackend):
+    """
+    Stores notes in a local directory without a database server.
+
+    Metadata and text live in SQLite, with an FTS5 table for keyword search.
+    Embeddings are appended to a raw float32 file, one row per note, and read
+    back through a memory map. Rows are only ever appended: updating a note
+    writes its new vector to a fresh row, and updating or deleting it leaves
+    the old row behind in the file; once more than half the rows are dead the
+    file is compacted. The near-duplicate index is a table of (bucket, note
+    id) pairs. Embeddings staged by a model migration are appended to a
+    separate file until the cutover replaces the vector file with one built
+    from them.
+    """
+
+    DB_FILE = "cortex.db"
+    VECTORS_FILE = "embeddings.f32"
+    REDUCED_FILE = "embeddings_reduced.f32"
+    STAGED_FILE = "embeddings_next.f32"
+
+    # Document fields kept in their own columns; everything else goes in "extra"
+    _COLUMNS = ("note", "type", "filename", "total_pages", "embedding_model", "created_at", "updated_at")
+    _VECTOR_FIELDS = ("_id", "embedding", "embedding_reduced", "lsh_buckets")
+
+    # SQLite's default limit on bound parameters is 999
+    _MAX_PARAMS = 900
+
+    def __init__(self, path: str):
+        """Open, or create, an embedded store in the directory at ``path``."""
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(path, self.DB_FILE), timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+
+    def _create_schema(self) -> None:
+        """Create the tables on first use."""
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS notes (
+                id TEXT PRIMARY KEY,
+                row INTEGER NOT NULL UNIQUE,
+                note TEXT NOT NULL,
+                type TEXT,
+                filename TEXT,
+                total_pages INTEGER,
+                embedding_model TEXT,
+                has_reduced INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT,
+                updated_at TEXT,
+                extra BLOB
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value
+            );
+            CREATE TABLE IF NOT EXISTS artifacts (
+                name TEXT PRIMARY KEY,
+                data BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS blobs (
+                name TEXT PRIMARY KEY,
+                data BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS lsh (
+                bucket INTEGER NOT NULL,
+                id TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS lsh_bucket ON lsh (bucket);
+            CREATE INDEX IF NOT EXISTS lsh_id ON lsh (id);
+            CREATE TABLE IF NOT EXISTS staged (
+                id TEXT PRIMARY KEY,
+                row INTEGER NOT NULL,
+                model TEXT NOT NULL
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+                note, content='notes', content_rowid='row', tokenize="unicode61 tokenchars '_'"
+            );
+        """)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _get_meta(self, key: str, default: Any = None) -> Any:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row["value"]
+
+    def _set_meta(self, key: str, value: Any) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _write_rows(self, name: str, start_row: int, vectors: np.ndarray) -> None:
+        """Write consecutive rows of a vector file, growing it as needed."""
+        data = np.ascontiguousarray(vectors, dtype=np.float32)
+        fd = os.open(self._file(name), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.pwrite(fd, data.tobytes(), start_row * data.shape[1] * 4)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _grow(self, name: str, rows: int, dim: int) -> None:
+        """Extend a vector file with zeros to hold at least ``rows`` rows."""
+        with open(self._file(name), "ab") as handle:
+            if os.fstat(handle.fileno()).st_size < rows * dim * 4:
+                handle.truncate(rows * dim * 4)
+
+    def _memmap(self, name: str, dim_key: str, mode: str = "r", rows_key: str = "rows") -> Optional[np.ndarray]:
+        """Map a vector file as a (rows, dim) float32 array."""
+        rows = self._get_meta(rows_key, 0)
+        dim = self._get_meta(dim_key)
+        if not rows or dim is None:
+            return None
+        return np.memmap(self._file(name), dtype=np.float32, mode=mode, shape=(rows, dim))
+
+    def _select(self, query: str, note_ids: List[str]) -> List[sqlite3.Row]:
+        """Run a query with an ``IN ({ids})`` placeholder in chunks under the parameter limit."""
+        rows = []
+        for start in range(0, len(note_ids), self._MAX_PARAMS):
+            chunk = note_ids[start:start + self._MAX_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            rows.extend(self.conn.execute(query.format(ids=placeholders), chunk))
+        return rows
+
+    def insert_notes(self, documents: List[Dict[str, Any]], index_text: bool = True) -> List[str]:
+        if not documents:
+            return []
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            existing = {row["id"] for row in self._select("SELECT id FROM notes WHERE id IN ({ids})",
+                                                          [document["_id"] for document in documents])}
+            if existing:
+                logger.warning(f"{len(existing)} of {len(documents)} notes were not inserted")
+                documents = [document for document in documents if document["_id"] not in existing]
+            if not documents:
+                self.conn.execute("ROLLBACK")
+                return []
+            first_row, has_reduced = self._append_vectors(documents)
+            records = []
+            for offset, document in enumerate(documents):
+                row = first_row + offset
+                records.append((
+                    document["_id"],
+                    row,
+                    document["note"],
+                    document.get("type"),
+                    document.get("filename"),
+                    document.get("total_pages"),
+                    document.get("embedding_model"),
+                    int(has_reduced[offset]),
+                    _to_iso(document.get("created_at")),
+                    _to_iso(document.get("updated_at")),
+                    self._encode_extra(document)
+                ))
+
+            self.conn.executemany("""
+                INSERT INTO notes (id, row, note, type, filename, total_pages, embedding_model,
+                                   has_reduced, created_at, updated_at, extra)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, records)
+            if index_text:
+                self.conn.executemany("INSERT INTO notes_fts (rowid, note) VALUES (?, ?)",
+                                      [(record[1], record[2]) for record in records])
+            self.conn.executemany("INSERT INTO lsh (bucket, id) VALUES (?, ?)", [
+                (int(bucket), document["_id"])
+                for document in documents for bucket in document.get("lsh_buckets") or ()
+            ])
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        return [document["_id"] for document in documents]
+
+    def _append_vectors(self, documents: List[Dict[str, Any]]) -> Tuple[int, List[bool]]:
+        """
+        Write the documents' vectors to new rows at the end of the vector files.
+
+        Rows are never overwritten, so memory maps held by readers stay
+        consistent. Must run inside a transaction.
+
+        Returns:
+            The first new row, and whether each document got a reduced vector
+        """
+        vectors = _to_matrix([document["embedding"] for document in documents])
+
+        first_row = self._get_meta("rows", 0)
+        dim = self._get_meta("dim")
+        if dim is None:
+            self._set_meta("dim", vectors.shape[1])
+        elif dim != vectors.shape[1]:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match stored dimension {dim}")
+
+        self._write_rows(self.VECTORS_FILE, first_row, vectors)
+
+        reduced_dim = self._get_meta("reduced_dim")
+        has_reduced = [reduced_dim is not None and reduced_dim == len(document.get("embedding_reduced") or ())
+                       for document in documents]
+        if reduced_dim is not None:
+            # Rows without a reduced vector are left as zeros so the file stays as long as the full one
+            reduced = np.zeros((len(documents), reduced_dim), dtype=np.float32)
+            for offset, document in enumerate(documents):
+                if has_reduced[offset]:
+                    reduced[offset] = document["embedding_reduced"]
+            self._write_rows(self.REDUCED_FILE, first_row, reduced)
+
+        self._set_meta("rows", first_row + len(documents))
+        return first_row, has_reduced
+
+    def _encode_extra(self, document: Dict[str, Any]) -> Optional[bytes]:
+        """BSON-encode the document fields that have no column of their own."""
+        extra = {key: value for key, value in document.items()
+                 if key not in self._COLUMNS and key not in self._VECTOR_FIELDS}
+        return bson.encode(extra) if extra else None
+
+    def _row_to_note(self, row: sqlite3.Row, full: bool = False) -> Dict[str, Any]:
+        """Turn a notes table row into a note document."""
+        note = {"_id": row["id"]}
+        for column in ("note", "type", "filename", "total_pages"):
+            if row[column] is not None:
+                note[column] = row[column]
+        note["created_at"] = datetime.fromisoformat(row["created_at"])
+        note["updated_at"] = datetime.fromisoformat(row["updated_at"])
+        extra = bson.decode(row["extra"]) if row["extra"] is not None else {}
+        if full:
+            if row["embedding_model"] is not None:
+                note["embedding_model"] = row["embedding_model"]
+            note.update(extra)
+        elif "possible_duplicates" in extra:
+            note["possible_duplicates"] = extra["possible_duplicates"]
+        return note
+
+    def get_note(self, note_id: str, with_embedding: bool = True) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute("SELECT * FROM notes WHERE id = ?", (note_id,)).fetchone()
+        if row is None:
+            return None
+        note = self._row_to_note(row, full=True)
+        if with_embedding:
+            vectors = self._memmap(self.VECTORS_FILE, "dim")
+            note["embedding"] = vectors[row["row"]].tolist()
+        return note
+
+    def get_notes(self, note_ids: List[str]) -> List[Dict[str, Any]]:
+        notes = {row["id"]: self._row_to_note(row) for row in self._select("SELECT * FROM notes WHERE id IN ({ids})", note_ids)}
+        return [notes[note_id] for note_id in note_ids if note_id in notes]
+
+    def list_notes(self) -> List[Dict[str, Any]]:
+        return [self._row_to_note(row) for row in self.conn.execute("SELECT * FROM notes ORDER BY row")]
+
+    def count_notes(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+
+    def embedding_dim(self) -> Optional[int]:
+        # Fixed by the first insert; every later one is checked against it
+        return self._get_meta("dim")
+
+    def iter_notes(self, batch_size: int = 1000) -> Iterator[Tuple[List[Dict[str, Any]], np.ndarray]]:
+        vectors = self._memmap(self.VECTORS_FILE, "dim")
+        cursor = self.conn.execute("SELECT * FROM notes ORDER BY row")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [self._row_to_note(row, full=True) for row in rows], vectors[[row["row"] for row in rows]]
+
+    def update_notes(self, documents: List[Dict[str, Any]]) -> List[bool]:
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            old = {row["id"]: row for row in self._select("SELECT * FROM notes WHERE id IN ({ids})",
+                                                          [document["_id"] for document in documents])}
+            present = [document for document in documents if document["_id"] in old]
+            # New vectors go to fresh rows and the old rows are left dead, like deleted notes' rows
+            first_row, has_reduced = self._append_vectors(present) if present else (0, [])
+            for offset, document in enumerate(present):
+                row = old[document["_id"]]
+                new_row = first_row + offset
+
+                extra = bson.decode(row["extra"]) if row["extra"] is not None else {}
+                extra.update({key: value for key, value in document.items()
+                              if key not in self._COLUMNS and key not in self._VECTOR_FIELDS})
+                self.conn.execute("INSERT INTO notes_fts (notes_fts, rowid, note) VALUES ('delete', ?, ?)",
+                                  (row["row"], row["note"]))
+                self.conn.execute("""
+                    UPDATE notes SET row = ?, note = ?, embedding_model = ?, has_reduced = ?, updated_at = ?, extra = ?
+                    WHERE id = ?
+                """, (
+                    new_row,
+                    document["note"],
+                    document.get("embedding_model", row["embedding_model"]),
+                    int(has_reduced[offset]),
+                    _to_iso(document.get("updated_at")) or row["updated_at"],
+                    bson.encode(extra) if extra else None,
+                    document["_id"]
+                ))
+                self.conn.execute("INSERT INTO notes_fts (rowid, note) VALUES (?, ?)",
+                                  (new_row, document["note"]))
+                self.conn.execute("DELETE FROM lsh WHERE id = ?", (document["_id"],))
+                self.conn.executemany("INSERT INTO lsh (bucket, id) VALUES (?, ?)",
+                                      [(int(bucket), document["_id"]) for bucket in document.get("lsh_buckets") or ()])
+                # A staged embedding was computed from the old text
+                self.conn.execute("DELETE FROM staged WHERE id = ?", (document["_id"],))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        self._compact_if_sparse(bool(present))
+        return [document["_id"] in old for document in documents]
+
+    def delete_notes(self, note_ids: List[str]) -> List[bool]:
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self._select("SELECT id, row, note FROM notes WHERE id IN ({ids})", note_ids)
+            self.conn.executemany("INSERT INTO notes_fts (notes_fts, rowid, note) VALUES ('delete', ?, ?)",
+                                  [(row["row"], row["note"]) for row in rows])
+            self.conn.executemany("DELETE FROM notes WHERE id = ?", [(row["id"],) for row in rows])
+            self.conn.executemany("DELETE FROM lsh WHERE id = ?", [(row["id"],) for row in rows])
+            self.conn.executemany("DELETE FROM staged WHERE id = ?", [(row["id"],) for row in rows])
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        self._compact_if_sparse(bool(rows))
+        deleted = {row["id"] for row in rows}
+        return [note_id in deleted for note_id in note_ids]
+
+    def _compact_if_sparse(self, changed: bool) -> None:
+        """Compact the vector files once more than half their rows are dead."""
+        total = self._get_meta("rows", 0)
+        if changed and total > 1000 and self.count_notes() < total // 2:
+            self.compact()
+
+    def compact(self) -> None:
+        """Rewrite the vector files without the rows of deleted notes."""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = [row["row"] for row in self.conn.execute("SELECT row FROM notes ORDER BY row")]
+            for name, dim_key in ((self.VECTORS_FILE, "dim"), (self.REDUCED_FILE, "reduced_dim")):
+                vectors = self._memmap(name, dim_key)
+                if vectors is None or not os.path.exists(self._file(name)):
+                    continue
+                temp = self._file(name + ".compact")
+                np.ascontiguousarray(vectors[rows]).tofile(temp)
+                # Readers that already mapped the old file keep their copy
+                os.replace(temp, self._file(name))
+
+            # Shift rows down in order, which never collides with the UNIQUE constraint
+            for new_row, old_row in enumerate(rows):
+                if new_row != old_row:
+                    self.conn.execute("UPDATE notes SET row = ? WHERE row = ?", (new_row, old_row))
+            self._set_meta("rows", len(rows))
+            self.conn.execute("INSERT INTO notes_fts (notes_fts) VALUES ('rebuild')")
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        logger.info(f"Compacted embedded store to {len(rows)} rows")
+
+    def _live_vectors(self, reduced: bool) -> Tuple[List[sqlite3.Row], Optional[np.ndarray]]:
+        """Rows of every note in row order, with the matching vectors."""
+        if reduced:
+            missing = self.conn.execute("SELECT COUNT(*) FROM notes WHERE has_reduced = 0").fetchone()[0]
+            if missing:
+                raise MissingReducedVectors(f"{missing} notes have no reduced embedding; run fit_projection first")
+            vectors = self._memmap(self.REDUCED_FILE, "reduced_dim")
+        else:
+            vectors = self._memmap(self.VECTORS_FILE, "dim")
+
+        rows = self.conn.execute("SELECT * FROM notes ORDER BY row").fetchall()
+        if vectors is None or not rows:
+            return rows, None
+        if len(rows) == len(vectors):
+            # No deleted rows: the mapped file is the matrix, no copy needed
+            return rows, vectors
+        return rows, vectors[[row["row"] for row in rows]]
+
+    def load_vectors(self, reduced: bool = False) -> Tuple[List[str], np.ndarray]:
+        rows, vectors = self._live_vectors(reduced)
+        if vectors is None:
+            return [], np.empty((0, 0), dtype=np.float32)
+        return [row["id"] for row in rows], vectors
+
+    def load_notes_with_vectors(self, reduced: bool = False) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+        rows, vectors = self._live_vectors(reduced)
+        if vectors is None:
+            return [], np.empty((0, 0), dtype=np.float32)
+        return [self._row_to_note(row) for row in rows], vectors
+
+    def get_vectors(self, note_ids: List[str]) -> Tuple[List[str], np.ndarray]:
+        rows = self._select("SELECT id, row FROM notes WHERE id IN ({ids})", note_ids)
+        vectors = self._memmap(self.VECTORS_FILE, "dim")
+        if vectors is None or not rows:
+            return [], np.empty((0, 0), dtype=np.float32)
+        return [row["id"] for row in rows], vectors[[row["row"] for row in rows]]
+
+    def set_reduced_vectors(self, note_ids: List[str], vectors: np.ndarray) -> None:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            reduced_dim = self._get_meta("reduced_dim")
+            if reduced_dim != vectors.shape[1]:
+                # A new projection; rows written for the old one are meaningless
+                self.conn.execute("UPDATE notes SET has_reduced = 0")
+                if os.path.exists(self._file(self.REDUCED_FILE)):
+                    os.remove(self._file(self.REDUCED_FILE))
+                self._set_meta("reduced_dim", vectors.shape[1])
+
+            rows = {row["id"]: row["row"] for row in self._select("SELECT id, row FROM notes WHERE id IN ({ids})", note_ids)}
+            total = self._get_meta("rows", 0)
+            self._grow(self.REDUCED_FILE, total, vectors.shape[1])
+            reduced = np.memmap(self._file(self.REDUCED_FILE), dtype=np.float32, mode="r+",
+                                shape=(total, vectors.shape[1]))
+            found = [(rows[note_id], i) for i, note_id in enumerate(note_ids) if note_id in rows]
+            if found:
+                target_rows, source_rows = zip(*found)
+                reduced[list(target_rows)] = vectors[list(source_rows)]
+                reduced.flush()
+            del reduced
+
+            self.conn.executemany("UPDATE notes SET has_reduced = 1 WHERE row = ?",
+                                  [(row,) for row, _ in found])
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def clear_reduced_vectors(self) -> None:
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute("UPDATE notes SET has_reduced = 0")
+            self.conn.execute("DELETE FROM meta WHERE key = 'reduced_dim'")
+            if os.path.exists(self._file(self.REDUCED_FILE)):
+                os.remove(self._file(self.REDUCED_FILE))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def set_lsh_buckets(self, note_ids: List[str], buckets: np.ndarray) -> None:
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            existing = {row["id"] for row in self._select("SELECT id FROM notes WHERE id IN ({ids})", note_ids)}
+            self.conn.executemany("DELETE FROM lsh WHERE id = ?", [(note_id,) for note_id in existing])
+            self.conn.executemany("INSERT INTO lsh (bucket, id) VALUES (?, ?)", [
+                (int(bucket), note_id)
+                for note_id, note_buckets in zip(note_ids, buckets) if note_id in existing
+                for bucket in note_buckets
+            ])
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def clear_lsh_buckets(self) -> None:
+        self.conn.execute("DELETE FROM lsh")
+
+    def lsh_candidates(self, buckets: List[int], limit: int) -> List[str]:
+        buckets = [int(bucket) for bucket in buckets][:self._MAX_PARAMS]
+        placeholders = ",".join("?" * len(buckets))
+        rows = self.conn.execute(f"""
+            SELECT id, COUNT(*) AS shared FROM lsh
+            WHERE bucket IN ({placeholders})
+            GROUP BY id
+            ORDER BY shared DESC
+            LIMIT ?
+        """, (*buckets, limit))
+        return [row["id"] for row in rows]
+
+    def lexical_search(self, query: str, limit: int) -> List[Tuple[str, float]]:
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        # Quote each term so FTS5 doesn't read it as query syntax
+        match = " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        rows = self.conn.execute("""
+            SELECT notes.id AS id, -bm25(notes_fts) AS score
+            FROM notes_fts JOIN notes ON notes.row = notes_fts.rowid
+            WHERE notes_fts MATCH ?
+            ORDER BY bm25(notes_fts)
+            LIMIT ?
+        """, (match, limit))
+        return [(row["id"], float(row["score"])) for row in rows]
+
+    def rebuild_lexical_index(self) -> int:
+        self.conn.execute("INSERT INTO notes_fts (notes_fts) VALUES ('rebuild')")
+        return self.count_notes()
+
+    def compact_lexical_index(self) -> Dict[str, int]:
+        # FTS5 merges its own segments; 'optimize' folds them into one b-tree
+        self.conn.execute("INSERT INTO notes_fts (notes_fts) VALUES ('optimize')")
+        return {"notes": self.count_notes()}
+
+    # Notes with neither a current nor a staged embedding from the model bound twice
+    _STALE_SQL = """
+        FROM notes LEFT JOIN staged ON staged.id = notes.id
+        WHERE (notes.embedding_model IS NULL OR notes.embedding_model != ?)
+          AND (staged.model IS NULL OR staged.model != ?)
+    """
+
+    def tag_embedding_models(self, model_name: str) -> int:
+        return self.conn.execute("UPDATE notes SET embedding_model = ? WHERE embedding_model IS NULL",
+                                 (model_name,)).rowcount
+
+    def stale_notes(self, model_name: str) -> List[str]:
+        rows = self.conn.execute(f"SELECT notes.id AS id {self._STALE_SQL} ORDER BY length(notes.note), notes.id",
+                                 (model_name, model_name))
+        return [row["id"] for row in rows]
+
+    def stale_texts(self, note_ids: List[str], model_name: str) -> Dict[str, str]:
+        texts = {}
+        for start in range(0, len(note_ids), self._MAX_PARAMS):
+            chunk = note_ids[start:start + self._MAX_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(f"SELECT notes.id AS id, notes.note AS note {self._STALE_SQL} "
+                                     f"AND notes.id IN ({placeholders})", (model_name, model_name, *chunk))
+            texts.update((row["id"], row["note"]) for row in rows)
+        return texts
+
+    def stage_embeddings(self, note_ids: List[str], embeddings: np.ndarray, model_name: str) -> None:
+        if not note_ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self.conn.execute("SELECT 1 FROM staged WHERE model != ? LIMIT 1", (model_name,)).fetchone():
+                # Left over from a migration to another model that never cut over
+                self._clear_staged()
+            first_row = self._get_meta("staged_rows", 0)
+            dim = self._get_meta("staged_dim")
+            if dim is None:
+                self._set_meta("staged_dim", vectors.shape[1])
+            elif dim != vectors.shape[1]:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match staged dimension {dim}")
+            self._write_rows(self.STAGED_FILE, first_row, vectors)
+            # A note staged twice keeps its latest row; the earlier one is left dead
+            self.conn.executemany("INSERT OR REPLACE INTO staged (id, row, model) VALUES (?, ?, ?)",
+                                  [(note_id, first_row + offset, model_name) for offset, note_id in enumerate(note_ids)])
+            self._set_meta("staged_rows", first_row + len(note_ids))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def _clear_staged(self) -> None:
+        """Forget every staged embedding, inside the caller's transaction."""
+        self.conn.execute("DELETE FROM staged")
+        self.conn.execute("DELETE FROM meta WHERE key IN ('staged_rows', 'staged_dim')")
+        if os.path.exists(self._file(self.STAGED_FILE)):
+            os.remove(self._file(self.STAGED_FILE))
+
+    def count_stale(self, model_name: str) -> int:
+        return self.conn.execute(f"SELECT COUNT(*) {self._STALE_SQL}", (model_name, model_name)).fetchone()[0]
+
+    def count_staged(self, model_name: str) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM staged WHERE model = ?", (model_name,)).fetchone()[0]
+
+    def embedding_model_counts(self) -> Dict[str, int]:
+        rows = self.conn.execute("SELECT embedding_model, COUNT(*) AS count FROM notes GROUP BY embedding_model")
+        return {str(row["embedding_model"]): row["count"] for row in rows}
+
+    def cutover_embeddings(self, model_name: str, batch_size: int = 10000) -> int:
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self.conn.execute("""
+                SELECT notes.row AS row, staged.row AS staged_row
+                FROM notes LEFT JOIN staged ON staged.id = notes.id AND staged.model = ?
+                ORDER BY notes.row
+            """, (model_name,)).fetchall()
+            switched = sum(row["staged_row"] is not None for row in rows)
+            if not switched:
+                self.conn.execute("ROLLBACK")
+                return 0
+            dim = self._get_meta("dim")
+            staged_dim = self._get_meta("staged_dim")
+            if switched < len(rows) and staged_dim != dim:
+                raise ValueError(f"{len(rows) - switched} notes still have {dim}-dimensional embeddings "
+                                 f"that cannot sit next to {staged_dim}-dimensional ones")
+
+            # Written in full next to the live file and swapped in, so readers
+            # holding a map of the old file keep a consistent copy
+            total = self._get_meta("rows", 0)
+            current = self._memmap(self.VECTORS_FILE, "dim")
+            staged = self._memmap(self.STAGED_FILE, "staged_dim", rows_key="staged_rows")
+            temp = self._file(self.VECTORS_FILE + ".cutover")
+            vectors = np.memmap(temp, dtype=np.float32, mode="w+", shape=(total, staged_dim))
+            for start in range(0, len(rows), batch_size):
+                chunk = rows[start:start + batch_size]
+                kept = [row["row"] for row in chunk if row["staged_row"] is None]
+                moved = [row for row in chunk if row["staged_row"] is not None]
+                if kept:
+                    vectors[kept] = current[kept]
+                if moved:
+                    vectors[[row["row"] for row in moved]] = staged[[row["staged_row"] for row in moved]]
+            vectors.flush()
+            del vectors, current, staged
+
+            self.conn.execute("""
+                UPDATE notes SET embedding_model = ?
+                WHERE id IN (SELECT id FROM staged WHERE model = ?)
+            """, (model_name, model_name))
+            self._set_meta("dim", staged_dim)
+            self._clear_staged()
+            os.replace(temp, self._file(self.VECTORS_FILE))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return switched
+
+    def get_artifact(self, name: str) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute("SELECT data FROM artifacts WHERE name = ?", (name,)).fetchone()
+        return None if row is None else bson.decode(row["data"])
+
+    def put_artifact(self, name: str, document: Dict[str, Any]) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO artifacts (name, data) VALUES (?, ?)",
+                          (name, bson.encode({**document, "_id": name})))
+
+    def delete_artifact(self, name: str) -> None:
+        self.conn.execute("DELETE FROM artifacts WHERE name = ?", (name,))
+
+    def get_blob(self, name: str) -> Optional[bytes]:
+        row = self.conn.execute("SELECT data FROM blobs WHERE name = ?", (name,)).fetchone()
+        return None if row is None else bytes(row["data"])
+
+    def put_blob(self, name: str, data: bytes) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO blobs (name, data) VALUES (?, ?)", (name, data))
+
+    def delete_blob(self, name: str) -> None:
+        self.conn.execute("DELETE FROM blobs WHERE name = ?", (name,))
+
+    def drop(self) -> None:
+        self.conn.close()
+        for name in (self.DB_FILE, self.DB_FILE + "-wal", self.DB_FILE + "-shm",
+                     self.VECTORS_FILE, self.REDUCED_FILE, self.STAGED_FILE):
+            if os.path.exists(self._file(name)):
+                os.remove(self._file(name))
+        self.conn = sqlite3.connect(os.path.join(self.path, self.DB_FILE), timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self._create_schema()
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def _to_matrix(vectors: List[List[float]]) -> np.ndarray:
+    """Stack embedding lists into a float32 matrix."""
+    if not vectors:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.array(vectors, dtype=np.float32)
+
+
+def _to_iso(value: Any) -> Optional[str]:
+    """Store datetimes as ISO 8601 text."""
+    if value is None:
+        return None
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+def embedded_path(db_uri: str) -> str:
+    """
+    Directory of an embedded store from its URI.
+
+    ``sqlite:///data/cortex`` is relative to the working directory and
+    ``sqlite:////var/lib/cortex`` is absolute, as in SQLAlchemy. ``file://``
+    URIs always carry an absolute path.
+    """
+    parsed = urlparse(db_uri)
+    path = parsed.netloc + parsed.path
+    if parsed.scheme == "sqlite":
+        path = path[1:] if path.startswith("/") else path
+    if not path:
+        raise ValueError(f"No path in embedded storage URI: {db_uri}")
+    return path
+
+
+def validate_tenant(tenant: Optional[str]) -> Optional[str]:
+    """
+    Check a tenant id, returning None for the default tenant.
+
+    Tenant ids are 1 to 48 lowercase letters, digits, '-' and '_', starting
+    with a letter or digit. None or an empty string means the default tenant.
+    """
+    if tenant is None or tenant == "":
+        return None
+    if not isinstance(tenant, str) or not _TENANT_PATTERN.match(tenant):
+        raise ValueError(f"Invalid tenant id: {tenant!r}")
+    return tenant
+
+
+def tenant_database(tenant: Optional[str]) -> str:
+    """Name of the MongoDB database holding a tenant's notes."""
+    tenant = validate_tenant(tenant)
+    return DEFAULT_DATABASE if tenant is None else f"{DEFAULT_DATABASE}_{tenant}"
+
+
+def tenant_path(path: str, tenant: Optional[str]) -> str:
+    """Directory of a tenant's embedded store under the store at ``path``."""
+    tenant = validate_tenant(tenant)
+    return path if tenant is None else os.path.join(path, TENANTS_DIR, tenant)
+
+
+def configured_db_uri() -> str:
+    """Storage URI for command line use, from CORTEX_DB_URI or the local MongoDB default."""
+    return os.environ.get("CORTEX_DB_URI", DEFAULT_DB_URI)
+
+
+def open_backend(db_uri: str = DEFAULT_DB_URI, tenant: Optional[str] = None) -> StorageBackend:
+    """
+    Open the storage backend selected by the scheme of ``db_uri``.
+
+    ``mongodb://`` and ``mongodb+srv://`` URIs use MongoDB; ``sqlite://`` and
+    ``file://`` URIs use the embedded store in the given directory.
+
+    Each tenant gets storage of its own: a separate database on MongoDB, or
+    a ``tenants/<tenant>`` directory in the embedded store. Everything built
+    over the notes (keyword and duplicate indexes, projections, cluster
+    trees, vector files) lives there too, so a request only ever reads its
+    tenant's data. The default tenant (None) uses the storage as before.
+    """
+    scheme = urlparse(db_uri).scheme
+    if scheme in ("mongodb", "mongodb+srv"):
+        return MongoBackend(db_uri, tenant)
+    if scheme in ("sqlite", "file"):
+        return EmbeddedBackend(tenant_path(embedded_path(db_uri), tenant))
+    raise ValueError(f"Unsupported storage URI scheme: {scheme or db_uri}")
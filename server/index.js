@@ -9,6 +9,12 @@ const fs = require('fs');
 const app = express();
 const PORT = 8080;
 
+// Linux caps a single argument at 128KB; larger payloads go to Python on stdin
+const MAX_ARG_LENGTH = 64 * 1024;
+
+// Upper bound on items in one bulk request
+const MAX_BULK_ITEMS = 5000;
+
 // Configure multer for file uploads
 const upload = multer({
     storage: multer.memoryStorage(),
@@ -26,14 +32,81 @@ const upload = multer({
 
 // Middleware
 app.use(cors());
-app.use(bodyParser.json());
+app.use(bodyParser.json({ limit: '50mb' }));
 app.use(bodyParser.urlencoded({ extended: true }));
 
+// Tenant ids name a database or directory, so they are restricted to safe characters
+const TENANT_PATTERN = /^[a-z0-9][a-z0-9_-]{0,47}$/;
+
+// API keys and the tenant each one may act on, from CORTEX_API_KEYS as a JSON
+// object like {"<key>": "acme"}; a null tenant means the default tenant
+function loadApiKeys() {
+    const config = process.env.CORTEX_API_KEYS;
+    if (!config) {
+        return null;
+    }
+    const apiKeys = new Map(Object.entries(JSON.parse(config)));
+    for (const [key, tenant] of apiKeys) {
+        if (!key || (tenant !== null && !TENANT_PATTERN.test(tenant))) {
+            throw new Error(`CORTEX_API_KEYS maps a key to an invalid tenant: ${tenant}`);
+        }
+    }
+    return apiKeys;
+}
+
+const API_KEYS = loadApiKeys();
+
+if (API_KEYS === null) {
+    console.warn('CORTEX_API_KEYS is not set; trusting the X-Tenant-Id header. ' +
+                 'Only run like this behind a proxy that authenticates clients and sets the header.');
+}
+
+// Every request acts on one tenant's notes. With API keys configured, the
+// tenant is the one mapped to the request's bearer key; otherwise it is taken
+// from the X-Tenant-Id header, and without the header the default tenant is used
+app.use((req, res, next) => {
+    if (req.path === '/health') {
+        return next();
+    }
+    
+    let tenant = req.get('X-Tenant-Id');
+    if (API_KEYS !== null) {
+        const match = /^Bearer (.+)$/.exec(req.get('Authorization') || '');
+        if (!match || !API_KEYS.has(match[1])) {
+            return res.status(401).json({
+                success: false,
+                error: 'A valid API key is required'
+            });
+        }
+        const keyTenant = API_KEYS.get(match[1]) || undefined;
+        if (tenant !== undefined && tenant !== keyTenant) {
+            return res.status(403).json({
+                success: false,
+                error: 'API key does not belong to this tenant'
+            });
+        }
+        tenant = keyTenant;
+    }
+    
+    if (tenant !== undefined && !TENANT_PATTERN.test(tenant)) {
+        return res.status(400).json({
+            success: false,
+            error: 'X-Tenant-Id must be 1-48 lowercase letters, digits, - or _'
+        });
+    }
+    req.tenant = tenant;
+    next();
+});
+
 // Utility function to run Python script
-function runPythonScript(scriptPath, args = []) {
+function runPythonScript(scriptPath, args = [], input = null) {
     return new Promise((resolve, reject) => {
         const pythonProcess = spawn('python', [scriptPath, ...args]);
         
+        if (input !== null) {
+            pythonProcess.stdin.end(input);
+        }
+        
         let stdout = '';
         let stderr = '';
         
@@ -70,12 +143,14 @@ function runPythonScript(scriptPath, args = []) {
 }
 
 // Utility function to call Python brain functions
-async function callBrainFunction(functionName, data = {}) {
+async function callBrainFunction(functionName, data = {}, tenant = undefined) {
     const brainScriptPath = path.join(__dirname, '..', 'brainlib', 'brain.py');
-    const args = [functionName, JSON.stringify(data)];
+    const payload = JSON.stringify({ ...data, tenant: tenant });
+    const viaStdin = payload.length > MAX_ARG_LENGTH;
+    const args = [functionName, viaStdin ? '-' : payload];
     
     try {
-        const result = await runPythonScript(brainScriptPath, args);
+        const result = await runPythonScript(brainScriptPath, args, viaStdin ? payload : null);
         return result;
     } catch (error) {
         console.error(`Error calling brain function ${functionName}:`, error);
@@ -84,9 +159,9 @@ async function callBrainFunction(functionName, data = {}) {
 }
 
 // Utility function to call Python clustering functions
-async function callClusterFunction(functionName, data = {}) {
+async function callClusterFunction(functionName, data = {}, tenant = undefined) {
     const clusterScriptPath = path.join(__dirname, '..', 'brainlib', 'cluster.py');
-    const args = [functionName, JSON.stringify(data)];
+    const args = [functionName, JSON.stringify({ ...data, tenant: tenant })];
     
     try {
         const result = await runPythonScript(clusterScriptPath, args);
@@ -97,12 +172,23 @@ async function callClusterFunction(functionName, data = {}) {
     }
 }
 
+// Validate the optional near-duplicate check settings of an upload
+function validateDuplicateOptions(duplicates, threshold) {
+    if (duplicates !== undefined && duplicates !== 'flag' && duplicates !== 'reject') {
+        return "duplicates must be 'flag' or 'reject'";
+    }
+    if (threshold !== undefined && (isNaN(parseFloat(threshold)) || parseFloat(threshold) <= 0 || parseFloat(threshold) > 1)) {
+        return 'duplicate_threshold must be a number in (0, 1]';
+    }
+    return null;
+}
+
 // Routes
 
 // POST /note - Store a new note
 app.post('/note', async (req, res) => {
     try {
-        const { note } = req.body;
+        const { note, duplicates, duplicate_threshold } = req.body;
         
         if (!note || typeof note !== 'string' || note.trim() === '') {
             return res.status(400).json({
@@ -111,16 +197,35 @@ app.post('/note', async (req, res) => {
             });
         }
         
+        const optionsError = validateDuplicateOptions(duplicates, duplicate_threshold);
+        if (optionsError) {
+            return res.status(400).json({ success: false, error: optionsError });
+        }
+        
         console.log(`Storing note: "${note}"`);
         
         // Call Python brain function to store note
-        const result = await callBrainFunction('store_note', { note: note.trim() });
+        const result = await callBrainFunction('store_note', {
+            note: note.trim(),
+            duplicates: duplicates,
+            duplicate_threshold: duplicate_threshold !== undefined ? parseFloat(duplicate_threshold) : undefined
+        }, req.tenant);
+        
+        if (result.success === false && result.duplicates) {
+            return res.status(409).json({
+                success: false,
+                error: 'Note is a near-duplicate of a stored note',
+                details: result.error,
+                duplicates: result.duplicates
+            });
+        }
         
         res.json({
             success: true,
             message: 'Note stored successfully',
             noteId: result.noteId || result.output,
-            note: note.trim()
+            note: note.trim(),
+            possibleDuplicates: result.possible_duplicates || []
         });
         
     } catch (error) {
@@ -144,6 +249,12 @@ app.post('/upload-pdf', upload.single('pdf'), async (req, res) => {
         }
         
         const { originalname, buffer } = req.file;
+        const { duplicates, duplicate_threshold } = req.body || {};
+        
+        const optionsError = validateDuplicateOptions(duplicates, duplicate_threshold);
+        if (optionsError) {
+            return res.status(400).json({ success: false, error: optionsError });
+        }
         
         console.log(`Processing PDF upload: ${originalname} (${buffer.length} bytes)`);
         
@@ -153,10 +264,19 @@ app.post('/upload-pdf', upload.single('pdf'), async (req, res) => {
         // Call Python brain function to store PDF
         const result = await callBrainFunction('store_pdf', { 
             pdf_base64: pdfBase64,
-            filename: originalname
-        });
+            filename: originalname,
+            duplicates: duplicates,
+            duplicate_threshold: duplicate_threshold !== undefined ? parseFloat(duplicate_threshold) : undefined
+        }, req.tenant);
         
-        if (result.success) {
+        if (result.success === false && result.duplicates) {
+            res.status(409).json({
+                success: false,
+                error: 'PDF is a near-duplicate of a stored note',
+                details: result.error,
+                duplicates: result.duplicates
+            });
+        } else if (result.success) {
             res.json({
                 success: true,
                 message: 'PDF uploaded and processed successfully',
@@ -164,7 +284,8 @@ app.post('/upload-pdf', upload.single('pdf'), async (req, res) => {
                 filename: originalname,
                 totalPages: result.total_pages,
                 pagesWithText: result.pages_with_text,
-                fileSizeBytes: result.file_size_bytes
+                fileSizeBytes: result.file_size_bytes,
+                possibleDuplicates: result.possible_duplicates || []
             });
         } else {
             res.status(400).json({
@@ -199,7 +320,7 @@ app.delete('/note/:id', async (req, res) => {
         console.log(`Deleting note with ID: ${id}`);
         
         // Call Python brain function to delete note
-        const result = await callBrainFunction('delete_note', { note_id: id.trim() });
+        const result = await callBrainFunction('delete_note', { note_id: id.trim() }, req.tenant);
         
         if (result.deleted) {
             res.json({
@@ -225,13 +346,152 @@ app.delete('/note/:id', async (req, res) => {
     }
 });
 
+// Check that a bulk request body field is a non-empty array of acceptable size
+function validateBulkItems(items, name) {
+    if (!Array.isArray(items) || items.length === 0) {
+        return `${name} must be a non-empty array`;
+    }
+    if (items.length > MAX_BULK_ITEMS) {
+        return `${name} may contain at most ${MAX_BULK_ITEMS} items`;
+    }
+    return null;
+}
+
+// POST /notes - Store many notes in one batch
+app.post('/notes', async (req, res) => {
+    try {
+        const { notes } = req.body;
+        
+        const validationError = validateBulkItems(notes, 'notes');
+        if (validationError) {
+            return res.status(400).json({
+                success: false,
+                error: validationError
+            });
+        }
+        
+        console.log(`Storing ${notes.length} notes`);
+        
+        const result = await callBrainFunction('store_notes', { notes: notes }, req.tenant);
+        
+        if (result.success === false) {
+            return res.status(500).json({
+                success: false,
+                error: 'Failed to store notes',
+                details: result.error
+            });
+        }
+        
+        res.json({
+            success: true,
+            message: `Stored ${result.stored} of ${notes.length} notes`,
+            stored: result.stored,
+            results: result.results
+        });
+        
+    } catch (error) {
+        console.error('Error storing notes:', error);
+        res.status(500).json({
+            success: false,
+            error: 'Failed to store notes',
+            details: error.message
+        });
+    }
+});
+
+// PATCH /notes - Replace the text of many notes in one batch
+app.patch('/notes', async (req, res) => {
+    try {
+        const { updates } = req.body;
+        
+        const validationError = validateBulkItems(updates, 'updates');
+        if (validationError) {
+            return res.status(400).json({
+                success: false,
+                error: validationError
+            });
+        }
+        
+        console.log(`Updating ${updates.length} notes`);
+        
+        const result = await callBrainFunction('update_notes', {
+            updates: updates.map(({ id, note }) => ({ note_id: id, note: note }))
+        }, req.tenant);
+        
+        if (result.success === false) {
+            return res.status(500).json({
+                success: false,
+                error: 'Failed to update notes',
+                details: result.error
+            });
+        }
+        
+        res.json({
+            success: true,
+            message: `Updated ${result.updated} of ${updates.length} notes`,
+            updated: result.updated,
+            results: result.results
+        });
+        
+    } catch (error) {
+        console.error('Error updating notes:', error);
+        res.status(500).json({
+            success: false,
+            error: 'Failed to update notes',
+            details: error.message
+        });
+    }
+});
+
+// POST /notes/delete - Delete many notes in one batch
+app.post('/notes/delete', async (req, res) => {
+    try {
+        const { ids } = req.body;
+        
+        const validationError = validateBulkItems(ids, 'ids');
+        if (validationError) {
+            return res.status(400).json({
+                success: false,
+                error: validationError
+            });
+        }
+        
+        console.log(`Deleting ${ids.length} notes`);
+        
+        const result = await callBrainFunction('delete_notes', { note_ids: ids }, req.tenant);
+        
+        if (result.success === false) {
+            return res.status(500).json({
+                success: false,
+                error: 'Failed to delete notes',
+                details: result.error
+            });
+        }
+        
+        res.json({
+            success: true,
+            message: `Deleted ${result.deleted} of ${ids.length} notes`,
+            deleted: result.deleted,
+            results: result.results
+        });
+        
+    } catch (error) {
+        console.error('Error deleting notes:', error);
+        res.status(500).json({
+            success: false,
+            error: 'Failed to delete notes',
+            details: error.message
+        });
+    }
+});
+
 // GET /notes - Retrieve all notes
 app.get('/notes', async (req, res) => {
     try {
         console.log('Retrieving all notes');
         
         // Call Python brain function to get all notes
-        const result = await callBrainFunction('get_all_notes');
+        const result = await callBrainFunction('get_all_notes', {}, req.tenant);
         
         res.json({
             success: true,
@@ -249,15 +509,81 @@ app.get('/notes', async (req, res) => {
     }
 });
 
+// GET /search - Search notes by keyword, meaning, or both
+app.get('/search', async (req, res) => {
+    try {
+        const { q, limit = '10', mode = 'hybrid' } = req.query;
+        
+        // Parse parameters
+        const maxResults = parseInt(limit);
+        
+        // Validate parameters
+        if (!q || typeof q !== 'string' || q.trim() === '') {
+            return res.status(400).json({
+                success: false,
+                error: 'Query parameter q is required'
+            });
+        }
+        
+        if (isNaN(maxResults) || maxResults < 1) {
+            return res.status(400).json({
+                success: false,
+                error: 'Invalid limit. Must be a positive integer.'
+            });
+        }
+        
+        if (!['lexical', 'semantic', 'hybrid'].includes(mode)) {
+            return res.status(400).json({
+                success: false,
+                error: 'Invalid mode. Must be lexical, semantic or hybrid.'
+            });
+        }
+        
+        console.log(`Searching notes for "${q}" with mode=${mode}, limit=${maxResults}`);
+        
+        // Call Python brain function to search notes
+        const result = await callBrainFunction('search', {
+            query: q.trim(),
+            limit: maxResults,
+            mode: mode
+        }, req.tenant);
+        
+        if (result.success === false) {
+            return res.status(500).json({
+                success: false,
+                error: 'Failed to search notes',
+                details: result.error
+            });
+        }
+        
+        res.json({
+            success: true,
+            notes: result.notes || [],
+            count: (result.notes || []).length,
+            mode: mode
+        });
+        
+    } catch (error) {
+        console.error('Error searching notes:', error);
+        res.status(500).json({
+            success: false,
+            error: 'Failed to search notes',
+            details: error.message
+        });
+    }
+});
+
 // GET /clusters - Get clustered notes
 app.get('/clusters', async (req, res) => {
     try {
-        const { k, auto_k = 'true', max_k = '10' } = req.query;
+        const { k, auto_k = 'true', max_k = '10', reduced = 'false', timings = 'false' } = req.query;
         
         // Parse parameters
         const autoK = auto_k.toLowerCase() === 'true';
         const maxK = parseInt(max_k);
         const numClusters = k ? parseInt(k) : null;
+        const useReduced = reduced.toLowerCase() === 'true';
+        const withTimings = timings.toLowerCase() === 'true';
         
         // Validate parameters
         if (k && (isNaN(numClusters) || numClusters < 1)) {
@@ -280,8 +606,10 @@ app.get('/clusters', async (req, res) => {
         const result = await callClusterFunction('get_clusters', { 
             k: numClusters, 
             auto_k: autoK, 
-            max_k: maxK 
-        });
+            max_k: maxK,
+            reduced: useReduced,
+            timings: withTimings
+        }, req.tenant);
         
         if (result.success === false) {
             return res.status(500).json({
@@ -296,6 +624,7 @@ app.get('/clusters', async (req, res) => {
             clusters: result.clusters || {},
             autoK: autoK,
             maxK: maxK,
+            ...(withTimings && { timings: result.timings }),
             message: 'Clusters generated successfully'
         });
         
@@ -332,7 +661,7 @@ app.get('/cluster-summary', async (req, res) => {
         const result = await callClusterFunction('get_cluster_summary', { 
             auto_k: autoK, 
             max_k: maxK 
-        });
+        }, req.tenant);
         
         if (result.success === false) {
             return res.status(500).json({
@@ -360,6 +689,169 @@ app.get('/cluster-summary', async (req, res) => {
     }
 });
 
+// POST /cluster-tree - Build and store the cluster tree
+app.post('/cluster-tree', async (req, res) => {
+    try {
+        const { leaf_size = 50, max_depth = 16, reduced = false } = req.body || {};
+        
+        const leafSize = parseInt(leaf_size);
+        const maxDepth = parseInt(max_depth);
+        
+        if (isNaN(leafSize) || leafSize < 1 || isNaN(maxDepth) || maxDepth < 1) {
+            return res.status(400).json({
+                success: false,
+                error: 'leaf_size and max_depth must be positive integers'
+            });
+        }
+        
+        console.log(`Building cluster tree with leaf_size=${leafSize}, max_depth=${maxDepth}`);
+        
+        const result = await callClusterFunction('build_cluster_tree', {
+            leaf_size: leafSize,
+            max_depth: maxDepth,
+            reduced: Boolean(reduced)
+        }, req.tenant);
+        
+        if (result.success === false) {
+            return res.status(500).json({
+                success: false,
+                error: 'Failed to build cluster tree',
+                details: result.error
+            });
+        }
+        
+        res.json({
+            success: true,
+            tree: result.tree,
+            message: 'Cluster tree built successfully'
+        });
+        
+    } catch (error) {
+        console.error('Error building cluster tree:', error);
+        res.status(500).json({
+            success: false,
+            error: 'Failed to build cluster tree',
+            details: error.message
+        });
+    }
+});
+
+// GET /cluster-tree/level/:level - Clusters at one depth of the stored tree
+app.get('/cluster-tree/level/:level', async (req, res) => {
+    try {
+        const level = parseInt(req.params.level);
+        
+        if (isNaN(level) || level < 0) {
+            return res.status(400).json({
+                success: false,
+                error: 'Invalid level. Must be a non-negative integer.'
+            });
+        }
+        
+        const result = await callClusterFunction('get_cluster_level', { level: level }, req.tenant);
+        
+        if (result.success === false) {
+            return res.status(500).json({
+                success: false,
+                error: 'Failed to read cluster level',
+                details: result.error
+            });
+        }
+        
+        res.json(result);
+        
+    } catch (error) {
+        console.error('Error reading cluster level:', error);
+        res.status(500).json({
+            success: false,
+            error: 'Failed to read cluster level',
+            details: error.message
+        });
+    }
+});
+
+// GET /cluster-tree/node/:id - One cluster of the stored tree with its children
+app.get('/cluster-tree/node/:id', async (req, res) => {
+    try {
+        const nodeId = parseInt(req.params.id);
+        const includeNotes = (req.query.notes || 'true').toLowerCase() === 'true';
+        
+        if (isNaN(nodeId) || nodeId < 0) {
+            return res.status(400).json({
+                success: false,
+                error: 'Invalid node id. Must be a non-negative integer.'
+            });
+        }
+        
+        const result = await callClusterFunction('get_cluster_node', {
+            node_id: nodeId,
+            include_notes: includeNotes
+        }, req.tenant);
+        
+        if (result.success === false) {
+            return res.status(500).json({
+                success: false,
+                error: 'Failed to read cluster node',
+                details: result.error
+            });
+        }
+        
+        res.json({
+            success: true,
+            node: result.node
+        });
+        
+    } catch (error) {
+        console.error('Error reading cluster node:', error);
+        res.status(500).json({
+            success: false,
+            error: 'Failed to read cluster node',
+            details: error.message
+        });
+    }
+});
+
+// GET /metrics - Dump collected metrics (set CORTEX_METRICS=1 to collect)
+app.get('/metrics', async (req, res) => {
+    try {
+        const { format = 'prometheus' } = req.query;
+        
+        if (!['prometheus', 'json'].includes(format)) {
+            return res.status(400).json({
+                success: false,
+                error: 'Invalid format. Must be prometheus or json.'
+            });
+        }
+        
+        const result = await callBrainFunction('metrics', { format: format });
+        
+        if (result.success === false) {
+            return res.status(500).json({
+                success: false,
+                error: 'Failed to dump metrics',
+                details: result.error
+            });
+        }
+        
+        if (format === 'prometheus') {
+            res.type('text/plain; version=0.0.4').send(result.metrics);
+        } else {
+            res.json({
+                success: true,
+                metrics: result.metrics
+            });
+        }
+        
+    } catch (error) {
+        console.error('Error dumping metrics:', error);
+        res.status(500).json({
+            success: false,
+            error: 'Failed to dump metrics',
+            details: error.message
+        });
+    }
+});
+
 // Health check endpoint
 app.get('/health', (req, res) => {
     res.json({
@@ -0,0 +1,33 @@
+"""
+Shared fixtures for the brainlib tests.
+
+Backend tests run twice, on the mongomock stand-in and on the embedded store,
+with the deterministic stub encoder in place of SentenceTransformer.
+"""
+
+import pytest
+
+from benchmarks.stubs import StubEncoder, mock_mongo, embedded_store
+from brainlib.brain import BrainCore
+
+BACKENDS = {"mongo": mock_mongo, "embedded": embedded_store}
+
+
+@pytest.fixture(params=sorted(BACKENDS))
+def db_uri(request):
+    """Storage URI of an empty store, once per backend."""
+    with BACKENDS[request.param]() as uri:
+        yield uri
+
+
+@pytest.fixture
+def embedded_uri():
+    """Storage URI of a second, empty embedded store."""
+    with embedded_store() as uri:
+        yield uri
+
+
+@pytest.fixture
+def core():
+    """BrainCore embedding with the stub encoder."""
+    return BrainCore(model_name="stub", model=StubEncoder(dim=32))
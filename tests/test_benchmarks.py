@@ -0,0 +1,33 @@
+"""Benchmark stand-ins and result comparison."""
+
+import numpy as np
+
+from benchmarks.compare import compare
+from benchmarks.stubs import StubEncoder
+from benchmarks.synthetic import make_note_texts, make_pdf
+from brainlib.pdf_processor import PDFProcessor
+
+
+def test_stub_encoder_is_deterministic_and_normalized():
+    first, second = StubEncoder(dim=16), StubEncoder(dim=16)
+    embeddings = first.encode(["red apple", "green apple", "blue car"])
+    np.testing.assert_array_equal(embeddings, second.encode(["red apple", "green apple", "blue car"]))
+    np.testing.assert_allclose(np.linalg.norm(embeddings, axis=1), 1.0, rtol=1e-6)
+    # Texts sharing words embed closer together
+    assert embeddings[0] @ embeddings[1] > embeddings[0] @ embeddings[2]
+
+
+def test_synthetic_texts_and_pdfs_are_reproducible():
+    assert make_note_texts(20, seed=3) == make_note_texts(20, seed=3)
+    pdf = make_pdf(pages=3, seed=1)
+    assert pdf == make_pdf(pages=3, seed=1)
+    assert PDFProcessor().extract_text_from_pdf(pdf, "synthetic.pdf")["total_pages"] == 3
+
+
+def test_compare_flags_regressions_beyond_threshold():
+    baseline = {"results": [{"operation": "search", "scale": 1000, "p50_ms": 10.0, "throughput_per_s": 100.0}]}
+    candidate = {"results": [{"operation": "search", "scale": 1000, "p50_ms": 10.5, "throughput_per_s": 80.0}]}
+    rows = {row["metric"]: row for row in compare(baseline, candidate, threshold=0.1)}
+    assert rows["p50_ms"]["regression"] is False
+    assert rows["throughput_per_s"]["regression"] is True
+    assert rows["throughput_per_s"]["change"] == -0.2
@@ -0,0 +1,63 @@
+"""Near-duplicate checks on new notes and duplicate groups over stored ones."""
+
+import pytest
+
+from brainlib.dedup import DuplicateIndex, DuplicateNoteError, build_duplicate_index, find_duplicate_groups
+from brainlib.storage import open_backend
+
+NOTES = ["alpha beta gamma", "delta epsilon zeta", "alpha beta gamma", "eta theta iota",
+         "delta epsilon zeta", "alpha beta gamma"] + [f"unrelated note number{i} word{i}" for i in range(14)]
+
+
+def test_flagged_note_returns_its_matches(db_uri, core):
+    first = core.store_note("alpha beta gamma", db_uri)
+    assert isinstance(first, str)
+
+    second = core.store_note_with_matches("alpha beta gamma", db_uri, duplicates="flag")
+    assert [match["note_id"] for match in second["possible_duplicates"]] == [first]
+    listed = {note["_id"]: note for note in core.get_all_notes(db_uri)}
+    assert listed[second["note_id"]]["possible_duplicates"] == second["possible_duplicates"]
+
+
+def test_first_check_builds_the_index(db_uri, core):
+    core.store_notes(["alpha beta gamma", "delta epsilon zeta"], db_uri)
+    with open_backend(db_uri) as backend:
+        assert DuplicateIndex.load(backend) is None
+
+    flagged = core.store_note_with_matches("alpha beta gamma", db_uri, duplicates="flag")
+    assert len(flagged["possible_duplicates"]) == 1
+    with open_backend(db_uri) as backend:
+        assert DuplicateIndex.load(backend) is not None
+    # The checked note went into the new index too
+    assert len(core.find_duplicates("alpha beta gamma", db_uri=db_uri)) == 2
+
+
+def test_rejected_note_is_not_stored(db_uri, core):
+    core.store_note("alpha beta gamma", db_uri)
+    with pytest.raises(DuplicateNoteError) as error:
+        core.store_note("alpha beta gamma", db_uri, duplicates="reject")
+    assert len(error.value.matches) == 1
+    assert len(core.get_all_notes(db_uri)) == 1
+
+
+@pytest.mark.parametrize("method", ["blocked", "lsh"])
+def test_groups_keep_the_oldest_note(db_uri, core, method):
+    stored = [core.store_note(note, db_uri) for note in NOTES]
+    with open_backend(db_uri) as backend:
+        build_duplicate_index(backend, batch_size=7)
+        # A block size smaller than the corpus exercises the tiling
+        report = find_duplicate_groups(backend, 0.99, method, block_size=4)
+
+    assert report["notes"] == len(NOTES)
+    assert report["pairs"] == 4
+    groups = {group["keep"]: group for group in report["groups"]}
+    assert set(groups) == {stored[0], stored[1]}
+    assert groups[stored[0]]["duplicates"] == [stored[2], stored[5]]
+    assert groups[stored[1]]["duplicates"] == [stored[4]]
+    assert [group["size"] for group in report["groups"]] == [3, 2]
+
+
+def test_groups_of_an_empty_store(db_uri):
+    with open_backend(db_uri) as backend:
+        report = find_duplicate_groups(backend)
+    assert report["notes"] == 0 and report["groups"] == []
@@ -0,0 +1,139 @@
+"""Keyword index: tokenizing, posting encoding, and keeping the index in step with the notes."""
+
+import mongomock
+import numpy as np
+import pytest
+
+from benchmarks.stubs import mock_mongo
+from benchmarks.synthetic import make_note_documents
+from brainlib.lexical import LexicalIndex, decode_postings, encode_postings, tokenize
+from brainlib.storage import open_backend
+
+
+def _texts(results):
+    return [note["note"] for note in results]
+
+
+def test_tokenize_folds_case_and_diacritics():
+    assert tokenize("Café NAÏVE Straße Ωμέγα 東京") == ["cafe", "naive", "strasse", "ωμεγα", "東京"]
+
+
+def test_tokenize_keeps_identifiers_and_their_parts():
+    assert tokenize("see brainlib.brain and store_note") == [
+        "see", "brainlib.brain", "brainlib", "brain", "and", "store_note"]
+
+
+@pytest.mark.parametrize("base", [0, 3])
+def test_postings_round_trip(base):
+    rng = np.random.default_rng(0)
+    seqs = np.unique(rng.integers(base, base + 10 ** 7, size=500))
+    data, width = encode_postings(seqs, base)
+    np.testing.assert_array_equal(decode_postings(data, width, base), seqs)
+
+
+def test_postings_round_trip_single_gap_widths():
+    for seqs in (np.array([7]), np.array([1, 2, 3]), np.array([0, 255, 256, 70000])):
+        data, width = encode_postings(seqs)
+        np.testing.assert_array_equal(decode_postings(data, width), seqs)
+
+
+def test_search_follows_add_update_and_delete(db_uri, core):
+    stored = core.store_notes(["quarterly plan for the kiwi launch", "grocery list: apples, bread",
+                               "Café meeting about the launch"], db_uri)
+    kiwi_id = stored[0]["noteId"]
+
+    assert _texts(core.search("kiwi", 5, "lexical", db_uri)) == ["quarterly plan for the kiwi launch"]
+    assert _texts(core.search("cafe", 5, "lexical", db_uri)) == ["Café meeting about the launch"]
+
+    core.update_notes([{"note_id": kiwi_id, "note": "quarterly plan for the mango launch"}], db_uri)
+    assert core.search("kiwi", 5, "lexical", db_uri) == []
+    assert _texts(core.search("mango", 5, "lexical", db_uri)) == ["quarterly plan for the mango launch"]
+
+    core.delete_notes([kiwi_id], db_uri)
+    assert core.search("mango", 5, "lexical", db_uri) == []
+    assert _texts(core.search("launch", 5, "lexical", db_uri)) == ["Café meeting about the launch"]
+
+
+def _store(db, index, note_id, text, indexed=True):
+    fields = index.prepare(db, text)
+    db.notes.insert_one({"_id": note_id, "note": text, **fields})
+    if indexed:
+        index.add_many(db, [fields])
+        index.mark_indexed(db, [note_id])
+
+
+def _delete(db, index, note_id):
+    note = db.notes.find_one_and_delete({"_id": note_id})
+    index.remove(db, note)
+
+
+@pytest.fixture
+def lexical_db():
+    return mongomock.MongoClient().notes_db
+
+
+def test_open_blocks_are_bounded(lexical_db):
+    index = LexicalIndex()
+    for i in range(LexicalIndex.OPEN_BLOCK_POSTINGS + 10):
+        _store(lexical_db, index, f"n{i}", f"common word{i}")
+
+    blocks = list(lexical_db.lexicon.find({"term": "common"}))
+    assert len(blocks) == 2
+    assert max(block["count"] for block in blocks) == LexicalIndex.OPEN_BLOCK_POSTINGS
+    assert lexical_db.lexicon_terms.find_one({"_id": "common"})["df"] == LexicalIndex.OPEN_BLOCK_POSTINGS + 10
+
+
+def test_compact_drops_deleted_postings(lexical_db):
+    index = LexicalIndex()
+    for i in range(40):
+        _store(lexical_db, index, f"n{i}", f"shared term{i}")
+    for i in range(30):
+        _delete(lexical_db, index, f"n{i}")
+
+    assert [note_id for note_id, _ in index.search(lexical_db, "term5")] == []
+    counts = index.compact(lexical_db)
+    assert counts["dropped"] == 60
+
+    blocks = list(lexical_db.lexicon.find({"term": "shared"}))
+    assert len(blocks) == 1 and blocks[0]["count"] == 10
+    assert lexical_db.lexicon.count_documents({"term": "term5"}) == 0
+    assert lexical_db.lexicon_terms.find_one({"_id": "shared"})["df"] == 10
+    assert {note_id for note_id, _ in index.search(lexical_db, "shared", 20)} == {f"n{i}" for i in range(30, 40)}
+
+
+def test_compact_repairs_unindexed_notes(lexical_db):
+    index = LexicalIndex()
+    _store(lexical_db, index, "indexed", "first note")
+    _store(lexical_db, index, "orphan", "orphan note", indexed=False)
+
+    assert index.search(lexical_db, "orphan") == []
+    assert index.compact(lexical_db)["repaired"] == 1
+    assert [note_id for note_id, _ in index.search(lexical_db, "orphan")] == ["orphan"]
+    assert "lex_pending" not in lexical_db.notes.find_one({"_id": "orphan"})
+
+
+def test_rebuild_matches_incremental_index(lexical_db):
+    index = LexicalIndex()
+    for i, text in enumerate(["red apple", "green apple", "red car", "blue car"]):
+        _store(lexical_db, index, f"n{i}", text)
+    before = index.search(lexical_db, "red apple")
+
+    assert index.rebuild(lexical_db) == 4
+    after = index.search(lexical_db, "red apple")
+    assert [note_id for note_id, _ in after] == [note_id for note_id, _ in before]
+    np.testing.assert_allclose([score for _, score in after], [score for _, score in before], rtol=1e-5)
+
+
+def test_indexes_are_created_once_per_backend(monkeypatch):
+    created = []
+    original = mongomock.collection.Collection.create_index
+
+    def create_index(collection, keys, **kwargs):
+        created.append(collection.name)
+        return original(collection, keys, **kwargs)
+
+    monkeypatch.setattr(mongomock.collection.Collection, "create_index", create_index)
+    with mock_mongo() as uri, open_backend(uri) as backend:
+        for documents in make_note_documents(30, dim=8, batch_size=10):
+            backend.insert_notes(documents)
+    assert sorted(created) == ["lexicon", "notes"]
@@ -0,0 +1,29 @@
+"""Metrics registry: the per-request timings block."""
+
+from brainlib import metrics
+from brainlib.metrics import MetricsRegistry
+
+
+def test_timings_are_cleared_on_read():
+    registry = MetricsRegistry()
+    registry.enabled = True
+    with registry.span("encode"):
+        pass
+
+    first = registry.timings()
+    assert [span["name"] for span in first["spans"]] == ["encode"]
+    assert "ms" in first["spans"][0]
+    assert registry.timings() == {"spans": [], "mongo": {}}
+
+
+def test_timings_keep_only_the_latest_spans(monkeypatch):
+    monkeypatch.setattr(metrics, "MAX_TIMINGS", 3)
+    registry = MetricsRegistry()
+    registry.enabled = True
+    for batch in range(5):
+        with registry.span("encode", batch=batch):
+            pass
+
+    timings = registry.timings()
+    assert [span["batch"] for span in timings["spans"]] == [2, 3, 4]
+    assert timings["dropped_spans"] == 2
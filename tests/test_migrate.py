@@ -0,0 +1,79 @@
+"""Embedding model migrations: staging, cutover, and brains following the store's model."""
+
+import numpy as np
+import pytest
+
+from benchmarks.stubs import StubEncoder
+from brainlib import brain
+from brainlib.brain import BrainCore, active_model, get_brain_core
+from brainlib.migrate import EmbeddingMigrator
+from brainlib.storage import open_backend
+
+TEXTS = ["gradient descent on the loss", "simmer the garlic in butter", "quarterly budget forecast"]
+
+
+@pytest.fixture
+def encoders(monkeypatch):
+    """Stub encoders registered as already loaded, so no model is ever downloaded."""
+    old = StubEncoder(dim=32)
+    new = StubEncoder(dim=48, seed=1)
+    monkeypatch.setitem(brain._encoders, "stub", old)
+    monkeypatch.setitem(brain._encoders, "stub-v2", new)
+    return old, new
+
+
+def _vectors(uri):
+    with open_backend(uri) as backend:
+        ids, vectors = backend.load_vectors()
+    return dict(zip(ids, vectors))
+
+
+def test_migrate_and_cutover_switch_vectors_and_model(embedded_uri, encoders):
+    old, new = encoders
+    ids = [r["noteId"] for r in BrainCore("stub").store_notes(TEXTS, embedded_uri)]
+    migrator = EmbeddingMigrator("stub-v2", batch_size=2)
+
+    checkpoint = migrator.migrate(embedded_uri, legacy_model="stub")
+    assert checkpoint["state"] == "staged" and checkpoint["processed"] == 3
+    # Reads keep using the old vectors until the cutover
+    assert _vectors(embedded_uri)[ids[0]].shape == (32,)
+    assert migrator.status(embedded_uri)["staged"] == 3
+
+    assert migrator.cutover(embedded_uri) == {"switched": 3, "stale": 0}
+    vectors = _vectors(embedded_uri)
+    for note_id, text in zip(ids, TEXTS):
+        np.testing.assert_allclose(vectors[note_id], new.encode(text), rtol=1e-6)
+    with open_backend(embedded_uri) as backend:
+        assert active_model(backend) == "stub-v2"
+        assert backend.embedding_model_counts() == {"stub-v2": 3}
+
+    # The module-level brain follows the store, a pinned one refuses to mix models
+    np.testing.assert_allclose(brain.embed_text("budget", embedded_uri), new.encode("budget"), rtol=1e-6)
+    [stored] = get_brain_core().store_notes(["train the model"], embedded_uri)
+    assert _vectors(embedded_uri)[stored["noteId"]].shape == (48,)
+    with pytest.raises(ValueError):
+        BrainCore("stub").store_note("another note", embedded_uri)
+
+
+def test_cutover_refuses_pending_notes(embedded_uri, encoders):
+    core = BrainCore("stub")
+    ids = [r["noteId"] for r in core.store_notes(TEXTS, embedded_uri)]
+    migrator = EmbeddingMigrator("stub-v2")
+    migrator.migrate(embedded_uri, legacy_model="stub")
+
+    # Updating a note discards its staged vector, so it needs migrating again
+    core.update_notes([{"note_id": ids[0], "note": "roast the garlic"}], embedded_uri)
+    assert migrator.status(embedded_uri)["pending"] == 1
+    with pytest.raises(RuntimeError):
+        migrator.cutover(embedded_uri)
+
+    migrator.migrate(embedded_uri, legacy_model="stub")
+    migrator.cutover(embedded_uri)
+    np.testing.assert_allclose(_vectors(embedded_uri)[ids[0]], encoders[1].encode("roast the garlic"), rtol=1e-6)
+
+
+def test_brain_loads_no_model_until_it_embeds(embedded_uri, monkeypatch):
+    monkeypatch.setattr(brain, "_encoders", {})
+    core = get_brain_core()
+    assert core.get_all_notes(embedded_uri) == []
+    assert core.model is None and brain._encoders == {}
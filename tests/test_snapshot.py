@@ -0,0 +1,75 @@
+"""Snapshot export and import between backends."""
+
+import numpy as np
+import pytest
+
+from benchmarks.stubs import StubEncoder
+from brainlib.brain import BrainCore, active_model
+from brainlib.snapshot import export_snapshot, import_snapshot, read_manifest
+from brainlib.storage import open_backend
+
+NOTES = ["quarterly plan for the kiwi launch", "grocery list: apples, bread", "Café meeting notes"]
+
+
+def test_round_trip_keeps_notes_and_embeddings(db_uri, embedded_uri, core, tmp_path):
+    core.store_notes(NOTES, db_uri)
+    manifest = export_snapshot(str(tmp_path / "snap"), db_uri, batch_size=2)
+    assert manifest["dim"] == 32
+    assert read_manifest(str(tmp_path / "snap"))["dim"] == 32
+
+    assert import_snapshot(str(tmp_path / "snap"), embedded_uri)["inserted"] == len(NOTES)
+    # Importing again skips the notes that already exist
+    assert import_snapshot(str(tmp_path / "snap"), embedded_uri)["inserted"] == 0
+
+    originals = {note["_id"]: note for note in core.get_all_notes(db_uri)}
+    copies = {note["_id"]: note for note in core.get_all_notes(embedded_uri)}
+    assert set(copies) == set(originals)
+    for note_id, note in originals.items():
+        assert copies[note_id]["note"] == note["note"]
+        np.testing.assert_allclose(core.get_note_with_embedding(note_id, embedded_uri)["embedding"],
+                                   core.get_note_with_embedding(note_id, db_uri)["embedding"], rtol=1e-6)
+
+    # The keyword index is rebuilt after the bulk insert
+    assert [note["note"] for note in core.search("kiwi", 5, "lexical", embedded_uri)] == [NOTES[0]]
+
+
+def test_import_replaces_existing_notes_when_dropping(db_uri, embedded_uri, core, tmp_path):
+    core.store_notes(NOTES, embedded_uri)
+    export_snapshot(str(tmp_path / "snap"), embedded_uri)
+    core.store_note("note that is not in the snapshot", db_uri)
+
+    import_snapshot(str(tmp_path / "snap"), db_uri, drop_existing=True)
+    assert sorted(note["note"] for note in core.get_all_notes(db_uri)) == sorted(NOTES)
+    assert core.search("snapshot", 5, "lexical", db_uri) == []
+
+
+def test_import_rejects_mismatched_dimension(db_uri, embedded_uri, core, tmp_path):
+    core.store_notes(NOTES, embedded_uri)
+    export_snapshot(str(tmp_path / "snap"), embedded_uri)
+    BrainCore(model_name="stub", model=StubEncoder(dim=8)).store_note("small note", db_uri)
+
+    with pytest.raises(ValueError, match="dimensions"):
+        import_snapshot(str(tmp_path / "snap"), db_uri)
+    assert len(core.get_all_notes(db_uri)) == 1
+
+
+def test_import_rejects_mismatched_model(db_uri, embedded_uri, core, tmp_path):
+    core.store_notes(NOTES, embedded_uri)
+    export_snapshot(str(tmp_path / "snap"), embedded_uri)
+    BrainCore(model_name="other", model=StubEncoder(dim=32)).store_note("note from another model", db_uri)
+
+    with pytest.raises(ValueError, match="other"):
+        import_snapshot(str(tmp_path / "snap"), db_uri)
+    assert len(core.get_all_notes(db_uri)) == 1
+
+
+@pytest.mark.parametrize("drop_existing", [False, True])
+def test_import_into_empty_target_records_snapshot_model(db_uri, embedded_uri, core, tmp_path, drop_existing):
+    core.store_notes(NOTES, embedded_uri)
+    export_snapshot(str(tmp_path / "snap"), embedded_uri)
+    if drop_existing:
+        BrainCore(model_name="other", model=StubEncoder(dim=32)).store_note("note from another model", db_uri)
+
+    import_snapshot(str(tmp_path / "snap"), db_uri, drop_existing=drop_existing)
+    with open_backend(db_uri) as backend:
+        assert active_model(backend) == "stub"
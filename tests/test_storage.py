@@ -0,0 +1,25 @@
+"""Embedded store: vector rows stay consistent for readers across updates."""
+
+import numpy as np
+
+from brainlib.storage import open_backend
+
+
+def test_update_appends_rows_and_leaves_mapped_vectors_alone(embedded_uri, core):
+    ids = [r["noteId"] for r in core.store_notes(["roast the garlic", "bake the bread"], embedded_uri)]
+    with open_backend(embedded_uri) as backend:
+        mapped = backend._memmap(backend.VECTORS_FILE, "dim")
+        held = np.array(mapped)
+
+        core.update_notes([{"note_id": ids[0], "note": "simmer the tomato sauce"}], embedded_uri)
+
+        # A reader's existing map still sees the vectors it started with
+        np.testing.assert_array_equal(mapped, held)
+        row = backend.conn.execute("SELECT row FROM notes WHERE id = ?", (ids[0],)).fetchone()["row"]
+        assert row == 2 and backend._get_meta("rows") == 3
+
+    note = core.get_note_with_embedding(ids[0], embedded_uri)
+    np.testing.assert_allclose(note["embedding"], core.embed_text("simmer the tomato sauce"), rtol=1e-6)
+    results = core.search("tomato", mode="lexical", db_uri=embedded_uri)
+    assert [r["_id"] for r in results] == [ids[0]]
+    assert core.search("garlic", mode="lexical", db_uri=embedded_uri) == []
@@ -0,0 +1,46 @@
+"""Tenant isolation: each tenant sees only its own notes and indexes."""
+
+import pytest
+
+from brainlib.storage import open_backend
+from brainlib.dedup import build_duplicate_index
+
+
+@pytest.fixture
+def tenants(db_uri, core):
+    core.store_notes(["default note about rockets"], db_uri)
+    acme = core.store_notes(["acme rocket skates", "acme anvil"], db_uri, tenant="acme")
+    core.store_notes(["globex doomsday device"], db_uri, tenant="globex")
+    return {"acme": [result["noteId"] for result in acme]}
+
+
+def test_notes_are_listed_per_tenant(db_uri, core, tenants):
+    assert [note["note"] for note in core.get_all_notes(db_uri)] == ["default note about rockets"]
+    assert sorted(note["note"] for note in core.get_all_notes(db_uri, tenant="acme")) == ["acme anvil", "acme rocket skates"]
+    assert [note["note"] for note in core.get_all_notes(db_uri, tenant="globex")] == ["globex doomsday device"]
+    assert core.get_all_notes(db_uri, tenant="initech") == []
+
+
+@pytest.mark.parametrize("mode", ["lexical", "semantic", "hybrid"])
+def test_search_stays_within_tenant(db_uri, core, tenants, mode):
+    notes = [note["note"] for note in core.search("acme anvil", 5, mode, db_uri, tenant="globex")]
+    assert all(not note.startswith("acme") for note in notes)
+    notes = [note["note"] for note in core.search("acme anvil", 5, mode, db_uri, tenant="acme")]
+    assert notes[0] == "acme anvil"
+
+
+def test_duplicates_and_deletes_stay_within_tenant(db_uri, core, tenants):
+    with open_backend(db_uri, "acme") as backend:
+        build_duplicate_index(backend)
+    assert core.find_duplicates("acme anvil", 0.9, db_uri=db_uri, tenant="acme") != []
+    assert core.find_duplicates("acme anvil", 0.9, db_uri=db_uri, tenant="globex") == []
+
+    note_id = tenants["acme"][0]
+    assert core.delete_note(note_id, db_uri, tenant="globex") is False
+    assert core.delete_note(note_id, db_uri, tenant="acme") is True
+
+
+@pytest.mark.parametrize("tenant", ["Acme", "../acme", "a" * 49, "-acme"])
+def test_invalid_tenant_is_rejected(db_uri, core, tenant):
+    with pytest.raises(ValueError, match="Invalid tenant"):
+        core.get_all_notes(db_uri, tenant=tenant)